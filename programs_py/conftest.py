@@ -0,0 +1,2 @@
+# Puts programs_py on sys.path, so that the tests import lib, offchain and
+# seahorse as the program and the off-chain modules do.
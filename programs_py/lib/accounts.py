@@ -1,22 +1,22 @@
 # oamm
 # Built with Seahorse v0.2.5
 #
-# This file contains the public keys related to the SOL/USDC/USDT OAMM and is used for permission checks.
+# This file contains the public keys of the OAMM that are not derived from a pool and is used for permission checks.
+# The keys of each pool's accounts (config, token accounts and LP token mints) are recorded in the pool by create_pool.
+# The keys are Pubkey literals, which are decoded at compile time, so a check such as
+# owner.key() == OWNER is a 32-byte comparison and no account key is base58-encoded at runtime.
 
-def get_public_keys() -> Tuple[str,str,str,str,str,str,str,str,str,str,str,str]:
-    owner_pubkey='DzgBxedPKCuWbK4a4P9Bj4nNdayVzZEqc7n6YZ1A4sLa'
-    mint_usdc_pubkey='3AdmphpXt2Cnum2WZPB5mwqHHoSg8943YgYe5Z4Phk8u'
-    mint_usdt_pubkey='2fXzsHWhhcNqTbigYDKEYwv6k5aYNqSXHjLNv1RJdXy9'
-    pool_pubkey='GkTxPhwRzb8xocBJMew7iVUwq2dzeTm5dZ3GkWYqMHA'
-    pool_usdc_token_account_pubkey='4QTUMW3sScb8jmKAYbcbiWoCYi9nRyXAyub9cHAXNfUb'
-    pool_usdt_token_account_pubkey='D4d2Zcw6JeShSNSBVFPYWtUQ9HXG9cApsTvcrPiDxzUY'
-    pool_mint_lp_sol_pubkey='6hFQSgkGFkZiRC9joDybk9U6L2X1CJgvp6eKoxGdrbTz'
-    pool_mint_lp_usdc_pubkey='5oQPPFRw4LECv8VnMp5gm5Bep5wpbUy2iZ8JcQLRZ4gk'
-    pool_mint_lp_usdt_pubkey='51pkDvEgjRhZMb9VYihtJnjQLKj2uj3YJvLBb2ReJ6rQ'
-    fee_account_sol_pubkey = 'D6U9ms9icRKY1oFrN57v5cui5Y89cNUzCutw1keUH8CM'
-    fee_account_usdc_pubkey = '3v5mLWxqReiegzaLDm1TizpaTyaiEtvY4WPHAabvUNR4'
-    fee_account_usdt_pubkey = '2Bcashf4mF4m3ex7YtjiAYoniGpgAC5a1cnGYVwxqeNo'
-    return str(owner_pubkey), str(mint_usdc_pubkey), str(mint_usdt_pubkey), str(pool_pubkey), str(pool_usdc_token_account_pubkey), str(pool_usdt_token_account_pubkey), str(pool_mint_lp_sol_pubkey), str(pool_mint_lp_usdc_pubkey), str(pool_mint_lp_usdt_pubkey), str(fee_account_sol_pubkey), str(fee_account_usdc_pubkey), str(fee_account_usdt_pubkey)
+from seahorse.prelude import *
 
-# call this function as:
-# owner_pub_key, mint_usdc_pubkey, mint_usdt_pubkey, pool_pubkey, pool_usdc_token_account_pubkey, pool_usdt_token_account_pubkey, pool_mint_lp_sol, pool_mint_lp_usdc, pool_mint_lp_usdt, fee_account_sol, fee_account_usdc, fee_account_usdt = get_public_keys()
+OWNER=Pubkey('DzgBxedPKCuWbK4a4P9Bj4nNdayVzZEqc7n6YZ1A4sLa')
+# Native SOL is identified by the wrapped SOL mint.
+MINT_SOL=Pubkey('So11111111111111111111111111111111111111112')
+MINT_USDC=Pubkey('3AdmphpXt2Cnum2WZPB5mwqHHoSg8943YgYe5Z4Phk8u')
+MINT_USDT=Pubkey('2fXzsHWhhcNqTbigYDKEYwv6k5aYNqSXHjLNv1RJdXy9')
+FEE_ACCOUNT_SOL=Pubkey('D6U9ms9icRKY1oFrN57v5cui5Y89cNUzCutw1keUH8CM')
+FEE_ACCOUNT_USDC=Pubkey('3v5mLWxqReiegzaLDm1TizpaTyaiEtvY4WPHAabvUNR4')
+FEE_ACCOUNT_USDT=Pubkey('2Bcashf4mF4m3ex7YtjiAYoniGpgAC5a1cnGYVwxqeNo')
+# The Pyth price accounts of the feeds that retrieve_prices validates, for the instructions that
+# use the prices cached in the slot instead of reading them.
+PRICE_ACCOUNT_SOL=Pubkey('J83w4HKfqxwcq3BEMMkPFSppX3gqekLyLJBexebFVkix')
+PRICE_ACCOUNT_USDT=Pubkey('38xoQ4oeJCBrcVvca2cGk7iV1dAfrmTR1kmhSCJQ8Jto')
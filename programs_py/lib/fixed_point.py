@@ -0,0 +1,519 @@
+# oamm
+# Built with Seahorse v0.2.5
+#
+# Fixed-point implementation of the pool math in lib/math.py.
+#
+# Amounts, balances, LP token supplies, prices and the pool parameters (fee,
+# protocol fee, leverage, delta) are u128 with 9 decimal places (ONE), which is
+# also the native unit of the pool's tokens, so results can be transferred
+# without going through f64_to_u64_9_decimal_places. Weights, imbalance ratios,
+# exponents and powers are carried with 18 decimal places (WAD).
+#
+# The pool account is the one of f64 pools, so that the engine is a flag of the
+# pool's config: every instruction converts the balances, LP token supplies,
+# prices and parameters with to_fixed, which rounds to the nearest native unit,
+# and adds its results back in f64. Each update rounds by at most 2**-53 of the
+# value, so the account stays exact in native units as long as balances and LP
+# token supplies stay well below 2**52 native units (4.5e6 tokens with 9
+# decimals); beyond that, a native unit can be gained or lost at the boundary.
+# This is a deliberate limit of the engine, as is its cost: the series of
+# log_wad and exp_wad and the u128 divisions take more compute units than the
+# f64 formulas.
+#
+# Error bounds, measured with balances of 1 to 1e5 tokens, prices of 0.1 to
+# 1000, fees up to 5%, protocol fees of 0 to 1, leverage parameters of 1 to
+# 1000 and delta of 0.05 to 0.5, with 10% of the trades from a token without
+# balance:
+# - trade_i_fixed/trade_o_fixed amounts and protocol fees are within 16 native
+#   units or a relative error of 1e-9, whichever is larger, of the exact
+#   (50-digit) result of the trade formulas on the same 9-decimal inputs. The
+#   f64 engine is not the reference here: on small trades at high leverage,
+#   x**y-1 cancels and costs it up to 1e-2 of the amount;
+# - the execute_trade decision agrees with the f64 engine;
+# - single_asset_deposit_fixed agrees with the f64 engine to within 100 native
+#   units or a relative error of 1e-7, and single_asset_withdrawal_fixed pays
+#   out every token to within 100 native units of it or the value of 100
+#   native units of token o (the token of the LP tokens), whichever is larger,
+#   or a relative error of 1e-7: the remaining amount is carried in native
+#   units of token o, so it is coarser in a cheaper token.
+# tests/test_fixed_point.py checks these bounds on random pools over that range.
+# log_wad and exp_wad sum their series until a term truncates to zero, so they
+# are accurate to a few units of 1e-18. Intermediate products stay within u128,
+# so mul_div skips its long division, as long as the value of the pool is below
+# 1e11 USD and token balances are below 1e11 tokens. Results that do not fit
+# in a u128 assert, and trades that would need more than a u64 of a token are
+# rejected.
+
+from seahorse.prelude import *
+from lib.math import *
+
+ONE=u128(1000000000)
+WAD=u128(1000000000000000000)
+LN2_WAD=u128(693147180559945309)
+U128_MAX=u128(340282366920938463463374607431768211455)
+U64_MAX=u128(18446744073709551615)
+TWO64=u128(18446744073709551616)
+TWO127=u128(170141183460469231731687303715884105728)
+# exp_wad is defined below 60*ln(2) (LN2_WAD with 18 decimal places).
+EXP_WAD_MAX=u128(41588830833596718540)
+
+
+def to_fixed(x: f64) -> u128:
+  """Converts a non-negative f64 into a fixed-point number with 9 decimal places, rounding to
+  the nearest unit (floor(540.877402764*1e9) gives 540877402763)."""
+  return u128(floor(x*1000000000.0+0.5))
+
+
+def from_fixed(x: u128) -> f64:
+  """Converts a fixed-point number with 9 decimal places into an f64."""
+  return f64(x)/1000000000.0
+
+
+def zeros_u128() -> Array[u128,3]:
+  """Returns an array of N_TOKENS zeros."""
+  return array(u128(0),u128(0),u128(0))
+
+
+def ratio_order_fixed(imb_ratios: Array[u128,3]) -> Array[u8,3]:
+  """Fixed-point counterpart of ratio_order."""
+  order=token_indices()
+  for n in range(1,N_TOKENS):
+    k=order[n]
+    m=n
+    while m>0 and imb_ratios[order[m-1]]<imb_ratios[k]:
+      order[m]=order[m-1]
+      m-=1
+    order[m]=k
+  return order
+
+
+def to_fixed_array(x: Array[f64,3]) -> Array[u128,3]:
+  """Applies to_fixed to every coordinate of x."""
+  y=zeros_u128()
+  for j in range(N_TOKENS):
+    y[j]=to_fixed(x[j])
+  return y
+
+
+def mul_div(a: u128, b: u128, c: u128) -> u128:
+  """Returns floor(a*b/c), which must fit in a u128. If a*b does not, it is formed in two
+  halves and divided bit by bit, which is exact but costs a long division."""
+  if b==0 or a<=U128_MAX//b:
+    return a*b//c
+  # a*b=hi*2**128+lo, from the 64-bit halves of a and b.
+  a1=a//TWO64
+  a0=a%TWO64
+  b1=b//TWO64
+  b0=b%TWO64
+  p00=a0*b0
+  p01=a0*b1
+  p10=a1*b0
+  mid=p00//TWO64+p01%TWO64+p10%TWO64
+  lo=p00%TWO64+mid%TWO64*TWO64
+  hi=a1*b1+p01//TWO64+p10//TWO64+mid//TWO64
+  assert hi<c, "Fixed-point overflow."
+  # Long division of hi*2**128+lo by c, one bit of lo at a time, with r<c throughout (2*r is
+  # not formed, as it may not fit).
+  q=u128(0)
+  r=hi
+  for n in range(128):
+    bit=lo//TWO127
+    lo=lo%TWO127*2
+    q=q*2
+    if r>=c-r:
+      r=r-(c-r)+bit
+      q+=1
+    else:
+      r=2*r+bit
+      if r>=c:
+        r-=c
+        q+=1
+  return q
+
+
+def mul_div_up(a: u128, b: u128, c: u128) -> u128:
+  """Returns ceil(a*b/c) (see mul_div)."""
+  d=mul_div(a,b,c)
+  if mul_div(d,c,b)<a:
+    return d+1
+  return d
+
+
+def log_wad(x: u128) -> u128:
+  """Natural logarithm of x>=WAD, both with 18 decimal places."""
+  assert x>=WAD, "log_wad is only defined for x>=1."
+  # We write x=m*2^k with 1<=m<2.
+  m=x
+  k=u128(0)
+  while m>=2*WAD:
+    m=m//2
+    k+=1
+  # ln(m)=2*atanh(z) with z=(m-1)/(m+1)<=1/3.
+  z=(m-WAD)*WAD//(m+WAD)
+  z2=z*z//WAD
+  term=z
+  total=z
+  n=u128(1)
+  while term!=0:
+    term=term*z2//WAD
+    n+=2
+    total+=term//n
+  return k*LN2_WAD+2*total
+
+
+def exp_wad(t: u128) -> u128:
+  """Exponential of 0<=t<EXP_WAD_MAX, both with 18 decimal places."""
+  assert t<EXP_WAD_MAX, "exp_wad overflows a u128."
+  k=t//LN2_WAD
+  r=t-k*LN2_WAD
+  # Taylor series of e^r with 0<=r<ln(2).
+  term=WAD
+  total=WAD
+  n=u128(1)
+  while term!=0:
+    term=term*r//WAD//n
+    total+=term
+    n+=1
+  while k>0:
+    total=total*2
+    k-=1
+  return total
+
+
+def pow_wad(x: u128, y: u128) -> u128:
+  """Returns x**y for x>0 and y>=0, all with 18 decimal places. x**y must be below 2**60."""
+  if x==WAD or y==0:
+    return WAD
+  if x>WAD:
+    return exp_wad(mul_div(log_wad(x),y,WAD))
+  # x<1: x**y=1/((1/x)**y), which rounds down to 0 below 2**-60.
+  t=mul_div(log_wad(WAD*WAD//x),y,WAD)
+  if t>=EXP_WAD_MAX:
+    return u128(0)
+  return WAD*WAD//exp_wad(t)
+
+
+def cube_wad(x: u128) -> u128:
+  """Fixed-point counterpart of funct_adjust_fee and funct_adjust_leverage_parameter, exact to a
+  few units of 1e-18. Above a ratio of 18.4, x*x takes the long division of mul_div."""
+  return mul_div(mul_div(x,x,WAD),x,WAD)
+
+
+def pool_metrics_fixed(balances: Array[u128,3], LP_tokens_issued: Array[u128,3], prices: Array[u128,3]) -> Tuple[u128,u128,Array[u128,3],Array[u128,3]]:
+  """Returns B and L (9 decimal places) and the weights and imbalance ratios (18 decimal places).
+  The imbalance ratio of a token without LP tokens in circulation is 0 (-1.0 in lib.math); no
+  check in the pool passes with either value."""
+  B=u128(0)
+  L=u128(0)
+  for j in range(N_TOKENS):
+    price=prices[j]
+    B+=price*balances[j]//ONE
+    L+=price*LP_tokens_issued[j]//ONE
+  W=zeros_u128()
+  R=zeros_u128()
+  if B!=0:
+    for j in range(N_TOKENS):
+      balance=balances[j]
+      lptok=LP_tokens_issued[j]
+      W[j]=mul_div(prices[j]*balance//ONE,WAD,B)
+      if lptok!=0:
+        R[j]=mul_div(mul_div(balance,WAD,lptok),L,B)
+  return B,L,W,R
+
+
+def check_trade_imbalance_ratios_fixed(B: u128, L: u128, imb_ratios: Array[u128,3], balances: Array[u128,3], LP_tokens_issued: Array[u128,3], prices: Array[u128,3], i: u8, o: u8, ai: u128, ao: u128, pr_fee: u128, delta: u128) -> bool:
+  """Fixed-point counterpart of check_trade_imbalance_ratios. Rejects the trades that would leave
+  the pool without value or with a negative balance of token o, instead of underflowing."""
+  B_in=B+prices[i]*(ai-pr_fee)//ONE
+  value_out=prices[o]*ao//ONE
+  if value_out>=B_in:
+    return False
+  B_after=B_in-value_out
+  LP_i=LP_tokens_issued[i]
+  LP_o=LP_tokens_issued[o]
+  delta_wad=delta*(WAD//ONE)
+  if LP_o!=0:
+    if ao>balances[o]:
+      return False
+    ro_after=mul_div(mul_div(balances[o]-ao,WAD,LP_o),L,B_after)
+    if ro_after<WAD-delta_wad and ro_after<imb_ratios[o]:
+      return False
+  if LP_i!=0:
+    ri_after=mul_div(mul_div(balances[i]+ai-pr_fee,WAD,LP_i),L,B_after)
+    if ri_after>WAD+delta_wad and ri_after>imb_ratios[i]:
+      return False
+  return True
+
+
+def scaled_fee_and_leverage_fixed(imbalance: Array[u128,3], base_fee: u128, base_leverage_parameter: u128, i: u8, o: u8) -> Tuple[u128,u128]:
+  """Fixed-point counterpart of scaled_fee_and_leverage_from_ratios. Takes the base fee and
+  leverage parameter with 9 decimal places and returns the scaled ones with 18."""
+  fi=cube_wad(imbalance[i])
+  fo=cube_wad(imbalance[o])
+  scaled_fee=mul_div(base_fee*(WAD//ONE),fi,fo)
+  scaled_leverage=mul_div(base_leverage_parameter*(WAD//ONE),fo,fi)
+  return scaled_fee,scaled_leverage
+
+
+def trade_i_fixed(i: u8, o: u8, ai: u128, balances: Array[u128,3], LP_tokens_issued: Array[u128,3], prices: Array[u128,3], fee: u128, protocol_fee: u128, leverage: u128, delta: u128) -> Tuple[u128,u128,bool]:
+  """Fixed-point counterpart of trade_i. Returns the amount ao of token o that goes out of
+  the pool (rounded down), the protocol fee and whether the trade can be executed."""
+  if LP_tokens_issued[i]==0:
+    return u128(0),u128(0),False
+  if balances[o]==0:
+    return u128(0),u128(0),False
+  B,L,W,imb_ratios=pool_metrics_fixed(balances, LP_tokens_issued, prices)
+  bi=balances[i]
+  bo=balances[o]
+  if bi==0:
+    ao=mul_div((ONE-fee)*ai,prices[i],prices[o]*ONE)
+    if ao>=bo:
+      return u128(0),u128(0),False
+    pr_fee=mul_div(protocol_fee*fee,ai,ONE*ONE)
+    execute_trade=check_trade_imbalance_ratios_fixed(B,L,imb_ratios,balances,LP_tokens_issued,prices,i,o,ai,ao,pr_fee,delta)
+    return ao,pr_fee,execute_trade
+  # The trading fee and leverage parameter are carried with 18 decimal places.
+  trading_fee=fee*(WAD//ONE)
+  trading_leverage=leverage*(WAD//ONE)
+  if LP_tokens_issued[o]!=0:
+    if imb_ratios[o]<WAD-delta*(WAD//ONE):
+      return u128(0),u128(0),False
+    if imb_ratios[i]>WAD+delta*(WAD//ONE):
+      return u128(0),u128(0),False
+    trading_fee,trading_leverage=scaled_fee_and_leverage_fixed(imb_ratios,fee,leverage,i,o)
+  bil=mul_div(bi,trading_leverage,WAD)
+  bol=mul_div(bo,trading_leverage,WAD)
+  # The amount in after fees is kept with 9 extra decimal places.
+  base=mul_div(bil*ONE,WAD,bil*ONE+mul_div(WAD-trading_fee,ai,ONE))
+  power=pow_wad(base,mul_div(W[i],WAD,W[o]))
+  ao=mul_div(bol,WAD-power,WAD)
+  pr_fee=mul_div(protocol_fee*trading_fee//ONE,ai,WAD)
+  if LP_tokens_issued[o]!=0 and ao>=bo:
+    return u128(0),u128(0),False
+  execute_trade=check_trade_imbalance_ratios_fixed(B,L,imb_ratios,balances,LP_tokens_issued,prices,i,o,ai,ao,pr_fee,delta)
+  return ao,pr_fee,execute_trade
+
+
+def trade_o_fixed(i: u8, o: u8, ao: u128, balances: Array[u128,3], LP_tokens_issued: Array[u128,3], prices: Array[u128,3], fee: u128, protocol_fee: u128, leverage: u128, delta: u128) -> Tuple[u128,u128,bool]:
+  """Fixed-point counterpart of trade_o. Returns the amount ai of token i that goes into
+  the pool (rounded up), the protocol fee and whether the trade can be executed."""
+  if ao==0:
+    return u128(0),u128(0),False
+  if LP_tokens_issued[i]==0:
+    return u128(0),u128(0),False
+  bi=balances[i]
+  bo=balances[o]
+  if ao>=bo:
+    return u128(0),u128(0),False
+  B,L,W,imb_ratios=pool_metrics_fixed(balances, LP_tokens_issued, prices)
+  if bi==0:
+    ai=mul_div_up(mul_div_up(ao,prices[o],prices[i]),ONE,ONE-fee)
+    if ai>U64_MAX:
+      return u128(0),u128(0),False
+    pr_fee=mul_div(protocol_fee*fee,ai,ONE*ONE)
+    execute_trade=check_trade_imbalance_ratios_fixed(B,L,imb_ratios,balances,LP_tokens_issued,prices,i,o,ai,ao,pr_fee,delta)
+    return ai,pr_fee,execute_trade
+  # The trading fee and leverage parameter are carried with 18 decimal places.
+  trading_fee=fee*(WAD//ONE)
+  trading_leverage=leverage*(WAD//ONE)
+  if LP_tokens_issued[o]!=0:
+    if imb_ratios[o]<WAD-delta*(WAD//ONE):
+      return u128(0),u128(0),False
+    if imb_ratios[i]>WAD+delta*(WAD//ONE):
+      return u128(0),u128(0),False
+    trading_fee,trading_leverage=scaled_fee_and_leverage_fixed(imb_ratios,fee,leverage,i,o)
+  bil=mul_div(bi,trading_leverage,WAD)
+  bol=mul_div(bo,trading_leverage,WAD)
+  if ao>=bol:
+    return u128(0),u128(0),False
+  base=mul_div_up(bol,WAD,bol-ao)
+  t=mul_div(log_wad(base),mul_div_up(W[o],WAD,W[i]),WAD)
+  # The amount in is bil/(1-fee)*(base**(wo/wi)-1). A trade that needs more than a u64 of token i
+  # (the amounts transferred are u64) is rejected, before the power can leave the u128 range.
+  if t>=EXP_WAD_MAX:
+    return u128(0),u128(0),False
+  power=exp_wad(t)
+  bil_fee=mul_div_up(bil,WAD,WAD-trading_fee)
+  if bil_fee!=0 and power-WAD>mul_div(U64_MAX,WAD,bil_fee):
+    return u128(0),u128(0),False
+  ai=mul_div_up(bil_fee,power-WAD,WAD)
+  pr_fee=mul_div(protocol_fee*trading_fee//ONE,ai,WAD)
+  execute_trade=check_trade_imbalance_ratios_fixed(B,L,imb_ratios,balances,LP_tokens_issued,prices,i,o,ai,ao,pr_fee,delta)
+  return ai,pr_fee,execute_trade
+
+
+def single_asset_deposit_fixed(i: u8, ai: u128, balances: Array[u128,3], LP_tokens_issued: Array[u128,3], prices: Array[u128,3]) -> u128:
+  """Fixed-point counterpart of single_asset_deposit. Returns the amount of LP tokens of type i
+  (rounded down) that must be given to the liquidity provider."""
+  B,L,W,imb_ratios=pool_metrics_fixed(balances, LP_tokens_issued, prices)
+  if LP_tokens_issued[i]==0 or balances[i]==0:
+    if B==0:
+      return ai
+    return mul_div(ai,L,B)
+  return mul_div(mul_div(ai,LP_tokens_issued[i],balances[i]),imb_ratios[i],WAD)
+
+
+def single_asset_withdrawal_fixed(o: u8, lpt: u128, balances: Array[u128,3], LP_tokens_issued: Array[u128,3], prices: Array[u128,3], delta: u128) -> Tuple[Array[u128,3],u128,u128]:
+  """Fixed-point counterpart of single_asset_withdrawal, with all amounts rounded down.
+  Returns the amounts of each token given to the LP, the value given to the LP in terms of
+  token o and the remaining amount of token o that could not be given to the LP."""
+  balances_list=list(balances)
+  amounts_out=zeros_u128()
+  B,L,W,imb_ratios=pool_metrics_fixed(balances, LP_tokens_issued, prices)
+  delta_wad=delta*(WAD//ONE)
+  a_remaining=u128(0)
+  ao=u128(0)
+  bo=balances[o]
+  if bo==0:
+    ao=mul_div(lpt,B,L)
+    a_remaining=ao
+  else:
+    ro=imb_ratios[o]
+    Lo=LP_tokens_issued[o]
+    ao=mul_div(mul_div(lpt,bo,Lo),WAD,ro)
+    if lpt<Lo:
+      M1=u128(0)
+      if ro<=WAD-delta_wad:
+        M1=mul_div(lpt,bo,Lo)
+      else:
+        reserved=mul_div(mul_div(ONE-delta,Lo-lpt,ONE),B,L)
+        if bo>reserved:
+          M1=bo-reserved
+      if ao<=M1:
+        amounts_out[o]+=ao
+        return amounts_out,ao,a_remaining
+      balances_list[o]-=M1
+      amounts_out[o]+=M1
+      a_remaining=ao-M1
+    else:
+      ao=mul_div(bo,WAD,ro)
+      if ao<=bo:
+        amounts_out[o]+=ao
+        return amounts_out,ao,a_remaining
+      balances_list[o]=u128(0)
+      amounts_out[o]+=bo
+      a_remaining=ao-bo
+  # The withdrawal continues with the other tokens, from the largest imbalance ratio down, as
+  # in single_asset_withdrawal.
+  order=ratio_order_fixed(imb_ratios)
+  for n in range(N_TOKENS):
+    k=order[n]
+    if a_remaining!=0 and k!=o and imb_ratios[k]>WAD-delta_wad:
+      ak=mul_div(a_remaining,prices[o],prices[k])
+      reserved=mul_div(mul_div(ONE-delta,LP_tokens_issued[k],ONE),B,L)
+      Mk=u128(0)
+      if balances_list[k]>reserved:
+        Mk=balances_list[k]-reserved
+      if ak<=Mk:
+        balances_list[k]-=ak
+        amounts_out[k]+=ak
+        a_remaining=u128(0)
+      else:
+        balances_list[k]-=Mk
+        amounts_out[k]+=Mk
+        paid=mul_div_up(Mk,prices[k],prices[o])
+        if paid<a_remaining:
+          a_remaining-=paid
+        else:
+          a_remaining=u128(0)
+  k=order[0]
+  if a_remaining!=0:
+    ak=mul_div(a_remaining,prices[o],prices[k])
+    if ak<=balances_list[k]:
+      balances_list[k]-=ak
+      amounts_out[k]+=ak
+      a_remaining=u128(0)
+  return amounts_out,ao,a_remaining
+
+
+# The following functions run the math of a pool with the engine it was configured with and
+# return both the f64 amounts used to update the pool account and the native amounts (u64)
+# to transfer, so that fixed-point pools never convert their results through f64.
+
+def trade_i_amounts(fixed_point: bool, i: u8, o: u8, ai: f64, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3], fee: f64, protocol_fee: f64, leverage: f64, delta: f64) -> Tuple[f64,f64,bool,u64,u64,u64]:
+  """Returns ao, pr_fee, execute_trade and the native amounts in, protocol fee and out."""
+  if fixed_point:
+    n_in=to_fixed(ai)
+    n_out,n_pr_fee,execute_trade=trade_i_fixed(i,o,n_in,to_fixed_array(balances),to_fixed_array(LP_tokens_issued),to_fixed_array(prices),to_fixed(fee),to_fixed(protocol_fee),to_fixed(leverage),to_fixed(delta))
+    return from_fixed(n_out),from_fixed(n_pr_fee),execute_trade,u64(n_in),u64(n_pr_fee),u64(n_out)
+  ao,pr_fee,execute_trade=trade_i(i,o,ai,balances,LP_tokens_issued,prices,fee,protocol_fee,leverage,delta)
+  return ao,pr_fee,execute_trade,f64_to_u64_9_decimal_places(ai),f64_to_u64_9_decimal_places(pr_fee),f64_to_u64_9_decimal_places(ao)
+
+
+def trade_o_amounts(fixed_point: bool, i: u8, o: u8, ao: f64, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3], fee: f64, protocol_fee: f64, leverage: f64, delta: f64) -> Tuple[f64,f64,bool,u64,u64,u64]:
+  """Returns ai, pr_fee, execute_trade and the native amounts in, protocol fee and out."""
+  if fixed_point:
+    n_out=to_fixed(ao)
+    n_in,n_pr_fee,execute_trade=trade_o_fixed(i,o,n_out,to_fixed_array(balances),to_fixed_array(LP_tokens_issued),to_fixed_array(prices),to_fixed(fee),to_fixed(protocol_fee),to_fixed(leverage),to_fixed(delta))
+    return from_fixed(n_in),from_fixed(n_pr_fee),execute_trade,u64(n_in),u64(n_pr_fee),u64(n_out)
+  ai,pr_fee,execute_trade=trade_o(i,o,ao,balances,LP_tokens_issued,prices,fee,protocol_fee,leverage,delta)
+  # As in trade_o_fixed, a trade that needs more than a u64 of token i is rejected instead of
+  # saturating the conversion to native units.
+  if ai*1000000000.0>=18446744073709551615.0:
+    return 0.0,0.0,False,u64(0),u64(0),f64_to_u64_9_decimal_places(ao)
+  return ai,pr_fee,execute_trade,f64_to_u64_9_decimal_places(ai),f64_to_u64_9_decimal_places(pr_fee),f64_to_u64_9_decimal_places(ao)
+
+
+def swap_amounts(fixed_point: bool, i: u8, o: u8, amount: f64, exact_in: bool, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3], fee: f64, protocol_fee: f64, leverage: f64, delta: f64) -> Tuple[f64,f64,f64,bool,u64,u64,u64]:
+  """Returns ai, ao, pr_fee, execute_trade and the native amounts in, protocol fee and out of a trade
+  where amount is the amount of token i that goes in (exact_in) or of token o that goes out."""
+  if exact_in:
+    ao,pr_fee,execute_trade,n_in,n_pr_fee,n_out=trade_i_amounts(fixed_point,i,o,amount,balances,LP_tokens_issued,prices,fee,protocol_fee,leverage,delta)
+    return amount,ao,pr_fee,execute_trade,n_in,n_pr_fee,n_out
+  ai,pr_fee,execute_trade,n_in,n_pr_fee,n_out=trade_o_amounts(fixed_point,i,o,amount,balances,LP_tokens_issued,prices,fee,protocol_fee,leverage,delta)
+  return ai,amount,pr_fee,execute_trade,n_in,n_pr_fee,n_out
+
+
+def swap_quote(fixed_point: bool, i: u8, o: u8, amount: f64, exact_in: bool, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3], fee: f64, protocol_fee: f64, leverage: f64, delta: f64) -> Tuple[f64,f64,f64,f64,f64,f64,f64,bool]:
+  """Returns what a swap would do without doing it: the amounts in and out, the protocol fee, the
+  fee and leverage parameter applied to the trade, the imbalance ratios of tokens i and o after the
+  trade (before it if it cannot be executed, -1.0 without LP tokens of the token) and whether the
+  trade can be executed."""
+  ai,ao,pr_fee,execute_trade,n_in,n_pr_fee,n_out=swap_amounts(fixed_point,i,o,amount,exact_in,balances,LP_tokens_issued,prices,fee,protocol_fee,leverage,delta)
+  trading_fee=fee
+  trading_leverage=leverage
+  ri_after=-1.0
+  ro_after=-1.0
+  if LP_tokens_issued[i]!=0.0 and balances[o]!=0.0:
+    B,L,W,imb_ratios=pool_metrics(balances, LP_tokens_issued, prices)
+    trading_fee,trading_leverage=trading_fee_and_leverage(i,o,balances,LP_tokens_issued,imb_ratios,fee,leverage)
+    ri_after=imb_ratios[i]
+    ro_after=imb_ratios[o]
+    if execute_trade:
+      ri_after,ro_after=imbalance_ratios_after_trade(B,L,balances,LP_tokens_issued,prices,i,o,ai,ao,pr_fee)
+  return ai,ao,pr_fee,trading_fee,trading_leverage,ri_after,ro_after,execute_trade
+
+
+def single_asset_deposit_amounts(fixed_point: bool, i: u8, ai: f64, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3]) -> Tuple[f64,u64,u64]:
+  """Returns the amount of LP tokens and the native amounts deposited and minted."""
+  if fixed_point:
+    n_in=to_fixed(ai)
+    n_lpt=single_asset_deposit_fixed(i,n_in,to_fixed_array(balances),to_fixed_array(LP_tokens_issued),to_fixed_array(prices))
+    return from_fixed(n_lpt),u64(n_in),u64(n_lpt)
+  lpt,k=single_asset_deposit(i,ai,balances,LP_tokens_issued,prices)
+  return lpt,f64_to_u64_9_decimal_places(ai),f64_to_u64_9_decimal_places(lpt)
+
+
+def single_asset_withdrawal_amounts(fixed_point: bool, o: u8, lpt: f64, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3], delta: f64) -> Tuple[Array[f64,3],f64,Array[u64,3],u64]:
+  """Returns the amounts of each token given to the LP, the amount of LP tokens to burn and the
+  native amounts of each token and of LP tokens to burn."""
+  amounts=zeros()
+  n_amounts=zeros_u64()
+  if fixed_point:
+    n_lpt=to_fixed(lpt)
+    n_out,n_ao,n_remaining=single_asset_withdrawal_fixed(o,n_lpt,to_fixed_array(balances),to_fixed_array(LP_tokens_issued),to_fixed_array(prices),to_fixed(delta))
+    if n_ao==0:
+      # Nothing to withdraw (e.g. no LP tokens redeemed): nothing is paid out or burned.
+      return amounts,0.0,n_amounts,u64(0)
+    n_burn=mul_div_up(n_lpt,n_ao-n_remaining,n_ao)
+    for j in range(N_TOKENS):
+      amounts[j]=from_fixed(n_out[j])
+      n_amounts[j]=u64(n_out[j])
+    return amounts,from_fixed(n_burn),n_amounts,u64(n_burn)
+  amounts,ao,remaining=single_asset_withdrawal(o,lpt,balances,LP_tokens_issued,prices,delta)
+  if ao==0.0:
+    return zeros(),0.0,n_amounts,u64(0)
+  lpt_to_burn=lpt*(ao-remaining)/ao
+  for j in range(N_TOKENS):
+    n_amounts[j]=f64_to_u64_9_decimal_places(amounts[j])
+  return amounts,lpt_to_burn,n_amounts,f64_to_u64_9_decimal_places(lpt_to_burn)
@@ -0,0 +1,29 @@
+# oamm
+# Built with Seahorse v0.2.5
+#
+# Log levels for the program's print calls (msg! logs on-chain).
+#
+# The prints of the instructions and of lib/math.py are guarded by
+# `if log_enabled(LOG_SUMMARY):` or `if log_enabled(LOG_DEBUG):`. LOG_LEVEL is
+# a constant, so the compiler drops the guarded prints, together with the
+# formatting of their arguments, from builds that do not log at that level.
+# log_enabled reads LOG_LEVEL from this module, so that off-chain code changes
+# the level of every module by setting lib.log.LOG_LEVEL.
+# - LOG_OFF: no logs. Use for production pools.
+# - LOG_SUMMARY: one line per trade, deposit and withdrawal, and the reason an
+#   operation was rejected.
+# - LOG_DEBUG: also prices, effective prices, imbalance ratios, scaled fees and
+#   leverage, and every step of the withdrawal loop. This is the output the
+#   program always had, for devnet debugging.
+
+from seahorse.prelude import *
+
+LOG_OFF=u8(0)
+LOG_SUMMARY=u8(1)
+LOG_DEBUG=u8(2)
+
+LOG_LEVEL=LOG_DEBUG
+
+
+def log_enabled(level: u8) -> bool:
+  return LOG_LEVEL>=level
@@ -2,18 +2,53 @@
 # Built with Seahorse v0.2.5
 
 from seahorse.prelude import *
+from lib.fast_math import *
+from lib.log import *
+
+# Evaluate the powers of the trade formulas and the cubes of funct_adjust_fee and
+# funct_adjust_leverage_parameter with lib/fast_math.py instead of **. This changes
+# the prices of trades by a few ulps, so it is off by default: turning it on in a
+# build changes the pricing of the pools it runs.
+FAST_MATH=False
+
+# Number of tokens of the pool. Seahorse only accepts integer literals as array lengths, so the
+# Array annotations spell it out and arrays are created with zeros and zeros_u64; everything else
+# loops over range(N_TOKENS). A pool with more tokens changes these three places.
+N_TOKENS=3
+
+def zeros() -> Array[f64,3]:
+  """Returns an array of N_TOKENS zeros."""
+  return array(0.0,0.0,0.0)
+
+def zeros_u64() -> Array[u64,3]:
+  """Returns an array of N_TOKENS zeros, for native amounts."""
+  return array(u64(0),u64(0),u64(0))
+
+def token_indices() -> Array[u8,3]:
+  """Returns the indices of the N_TOKENS tokens, in order."""
+  return array(u8(0),u8(1),u8(2))
+
+def ratio_order(imb_ratios: Array[f64,3]) -> Array[u8,3]:
+  """Returns the indices of the tokens by decreasing imbalance ratio, ties in index order."""
+  order=token_indices()
+  for n in range(1,N_TOKENS):
+    k=order[n]
+    m=n
+    while m>0 and imb_ratios[order[m-1]]<imb_ratios[k]:
+      order[m]=order[m-1]
+      m-=1
+    order[m]=k
+  return order
 
 def weights(balances: Array[f64,3],prices: Array[f64,3]) -> Array[f64,3]:
   """Returns an array with the weights of the tokens with respect to the current prices."""
-  assert len(balances)==len(prices) , "Balance list and price list do not have the same length."
-  n=len(balances)
   B=0.0
-  W=array(0.0,0.0,0.0)
-  for j in range(n):
+  W=zeros()
+  for j in range(N_TOKENS):
     price=prices[j]
     balance=balances[j]
     B+=price*balance
-  for j in range(n):
+  for j in range(N_TOKENS):
     price=prices[j]
     balance=balances[j]
     W[j]=price*balance/B
@@ -22,12 +57,9 @@ def weights(balances: Array[f64,3],prices: Array[f64,3]) -> Array[f64,3]:
 
 def compute_B_and_L(balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3]) -> Tuple[f64,f64]:
   """Returns a tuple with the values of B and L"""
-  assert len(balances)==len(prices) , "Balance list and price list do not have the same length."
-  assert len(balances)==len(LP_tokens_issued) , "Balance list and list of amount of LP tokens issued do not have the same length."
-  n= len(balances)
   B=0.0
   L=0.0
-  for j in range(n):
+  for j in range(N_TOKENS):
     price=prices[j]
     balance=balances[j]
     lptok=LP_tokens_issued[j]
@@ -38,153 +70,203 @@ def compute_B_and_L(balances: Array[f64,3], LP_tokens_issued: Array[f64,3], pric
 
 def imbalance_ratios(balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3]) -> Array[f64,3]:
   """Returns a list with the imbalance ratios of the tokens."""
-  assert len(balances)==len(prices) , "Balance list and price list do not have the same length."
-  assert len(balances)==len(LP_tokens_issued) , "Balance list and list of amount of LP tokens issued do not have the same length."
-  n= len(balances)
-  W=array(0.0,0.0,0.0)
-  LP_tokens_list=list(LP_tokens_issued)
-  balances_list=list(balances)
-  LP_tokens_issued_copy=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-  B,L=compute_B_and_L(balances, LP_tokens_issued_copy, prices)
-  for j in range(n):
-    lptok=LP_tokens_list[j]
+  W=zeros()
+  B,L=compute_B_and_L(balances, LP_tokens_issued, prices)
+  for j in range(N_TOKENS):
+    lptok=LP_tokens_issued[j]
     if lptok != 0.0:
-      balance=balances_list[j]
+      balance=balances[j]
       W[j]=(balance*L)/(B*lptok)
     else:
       W[j]=-1.0
   return W
 
-def check_imbalance_ratios(balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3],i: u8,o: u8,ai:f64, ao:f64, pr_fee: f64, delta: f64) -> bool:
-  ### We check imbalance ratios
-  balances_list=list(balances)
-  LP_tokens_list=list(LP_tokens_issued)
-  prices_list=list(prices)
-  balances_before=array(balances_list[0],balances_list[1],balances_list[2])
-  LP_tokens_issued_before=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-  prices_before=array(prices[0],prices[1],prices[2])
-  bi=balances_list[i]
-  balances_list[i]=bi+ai-pr_fee
-  bo=balances_list[o]
-  balances_list[o]=bo-ao
-  balances_after=array(balances_list[0],balances_list[1],balances_list[2])
-  LP_tokens_issued_after=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-  prices_after=array(prices[0],prices[1],prices[2])
-  imb_ratios_before_trade_array=imbalance_ratios(balances_before, LP_tokens_issued_before, prices_before)
-  imb_ratios_before=list(imb_ratios_before_trade_array)
-  imb_ratios_after_trade_array=imbalance_ratios(balances_after, LP_tokens_issued_after, prices_after)
-  imb_ratios_after=list(imb_ratios_after_trade_array)
-  print(f'Imbalance ratios after trade: {imb_ratios_after}')
-  #print(f'{imb_ratios_after[o]<1.0-delta} {imb_ratios_after[o]<imb_ratios_before[o]} {imb_ratios_after[i]>1.0+delta} {imb_ratios_after[i]>imb_ratios_before[i]}')
-  if (imb_ratios_after[o]<1.0-delta and imb_ratios_after[o]<imb_ratios_before[o]) or (imb_ratios_after[i]>1.0+delta and imb_ratios_after[i]>imb_ratios_before[i]):
-    execute_trade=False
+def pool_metrics(balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3]) -> Tuple[f64,f64,Array[f64,3],Array[f64,3]]:
+  """Returns B, L, the weights and the imbalance ratios of the tokens in a single pass.
+  If B is zero (empty pool) the weights and imbalance ratios are left at 0.0."""
+  B=0.0
+  L=0.0
+  for j in range(N_TOKENS):
+    price=prices[j]
+    B+=price*balances[j]
+    L+=price*LP_tokens_issued[j]
+  W=zeros()
+  R=zeros()
+  if B!=0.0:
+    for j in range(N_TOKENS):
+      balance=balances[j]
+      lptok=LP_tokens_issued[j]
+      W[j]=prices[j]*balance/B
+      if lptok != 0.0:
+        R[j]=(balance*L)/(B*lptok)
+      else:
+        R[j]=-1.0
+  return B,L,W,R
+
+
+def imbalance_ratios_after_trade(B: f64, L: f64, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3], i: u8, o: u8, ai: f64, ao: f64, pr_fee: f64) -> Tuple[f64,f64]:
+  """Returns the imbalance ratios of tokens i and o after a trade, derived in O(1) from the
+  values of B and L before the trade (L does not change with a trade)."""
+  bi_after=balances[i]+ai-pr_fee
+  bo_after=balances[o]-ao
+  B_after=B+prices[i]*(ai-pr_fee)-prices[o]*ao
+  LP_i=LP_tokens_issued[i]
+  LP_o=LP_tokens_issued[o]
+  ri=-1.0
+  ro=-1.0
+  if LP_i != 0.0:
+    ri=(bi_after*L)/(B_after*LP_i)
+  if LP_o != 0.0:
+    ro=(bo_after*L)/(B_after*LP_o)
+  return ri,ro
+
+
+def check_trade_imbalance_ratios(B: f64, L: f64, imb_ratios: Array[f64,3], balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3],i: u8,o: u8,ai:f64, ao:f64, pr_fee: f64, delta: f64) -> bool:
+  """Same check as check_imbalance_ratios, using the pool metrics computed before the trade."""
+  ri_after,ro_after=imbalance_ratios_after_trade(B, L, balances, LP_tokens_issued, prices, i, o, ai, ao, pr_fee)
+  if log_enabled(LOG_DEBUG):
+    print(f'Imbalance ratios after trade: {ri_after} (token {i}), {ro_after} (token {o})')
+  if (ro_after<1.0-delta and ro_after<imb_ratios[o]) or (ri_after>1.0+delta and ri_after>imb_ratios[i]):
     return False
   return True
 
 
+def check_imbalance_ratios(balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3],i: u8,o: u8,ai:f64, ao:f64, pr_fee: f64, delta: f64) -> bool:
+  ### We check imbalance ratios
+  B,L,W,imb_ratios_before=pool_metrics(balances, LP_tokens_issued, prices)
+  return check_trade_imbalance_ratios(B, L, imb_ratios_before, balances, LP_tokens_issued, prices, i, o, ai, ao, pr_fee, delta)
+
+
+def pow_f64(x: f64, y: f64) -> f64:
+    """Returns x**y, with pow_fast if FAST_MATH is set."""
+    if FAST_MATH:
+        return pow_fast(x,y)
+    return x**y
+
 def funct_adjust_leverage_parameter(x: f64) -> f64:
     """Base function that adjusts the leverage parameter."""
+    if FAST_MATH:
+        return cube(x)
     return x**3.0
 
 def funct_adjust_fee(x: f64) -> f64:
     """Base function that adjusts the fee."""
+    if FAST_MATH:
+        return cube(x)
     return x**3.0
 
-def scaled_fee_and_leverage(balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3], base_fee: f64, base_leverage_parameter: f64, i: u8, o: u8) -> Tuple[f64,f64]:
+def scaled_fee_and_leverage_from_ratios(imbalance: Array[f64,3], base_fee: f64, base_leverage_parameter: f64, i: u8, o: u8) -> Tuple[f64,f64]:
     """Returns the scaled fee and leverage parameter for a trade where token i goes into the pool and
-    token o goes out of the pool."""
-    imbalance=imbalance_ratios(balances, LP_tokens_issued, prices)
-    print(f'Imbalance: {imbalance}')
+    token o goes out of the pool, given the current imbalance ratios."""
+    if log_enabled(LOG_DEBUG):
+        print(f'Imbalance: {imbalance}')
     scaled_fee=funct_adjust_fee(imbalance[i])/funct_adjust_fee(imbalance[o])*base_fee
     scaled_leverage=funct_adjust_leverage_parameter(imbalance[o])/funct_adjust_leverage_parameter(imbalance[i])*base_leverage_parameter
     return scaled_fee,scaled_leverage
 
+def scaled_fee_and_leverage(balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3], base_fee: f64, base_leverage_parameter: f64, i: u8, o: u8) -> Tuple[f64,f64]:
+    """Returns the scaled fee and leverage parameter for a trade where token i goes into the pool and
+    token o goes out of the pool."""
+    imbalance=imbalance_ratios(balances, LP_tokens_issued, prices)
+    return scaled_fee_and_leverage_from_ratios(imbalance, base_fee, base_leverage_parameter, i, o)
+
+def trading_fee_and_leverage(i: u8, o: u8, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], imb_ratios: Array[f64,3], base_fee: f64, base_leverage_parameter: f64) -> Tuple[f64,f64]:
+    """Returns the fee and leverage parameter that trade_i and trade_o apply to a trade of token i
+    for token o: scaled if token i has a balance and LP tokens of o are in circulation, the base
+    values otherwise."""
+    if balances[i]!=0.0 and LP_tokens_issued[o]!=0.0:
+        return scaled_fee_and_leverage_from_ratios(imb_ratios,base_fee,base_leverage_parameter,i,o)
+    return base_fee,base_leverage_parameter
+
 
 
 def trade_i(i: u8,o: u8,ai: f64, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3],fee: f64,protocol_fee: f64,leverage: f64,delta: f64) -> Tuple[f64,f64,bool]:
     """Performs a trade where an amount ai of token i goes into the pool
     and token o goes out of the pool. Returns the amount ao of token o that goes
     out of the pool."""
-    LP_tokens_list=list(LP_tokens_issued)
-    balances_list=list(balances)
     # We check conditions first.
-    if LP_tokens_list[i]==0.0:
-        print(f'Trade not allowed. No LP tokens {i} in circulation.')
+    if LP_tokens_issued[i]==0.0:
+        if log_enabled(LOG_SUMMARY):
+            print(f'Trade not allowed. No LP tokens {i} in circulation.')
         return 0.0,0.0,False
-    if balances_list[o]==0.0:
-        print(f"The trade can't be performed. No token {o} in the pool.")
+    if balances[o]==0.0:
+        if log_enabled(LOG_SUMMARY):
+            print(f"The trade can't be performed. No token {o} in the pool.")
         return 0.0,0.0,False
-    ## First we update the weights
-    prices_copy_1=array(prices[0],prices[1],prices[2])
-    balances_copy_1=array(balances[0],balances[1],balances[2])
-    price_list=list(prices)
-    W=weights(balances_copy_1, prices_copy_1)
+    ## First we compute the weights and imbalance ratios
+    B,L,W,imb_ratios=pool_metrics(balances, LP_tokens_issued, prices)
     # We divide into different cases
-    if balances_list[i]==0.0:
-        ao=(1.0-fee)*ai*price_list[i]/price_list[o]
+    if balances[i]==0.0:
+        ao=(1.0-fee)*ai*prices[i]/prices[o]
+        if ao>=balances[o]:
+            if log_enabled(LOG_SUMMARY):
+                print(f"Not enough balance of token {o}")
+            return 0.0,0.0,False
         pr_fee=protocol_fee*fee*ai
-        print(f"--- Trade --- in: {i} --- out: {o}")
-        print(f"Price list: {price_list}.")
-        print(f"in: {ai} {i} --- out: {ao} {o}")
-        print(f"Effective price: {(1.0-fee)*ai/ao} {i}/{o} --- {ao/((1.0-fee)*ai)} {o}/{i}")
-        balances_copy_4=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_4=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_4=array(prices[0],prices[1],prices[2])
-        execute_trade=check_imbalance_ratios(balances_copy_4, LP_tokens_issued_copy_4, prices_copy_4,i,o,ai,ao, pr_fee, delta)
+        if log_enabled(LOG_DEBUG):
+            print(f"--- Trade --- in: {i} --- out: {o}")
+            print(f"Price list: {prices}.")
+        if log_enabled(LOG_SUMMARY):
+            print(f"in: {ai} {i} --- out: {ao} {o}")
+        if log_enabled(LOG_DEBUG):
+            print(f"Effective price: {(1.0-fee)*ai/ao} {i}/{o} --- {ao/((1.0-fee)*ai)} {o}/{i}")
+        execute_trade=check_trade_imbalance_ratios(B,L,imb_ratios,balances,LP_tokens_issued,prices,i,o,ai,ao,pr_fee,delta)
         return ao,pr_fee,execute_trade
-    if LP_tokens_list[o]==0.0 and balances_list[i]!=0.0: # Self.balances[i]!=0 is not needed here, but added anyway just in case
-        bi1=balances_list[i]
+    if LP_tokens_issued[o]==0.0 and balances[i]!=0.0: # Self.balances[i]!=0 is not needed here, but added anyway just in case
+        bi1=balances[i]
         bi=bi1*leverage
         wi=W[i]
-        bo1=balances_list[o]
+        bo1=balances[o]
         bo=bo1*leverage
         wo=W[o]
-        ao=bo*(1.0-(bi/(bi+(1.0-fee)*ai))**(wi/wo))
+        ao=bo*(1.0-pow_f64(bi/(bi+(1.0-fee)*ai),wi/wo))
         pr_fee=protocol_fee*fee*ai
-        print(f"--- Trade --- in: {i} --- out: {o}")
-        print(f"Price list: {price_list}.")
-        print(f"in: {ai} {i} --- out: {ao} {o}")
-        print(f"Effective price: {(1.0-fee)*ai/ao} {i}/{o} --- {ao/((1.0-fee)*ai)} {o}/{i}")
-        balances_copy_6=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_6=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_6=array(prices[0],prices[1],prices[2])
-        execute_trade=check_imbalance_ratios(balances_copy_6, LP_tokens_issued_copy_6, prices_copy_6,i,o,ai,ao, pr_fee, delta)
+        if log_enabled(LOG_DEBUG):
+            print(f"--- Trade --- in: {i} --- out: {o}")
+            print(f"Price list: {prices}.")
+        if log_enabled(LOG_SUMMARY):
+            print(f"in: {ai} {i} --- out: {ao} {o}")
+        if log_enabled(LOG_DEBUG):
+            print(f"Effective price: {(1.0-fee)*ai/ao} {i}/{o} --- {ao/((1.0-fee)*ai)} {o}/{i}")
+        execute_trade=check_trade_imbalance_ratios(B,L,imb_ratios,balances,LP_tokens_issued,prices,i,o,ai,ao,pr_fee,delta)
         return ao,pr_fee,execute_trade
-    if LP_tokens_list[o]!=0.0 and balances_list[i]!=0.0: # Self.balances[i]!=0 is not needed here, but added anyway just in case
+    if LP_tokens_issued[o]!=0.0 and balances[i]!=0.0: # Self.balances[i]!=0 is not needed here, but added anyway just in case
         ## We check imbalance ratio of token o
-        prices_copy_2=array(prices[0],prices[1],prices[2])
-        balances_copy_2=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_2=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        imb_ratios_initial=imbalance_ratios(balances_copy_2, LP_tokens_issued_copy_2, prices_copy_2)
-        if imb_ratios_initial[o]<1.0-delta:
-            print(f'Imbalance ratio of Token {o} too low.')
+        if imb_ratios[o]<1.0-delta:
+            if log_enabled(LOG_SUMMARY):
+                print(f'Imbalance ratio of Token {o} too low.')
+            return 0.0,0.0,False
+        ## Every trade raises the imbalance ratio of token i, so none is allowed above 1+delta.
+        ## This also rejects trades too small to move the ratio in f64 (ai=0 included), which
+        ## check_trade_imbalance_ratios would let through: there is nothing to execute, as intended.
+        if imb_ratios[i]>1.0+delta:
+            if log_enabled(LOG_SUMMARY):
+                print(f'Imbalance ratio of Token {i} too high.')
             return 0.0,0.0,False
         ## Now we update the fees and the leverage parameter
-        prices_copy_3=array(prices[0],prices[1],prices[2])
-        balances_copy_3=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_3=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        trading_fee,leverage=scaled_fee_and_leverage(balances_copy_3, LP_tokens_issued_copy_3, prices_copy_3,fee,leverage,i,o)
+        trading_fee,leverage=scaled_fee_and_leverage_from_ratios(imb_ratios,fee,leverage,i,o)
         ## Now we perform the trade
-        bi1=balances_list[i]
+        bi1=balances[i]
         bi=bi1*leverage
         wi=W[i]
-        bo1=balances_list[o]
+        bo1=balances[o]
         bo=bo1*leverage
         wo=W[o]
-        ao=bo*(1.0-(bi/(bi+(1.0-trading_fee)*ai))**(wi/wo))
+        ao=bo*(1.0-pow_f64(bi/(bi+(1.0-trading_fee)*ai),wi/wo))
         pr_fee=protocol_fee*trading_fee*ai
-        if ao>=balances_list[o]:
+        if ao>=balances[o]:
             # We check if there is enough balance of token o.
-            print(f"Not enough balance of token {o}.")
+            if log_enabled(LOG_SUMMARY):
+                print(f"Not enough balance of token {o}.")
             return 0.0,0.0,False
-        balances_copy_5=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_5=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_5=array(prices[0],prices[1],prices[2])
-        execute_trade=check_imbalance_ratios(balances_copy_5, LP_tokens_issued_copy_5, prices_copy_5,i,o,ai,ao, pr_fee, delta)
-        print(f"--- Trade --- in: {i} --- out: {o}")
-        print(f"Price list: {price_list}.")
-        print(f"in: {ai} {i} --- out: {ao} {o}")
-        print(f"Effective price: {(1.0-fee)*ai/ao} {i}/{o} --- {ao/((1.0-fee)*ai)} {o}/{i}")
+        execute_trade=check_trade_imbalance_ratios(B,L,imb_ratios,balances,LP_tokens_issued,prices,i,o,ai,ao,pr_fee,delta)
+        if log_enabled(LOG_DEBUG):
+            print(f"--- Trade --- in: {i} --- out: {o}")
+            print(f"Price list: {prices}.")
+        if log_enabled(LOG_SUMMARY):
+            print(f"in: {ai} {i} --- out: {ao} {o}")
+        if log_enabled(LOG_DEBUG):
+            print(f"Effective price: {(1.0-fee)*ai/ao} {i}/{o} --- {ao/((1.0-fee)*ai)} {o}/{i}")
         return ao,pr_fee,execute_trade
     return 0.0,0.0,False
 
@@ -196,165 +278,280 @@ def trade_o(i: u8,o: u8,ao: f64, balances: Array[f64,3], LP_tokens_issued: Array
     and token i goes into the pool. Returns the amount ai of token i that goes
     into the pool."""
     if ao<=0.0:
-        print(f"Invalid amount of token {o}")
+        if log_enabled(LOG_SUMMARY):
+            print(f"Invalid amount of token {o}")
         return 0.0,0.0,False
     # We check conditions first.
-    LP_tokens_list=list(LP_tokens_issued)
-    balances_list=list(balances)
-    if LP_tokens_list[i]==0.0:
-        print(f'Trade not allowed. No LP {i} tokens in circulation.')
+    if LP_tokens_issued[i]==0.0:
+        if log_enabled(LOG_SUMMARY):
+            print(f'Trade not allowed. No LP {i} tokens in circulation.')
         return 0.0,0.0,False
-    if ao>=balances_list[o]:
+    if ao>=balances[o]:
         # We check if there is enough balance of token o.
         # This also prevents the balance of token 0 from being zero.
-        print(f"Not enough balance of token {o}")
+        if log_enabled(LOG_SUMMARY):
+            print(f"Not enough balance of token {o}")
         return 0.0,0.0,False
-    # First we update the weights
-    prices_copy_1=array(prices[0],prices[1],prices[2])
-    balances_copy_1=array(balances[0],balances[1],balances[2])
-    price_list=list(prices)
-    W=weights(balances_copy_1, prices_copy_1)
+    # First we compute the weights and imbalance ratios
+    B,L,W,imb_ratios=pool_metrics(balances, LP_tokens_issued, prices)
     # We divide into different cases
-    if balances_list[i]==0.0:
-        ai=ao*price_list[o]/price_list[i]/(1.0-fee)
+    if balances[i]==0.0:
+        ai=ao*prices[o]/prices[i]/(1.0-fee)
         pr_fee=protocol_fee*fee*ai
-        print(f"--- Trade --- in: {i} --- out: {o}")
-        print(f"Price list: {price_list}.")
-        print(f"in: {ai} {i} --- out: {ao} {o}")
-        print(f"Effective price: {(1.0-fee)*ai/ao} {i}/{o} --- {ao/((1.0-fee)*ai)} {o}/{i}")
-        balances_copy_4=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_4=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_4=array(prices[0],prices[1],prices[2])
-        execute_trade=check_imbalance_ratios(balances_copy_4, LP_tokens_issued_copy_4, prices_copy_4,i,o,ai,ao, pr_fee, delta)
+        if log_enabled(LOG_DEBUG):
+            print(f"--- Trade --- in: {i} --- out: {o}")
+            print(f"Price list: {prices}.")
+        if log_enabled(LOG_SUMMARY):
+            print(f"in: {ai} {i} --- out: {ao} {o}")
+        if log_enabled(LOG_DEBUG):
+            print(f"Effective price: {(1.0-fee)*ai/ao} {i}/{o} --- {ao/((1.0-fee)*ai)} {o}/{i}")
+        execute_trade=check_trade_imbalance_ratios(B,L,imb_ratios,balances,LP_tokens_issued,prices,i,o,ai,ao,pr_fee,delta)
         return ai,pr_fee,execute_trade
-    if LP_tokens_list[o]==0.0 and balances_list[i]!=0.0: # Self.balances[i]!=0 is not needed here, but added anyway just in case
-        bi1=balances_list[i]
+    if LP_tokens_issued[o]==0.0 and balances[i]!=0.0: # Self.balances[i]!=0 is not needed here, but added anyway just in case
+        bi1=balances[i]
         bi=bi1*leverage
         wi=W[i]
-        bo1=balances_list[o]
+        bo1=balances[o]
         bo=bo1*leverage
         wo=W[o]
-        ai=bi/(1.0-fee)*((bo/(bo-ao))**(wo/wi)-1.0)
+        if ao>=bo:
+            # The curve cannot pay out the leveraged balance of token o (leverage below 1).
+            if log_enabled(LOG_SUMMARY):
+                print(f"Not enough balance of token {o}")
+            return 0.0,0.0,False
+        ai=bi/(1.0-fee)*(pow_f64(bo/(bo-ao),wo/wi)-1.0)
         pr_fee=protocol_fee*fee*ai
-        print(f"--- Trade --- in: {i} --- out: {o}")
-        print(f"Price list: {price_list}.")
-        print(f"in: {ai} {i} --- out: {ao} {o}")
-        print(f"Effective price: {(1.0-fee)*ai/ao} {i}/{o} --- {ao/((1.0-fee)*ai)} {o}/{i}")
-        balances_copy_5=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_5=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_5=array(prices[0],prices[1],prices[2])
-        execute_trade=check_imbalance_ratios(balances_copy_5, LP_tokens_issued_copy_5, prices_copy_5,i,o,ai,ao, pr_fee, delta)
+        if log_enabled(LOG_DEBUG):
+            print(f"--- Trade --- in: {i} --- out: {o}")
+            print(f"Price list: {prices}.")
+        if log_enabled(LOG_SUMMARY):
+            print(f"in: {ai} {i} --- out: {ao} {o}")
+        if log_enabled(LOG_DEBUG):
+            print(f"Effective price: {(1.0-fee)*ai/ao} {i}/{o} --- {ao/((1.0-fee)*ai)} {o}/{i}")
+        execute_trade=check_trade_imbalance_ratios(B,L,imb_ratios,balances,LP_tokens_issued,prices,i,o,ai,ao,pr_fee,delta)
         return ai,pr_fee,execute_trade
 
-    if LP_tokens_list[o]!=0.0 and balances_list[i]!=0.0: # Self.balances[i]!=0 is not needed here, but added anyway just in case
+    if LP_tokens_issued[o]!=0.0 and balances[i]!=0.0: # Self.balances[i]!=0 is not needed here, but added anyway just in case
         # We check imbalance ratio of token o
-        balances_copy_2=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_2=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_2=array(prices[0],prices[1],prices[2])
-        imb_ratios_initial=imbalance_ratios(balances_copy_2, LP_tokens_issued_copy_2, prices_copy_2)
-        if imb_ratios_initial[o]<1.0-delta:
-            print(f'Imbalance ratio of {o} too low.')
+        if imb_ratios[o]<1.0-delta:
+            if log_enabled(LOG_SUMMARY):
+                print(f'Imbalance ratio of {o} too low.')
+            return 0.0,0.0,False
+        # Every trade raises the imbalance ratio of token i, so none is allowed above 1+delta.
+        # This also rejects trades too small to move the ratio in f64 (ao=0 included), which
+        # check_trade_imbalance_ratios would let through: there is nothing to execute, as intended.
+        if imb_ratios[i]>1.0+delta:
+            if log_enabled(LOG_SUMMARY):
+                print(f'Imbalance ratio of {i} too high.')
             return 0.0,0.0,False
 
         # Now we update the fees and the leverage parameter
-        balances_copy_3=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_3=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_3=array(prices[0],prices[1],prices[2])
-        trading_fee,leverage=scaled_fee_and_leverage(balances_copy_3, LP_tokens_issued_copy_3, prices_copy_3,fee,leverage,i,o)
+        trading_fee,leverage=scaled_fee_and_leverage_from_ratios(imb_ratios,fee,leverage,i,o)
         # Now we perform the trade
-        bi1=balances_list[i]
+        bi1=balances[i]
         bi=bi1*leverage
         wi=W[i]
-        bo1=balances_list[o]
+        bo1=balances[o]
         bo=bo1*leverage
         wo=W[o]
-        ai=bi/(1.0-trading_fee)*((bo/(bo-ao))**(wo/wi)-1.0)
+        if ao>=bo:
+            # The curve cannot pay out the leveraged balance of token o (leverage below 1).
+            if log_enabled(LOG_SUMMARY):
+                print(f"Not enough balance of token {o}")
+            return 0.0,0.0,False
+        ai=bi/(1.0-trading_fee)*(pow_f64(bo/(bo-ao),wo/wi)-1.0)
         pr_fee=protocol_fee*trading_fee*ai
         # We check imbalance ratios
-        balances_copy_6=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_6=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_6=array(prices[0],prices[1],prices[2])
-        execute_trade=check_imbalance_ratios(balances_copy_6, LP_tokens_issued_copy_6, prices_copy_6,i,o,ai,ao, pr_fee, delta)
-        print(f"--- Trade --- in: {i} --- out: {o}")
-        print(f"Price list: {price_list}.")
-        print(f"Leverage parameter: {leverage} --- Fee: {trading_fee} %")
-        print(f"in: {ai} {i} --- out: {ao} {o}")
-        print(f"Effective price: {(1.0-trading_fee)*ai/ao} {i}/{o} --- {ao/((1.0-trading_fee)*ai)} {o}/{i}")
+        execute_trade=check_trade_imbalance_ratios(B,L,imb_ratios,balances,LP_tokens_issued,prices,i,o,ai,ao,pr_fee,delta)
+        if log_enabled(LOG_DEBUG):
+            print(f"--- Trade --- in: {i} --- out: {o}")
+            print(f"Price list: {prices}.")
+            print(f"Leverage parameter: {leverage} --- Fee: {trading_fee} %")
+        if log_enabled(LOG_SUMMARY):
+            print(f"in: {ai} {i} --- out: {ao} {o}")
+        if log_enabled(LOG_DEBUG):
+            print(f"Effective price: {(1.0-trading_fee)*ai/ao} {i}/{o} --- {ao/((1.0-trading_fee)*ai)} {o}/{i}")
         return ai,pr_fee,execute_trade
     return 0.0,0.0,False
 
 
+# Newton steps of max_amount_in after the closed-form first guess.
+MAX_TRADE_NEWTON_STEPS=8
+
+def trade_curve(a: f64, linear: bool, slope: f64, bil: f64, bol: f64, e: f64, q: f64) -> Tuple[f64,f64]:
+    """Returns the amount out of a trade with amount in a and its derivative with respect to a:
+    slope*a if linear, else bol*(1-(bil/(bil+q*a))**e), with q one minus the trading fee."""
+    if linear:
+        return slope*a,slope
+    r=bil/(bil+q*a)
+    re=pow_f64(r,e)
+    return bol*(1.0-re),bol*e*q*re*r/bil
+
+def trade_curve_inverse(ao: f64, linear: bool, slope: f64, bil: f64, bol: f64, e: f64, q: f64) -> f64:
+    """Returns the amount in of a trade with amount out ao on the same curve, as in trade_o."""
+    if linear:
+        return ao/slope
+    return bil/q*(pow_f64(bol/(bol-ao),1.0/e)-1.0)
+
+def max_amount_in(F0: f64, u: f64, v: f64, linear: bool, slope: f64, bil: f64, bol: f64, e: f64, q: f64) -> f64:
+    """Returns the largest a>=0 with F0-u*g(a)-v*a>=0, where g is the trade curve and u>=0,
+    or -1.0 if there is no such bound.
+    The function is convex in a, so the root of its tangent at 0 (closed form, exact on a linear
+    curve) is below the bound, and Newton steps from there increase towards it without passing it."""
+    if F0<=0.0:
+        return 0.0
+    s=u*slope+v
+    if s<=0.0:
+        return -1.0
+    a=F0/s
+    if linear:
+        return a
+    n=0
+    step=a
+    while n<MAX_TRADE_NEWTON_STEPS and step>a*1e-15:
+        g,dg=trade_curve(a,linear,slope,bil,bol,e,q)
+        df=u*dg+v
+        if df<=0.0:
+            # The function stops decreasing before reaching 0, so it never does.
+            return -1.0
+        step=(F0-u*g-v*a)/df
+        a+=step
+        n+=1
+    return a
+
+def min_bound(a: f64, b: f64) -> f64:
+    """Returns the smaller of two bounds, where -1.0 means no bound."""
+    if a<0.0:
+        return b
+    if b<0.0 or a<b:
+        return a
+    return b
+
+def max_trade(i: u8, o: u8, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3], fee: f64, protocol_fee: f64, leverage: f64, delta: f64) -> Tuple[f64,f64]:
+    """Returns the largest amount ai of token i that trade_i accepts for a trade of token i for
+    token o, and the largest amount ao of token o that trade_o accepts, without trying any trade.
+    Both are 0.0 if no trade is accepted and -1.0 if there is no limit. They are rounded down
+    by a relative 1e-9 or more, so that the trade functions accept them despite rounding."""
+    if LP_tokens_issued[i]==0.0 or balances[o]==0.0:
+        return 0.0,0.0
+    B,L,W,imb_ratios=pool_metrics(balances, LP_tokens_issued, prices)
+    bi=balances[i]
+    bo=balances[o]
+    LP_i=LP_tokens_issued[i]
+    LP_o=LP_tokens_issued[o]
+    if imb_ratios[i]>1.0+delta or (LP_o!=0.0 and imb_ratios[o]<1.0-delta):
+        return 0.0,0.0
+    # The trade curve ao=g(ai), as in trade_i.
+    trading_fee,trading_leverage=trading_fee_and_leverage(i,o,balances,LP_tokens_issued,imb_ratios,fee,leverage)
+    q=1.0-trading_fee
+    linear=bi==0.0
+    bil=bi*trading_leverage
+    bol=bo*trading_leverage
+    e=1.0
+    slope=q*prices[i]/prices[o]
+    if not linear:
+        e=W[i]/W[o]
+        slope=bol*e*q/bil
+    # The amount of token i kept by the pool is c*ai.
+    c=1.0-protocol_fee*trading_fee
+    # After the trade B'=B+pi*c*ai-po*ao and L is unchanged; each constraint of
+    # check_trade_imbalance_ratios is linear in (ai, ao).
+    # Token i: (bi+c*ai)*L<=(1+delta)*LP_i*B'.
+    t=(1.0+delta)*LP_i
+    ai_max=max_amount_in(t*B-bi*L,t*prices[o],c*(L-t*prices[i]),linear,slope,bil,bol,e,q)
+    if LP_o!=0.0:
+        # Token o: (bo-ao)*L>=(1-delta)*LP_o*B'.
+        t=(1.0-delta)*LP_o
+        ai_max=min_bound(ai_max,max_amount_in(bo*L-t*B,L-t*prices[o],c*t*prices[i],linear,slope,bil,bol,e,q))
+    if linear or LP_o!=0.0:
+        # Balance of token o: ao<bo.
+        ai_max=min_bound(ai_max,max_amount_in(bo,1.0,0.0,linear,slope,bil,bol,e,q))
+    # trade_o also requires ao<bo on every branch.
+    ao_max=bo
+    if not linear and bol<bo:
+        # And ao<bo*leverage on the curve (the trade curve stays below it).
+        ao_max=bol
+    if ai_max>=0.0:
+        # The linear form of the constraints loses digits near the bound, so back off from it
+        # until check_trade_imbalance_ratios accepts the trade.
+        margin=1e-9
+        accepted=False
+        while not accepted and margin<1e-3:
+            ai_max*=1.0-margin
+            ao_max,dg=trade_curve(ai_max,linear,slope,bil,bol,e,q)
+            accepted=((LP_o==0.0 and not linear) or ao_max<bo) and check_trade_imbalance_ratios(B,L,imb_ratios,balances,LP_tokens_issued,prices,i,o,ai_max,ao_max,protocol_fee*trading_fee*ai_max,delta)
+            margin*=16.0
+        ao_max=min_bound(ao_max,bo)
+    # Same for the amount out, through the inverse curve of trade_o.
+    margin=1e-9
+    accepted=False
+    while not accepted and margin<1e-3:
+        ao_max*=1.0-margin
+        a=trade_curve_inverse(ao_max,linear,slope,bil,bol,e,q)
+        accepted=check_trade_imbalance_ratios(B,L,imb_ratios,balances,LP_tokens_issued,prices,i,o,a,ao_max,protocol_fee*trading_fee*a,delta)
+        margin*=16.0
+    return ai_max,ao_max
+
+
 def single_asset_deposit(i: u8, ai: f64, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3])-> Tuple[f64,u8]:
     """Performs a single asset deposit of amount i of token i.
     Returns the amount of LP tokens and its type (i) that must be given to the liquidity provider.
     """
-    LP_tokens_list=list(LP_tokens_issued)
-    balances_list=list(balances)
+    B,L,W,imb_ratios_array=pool_metrics(balances, LP_tokens_issued, prices)
     # we divide into cases
-    if LP_tokens_list[i]==0.0 or (LP_tokens_list[i]!=0.0 and balances_list[i]==0.0):
-        balances_copy_1=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_1=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_1=array(prices[0],prices[1],prices[2])
-        B,L=compute_B_and_L(balances_copy_1, LP_tokens_issued_copy_1, prices_copy_1)
+    if LP_tokens_issued[i]==0.0 or (LP_tokens_issued[i]!=0.0 and balances[i]==0.0):
         if B==0.0:
             lpt=ai
-            print("in:",ai,"Token",i,"--- out:",lpt,"LP tokens")
+            if log_enabled(LOG_SUMMARY):
+                print("in:",ai,"Token",i,"--- out:",lpt,"LP tokens")
             return lpt,i
         if B!=0.0:
             lpt=ai*L/B
-            print("in:",ai,"Token",i,"--- out:",lpt,"LP tokens")
+            if log_enabled(LOG_SUMMARY):
+                print("in:",ai,"Token",i,"--- out:",lpt,"LP tokens")
             return lpt,i
 
-    if LP_tokens_list[i]!=0.0 and balances_list[i]!=0.0:
-        balances_copy_2=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_2=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_2=array(prices[0],prices[1],prices[2])
-        imb_ratios_array=imbalance_ratios(balances_copy_2, LP_tokens_issued_copy_2, prices_copy_2)
-        bi=balances_list[i]
+    if LP_tokens_issued[i]!=0.0 and balances[i]!=0.0:
+        bi=balances[i]
         ri=imb_ratios_array[i]
-        lpt=(ai/bi)*ri*LP_tokens_list[i]
-        print("in:",ai,"Token",i,"--- out:",lpt,"LP tokens")
+        lpt=(ai/bi)*ri*LP_tokens_issued[i]
+        if log_enabled(LOG_SUMMARY):
+            print("in:",ai,"Token",i,"--- out:",lpt,"LP tokens")
         return lpt,i
 
     return 0.0,0
 
 
 
-def single_asset_withdrawal(o: u8, lpt: f64, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3],delta:f64) -> Tuple[f64,f64,f64,f64,f64]:
+def single_asset_withdrawal(o: u8, lpt: f64, balances: Array[f64,3], LP_tokens_issued: Array[f64,3], prices: Array[f64,3],delta:f64) -> Tuple[Array[f64,3],f64,f64]:
     """ Given an amount of LP tokens and its type o,
     returns the amounts of each token to be given to the LP
-    (first three coordinates) and the value given to the LP
-    in terms of token o. The fifth coordinate is the remaining
+    (an array) and the value given to the LP in terms of
+    token o. The third coordinate is the remaining
     amount of token o to be given to the LP (if any) in case the
     process could not be completed.
     """
-    LP_tokens_list=list(LP_tokens_issued)
     balances_list=list(balances)
-    amounts_out=[0.0,0.0,0.0]
+    amounts_out=zeros()
 
     a_remaining=[0.0]
     aol=[0.0]
 
+    # B, L and the imbalance ratios used below are those of the pool before the withdrawal.
+    B,L,W,imb_ratios=pool_metrics(balances, LP_tokens_issued, prices)
+
     bo=balances_list[o]
     if bo==0.0:
-        balances_copy_1=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_1=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_1=array(prices[0],prices[1],prices[2])
-        B,L=compute_B_and_L(balances_copy_1, LP_tokens_issued_copy_1, prices_copy_1)
-
         ao=lpt*B/L
         aol[0]=ao
-        print(f'Liquidity provider receives 0 token {o}.')
+        if log_enabled(LOG_DEBUG):
+            print(f'Liquidity provider receives 0 token {o}.')
         a_remaining[0]=ao
         # continue withdrawal with other token
 
     if bo!=0.0:
-        balances_copy_2=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_2=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_2=array(prices[0],prices[1],prices[2])
-        imb_ratios_array=imbalance_ratios(balances_copy_2, LP_tokens_issued_copy_2, prices_copy_2)
-        ro=imb_ratios_array[o]
-        Lo=LP_tokens_list[o]
+        ro=imb_ratios[o]
+        Lo=LP_tokens_issued[o]
         ao=lpt*bo/(Lo*ro)
         aol[0]=ao
         if lpt<Lo:
@@ -362,22 +559,18 @@ def single_asset_withdrawal(o: u8, lpt: f64, balances: Array[f64,3], LP_tokens_i
             if ro<=1.0-delta:
                 M1[0]=lpt*bo/Lo
             if ro>1.0-delta:
-                balances_copy_3=array(balances[0],balances[1],balances[2])
-                LP_tokens_issued_copy_3=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-                prices_copy_3=array(prices[0],prices[1],prices[2])
-                B,L=compute_B_and_L(balances_copy_3, LP_tokens_issued_copy_3, prices_copy_3)
-
                 M1[0]=bo-(1.0-delta)*(Lo-lpt)*B/L
             if ao<=M1[0]:
                 balances_list[o]-=ao
                 amounts_out[o]+=ao
-                print(f'Liquidity provider receives {ao} token {o}.')
-                LP_tokens_list[o]-=lpt
-                return amounts_out[0],amounts_out[1],amounts_out[2],ao,a_remaining[0]
+                if log_enabled(LOG_DEBUG):
+                    print(f'Liquidity provider receives {ao} token {o}.')
+                return amounts_out,ao,a_remaining[0]
             if ao>M1[0]:
                 balances_list[o]-=M1[0]
                 amounts_out[o]+=M1[0]
-                print(f'Liquidity provider receives {M1[0]} token {o}.')
+                if log_enabled(LOG_DEBUG):
+                    print(f'Liquidity provider receives {M1[0]} token {o}.')
                 a_remaining[0]=ao-M1[0]
                 # continue withdrawal with other token
 
@@ -387,86 +580,61 @@ def single_asset_withdrawal(o: u8, lpt: f64, balances: Array[f64,3], LP_tokens_i
             if ao<=bo:
                 balances_list[o]-=ao
                 amounts_out[o]+=ao
-                print(f'Liquidity provider receives {ao} token {o}.')
-                LP_tokens_list[o]-=lpt
-                return amounts_out[0],amounts_out[1],amounts_out[2],ao,a_remaining[0]
+                if log_enabled(LOG_DEBUG):
+                    print(f'Liquidity provider receives {ao} token {o}.')
+                return amounts_out,ao,a_remaining[0]
             if ao>bo:
                 balances_list[o]=0.0
                 amounts_out[o]+=bo
-                print(f'Liquidity provider receives {bo} token {o}.')
+                if log_enabled(LOG_DEBUG):
+                    print(f'Liquidity provider receives {bo} token {o}.')
                 a_remaining[0]=ao-bo
                 # continue withdrawal with other token
 
-    # withdrawal continues with another token
-    # employs remaining amount
-    Loop=[True]
-
-    prev_index=[o]
-
-    price_list=list(prices)
-
-    while a_remaining[0]!=0.0 and Loop[0]:
-        balances_copy_4=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_4=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_4=array(prices[0],prices[1],prices[2])
-        imb_ratios_array=imbalance_ratios(balances_copy_4, LP_tokens_issued_copy_4, prices_copy_4)
-        imb_ratios=list(imb_ratios_array)
-        #k=imb_ratios.index(max([x for x in imb_ratios if x >= 0.0]))
-        #index is not implemented yet, max does not work with lists
-        maximum_imb_ratio=0.0
-        max_imb_ratio_list=[0.0]
-        mylist=[u8(0)]
-        for j in [0,1,2]:
-          imb_ratios_j=imb_ratios[j]
-          print(imb_ratios)
-          print(max_imb_ratio_list[0])
-          if imb_ratios_j > max_imb_ratio_list[0]:
-            mylist[0]=u8(j)
-            max_imb_ratio_list[0]=imb_ratios_j
-        k=mylist[0]
-        a_rem=a_remaining[0]
-        price_o=price_list[o]
-        price_k=price_list[k]
-        ak=a_rem*price_o/price_k
-        bk=balances_list[k]
-        Lk=LP_tokens_list[k]
-        balances_copy_5=array(balances[0],balances[1],balances[2])
-        LP_tokens_issued_copy_5=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-        prices_copy_5=array(prices[0],prices[1],prices[2])
-        B,L=compute_B_and_L(balances_copy_5, LP_tokens_issued_copy_5, prices_copy_5)
-
-        Mk=bk-(1.0-delta)*Lk*B/L
-        if ak<=Mk:
-            balances_list[k]-=ak
-            amounts_out[k]+=ak
-            print(f'Liquidity provider receives {ak} token {k}.')
-            a_remaining[0]=0.0
-        if ak>Mk:
-            balances_list[k]-=Mk
-            amounts_out[k]+=Mk
-            print(f'Liquidity provider receives {Mk} token {k}.')
-            a_remaining[0]-=Mk*price_list[k]/price_list[o]
-        if prev_index[0]==k:
-            Loop[0]=False
-            a_rem=a_remaining[0]
-            price_o=price_list[o]
-            price_k=price_list[k]
-            ak=a_rem*price_o/price_k
-            if ak<=balances_list[k]:
+    # The withdrawal continues with the other tokens, from the largest imbalance ratio down.
+    # Each one pays out down to its reserve, the balance at which its imbalance ratio (with B
+    # and L before the withdrawal) is 1-delta. That leaves it below every token still to be
+    # used, so the order is computed once and each token costs one step.
+    order=ratio_order(imb_ratios)
+    for n in range(N_TOKENS):
+        k=order[n]
+        if a_remaining[0]!=0.0 and k!=o and imb_ratios[k]>1.0-delta:
+            ak=a_remaining[0]*prices[o]/prices[k]
+            Mk=balances_list[k]-(1.0-delta)*LP_tokens_issued[k]*B/L
+            if ak<=Mk:
                 balances_list[k]-=ak
                 amounts_out[k]+=ak
-                print(f'Liquidity provider receives {ak} token {k}.')
+                if log_enabled(LOG_DEBUG):
+                    print(f'Liquidity provider receives {ak} token {k}.')
                 a_remaining[0]=0.0
-            else:
+            if ak>Mk and Mk>0.0:
+                balances_list[k]-=Mk
+                amounts_out[k]+=Mk
+                if log_enabled(LOG_DEBUG):
+                    print(f'Liquidity provider receives {Mk} token {k}.')
+                a_remaining[0]-=Mk*prices[k]/prices[o]
+
+    # If every token is down to its reserve, the token with the largest imbalance ratio pays
+    # the rest, if its balance allows.
+    k=order[0]
+    if a_remaining[0]!=0.0:
+        ak=a_remaining[0]*prices[o]/prices[k]
+        if ak<=balances_list[k]:
+            balances_list[k]-=ak
+            amounts_out[k]+=ak
+            if log_enabled(LOG_DEBUG):
+                print(f'Liquidity provider receives {ak} token {k}.')
+            a_remaining[0]=0.0
+        else:
+            if log_enabled(LOG_DEBUG):
                 print(f'Remaining {a_remaining[0]} token {o}')
-        prev_index[0]=k
 
     ao=aol[0]
-    LP_tokens_list[o]-=lpt
-    print("in:",lpt,"LP tokens","--- out:",ao,"token",o,"(in value)")
+    if log_enabled(LOG_SUMMARY):
+        print("in:",lpt,"LP tokens","--- out:",ao,"token",o,"(in value)")
 
 
-    return amounts_out[0],amounts_out[1],amounts_out[2],ao,a_remaining[0]
+    return amounts_out,ao,a_remaining[0]
 
 
 def f64_to_u64_9_decimal_places(x: f64) -> u64:
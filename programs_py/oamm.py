@@ -2,6 +2,8 @@
 # Built with Seahorse v0.2.5
 
 from lib.math import *
+from lib.fixed_point import *
+from lib.log import *
 from lib.accounts import *
 from seahorse.prelude import *
 from seahorse.pyth import *
@@ -10,82 +12,269 @@ declare_id('4QtTJaWNGQBT1zoa3wuyewFXd1mCquGHL8hz69tuZ3Xu') # devnet
 
 
 
+class oamm_factory(Account):
+    # Numbers the pools created by create_pool. Its seeds are ['oamm_factory'].
+    n_pools: u64
+
+
 class oamm(Account):
-    balance_sol: f64
-    balance_usdc: f64
-    balance_usdt: f64
-    lp_sol_tokens: f64
-    lp_usdc_tokens: f64
-    lp_usdt_tokens: f64
+    # Balances, LP tokens in circulation and protocol fees not yet swept of each token, indexed like
+    # the arrays of lib/math.py (0: SOL, 1: USDC, 2: USDT).
+    balances: Array[f64,3]
+    lp_tokens: Array[f64,3]
+    fees: Array[u64,3]
+    # The pool's seeds are ['oamm', pool_id]. Instructions check the other accounts of the pool
+    # against the keys below, which create_pool records.
+    pool_id: u64
+    config: Pubkey
+    mints: Array[Pubkey,3]
+    token_accounts: Array[Pubkey,3]
+    lp_mints: Array[Pubkey,3]
+    bump: u8
+
+
+class oamm_config(Account):
+    # Pool parameters, set by init and never written afterwards, so instructions take this account
+    # read-only and only the oamm account above is write-locked by deposits, withdrawals and trades.
+    # Its seeds are ['oamm_config', pool].
     base_fee: f64
     protocol_fee: f64
     base_leverage: f64
     delta: f64
-    bump: u8
+    fixed_point: bool
+
+
+class price_cache(Account):
+    # Oracle prices of the last slot in which an instruction of the pool read them, so that the next
+    # instructions of the pool in the same slot (e.g. composed in one transaction) reuse them instead
+    # of parsing the price accounts again. Its seeds are ['price_cache', pool].
+    pool: Pubkey
+    slot: u64
+    prices: Array[f64,3]
+
+
+# Kinds of PoolEvent.
+EVENT_DEPOSIT=u8(0)
+EVENT_WITHDRAWAL=u8(1)
+EVENT_TRADE=u8(2)
+EVENT_UPDATE=u8(3)
+
+class PoolEvent(Event):
+    # Emitted by every instruction that changes the pool state. The d_* fields are the amounts added
+    # to the pool fields of the same name, so adding them up from init reproduces the pool state.
+    # token_in and token_out are the tokens of a trade, and the token of the LP tokens minted or burned.
+    kind: u8
+    user: Pubkey
+    pool: Pubkey
+    token_in: u8
+    token_out: u8
+    d_balances: Array[f64,3]
+    d_lp_tokens: Array[f64,3]
+    prices: Array[f64,3]
+    protocol_fee: f64
+
+    def __init__(self, kind: u8, user: Pubkey, pool: Pubkey, token_in: u8, token_out: u8, d_balances: Array[f64,3], d_lp_tokens: Array[f64,3], prices: Array[f64,3], protocol_fee: f64):
+        self.kind=kind
+        self.user=user
+        self.pool=pool
+        self.token_in=token_in
+        self.token_out=token_out
+        self.d_balances=d_balances
+        self.d_lp_tokens=d_lp_tokens
+        self.prices=prices
+        self.protocol_fee=protocol_fee
+
+
+def emit_trade_event(user: Pubkey, pool: Pubkey, i: u8, o: u8, ai: f64, ao: f64, pr_fee: f64, prices: Array[f64,3]):
+  """Emits the PoolEvent of a trade that added ai-pr_fee of token i to the pool and took out ao of token o."""
+  d_balances=zeros()
+  d_balances[i]=ai-pr_fee
+  d_balances[o]=-ao
+  PoolEvent(EVENT_TRADE, user, pool, i, o, d_balances, zeros(), prices, pr_fee).emit()
+
+
+def emit_deposit_event(user: Pubkey, pool: Pubkey, i: u8, ai: f64, lpt: f64, prices: Array[f64,3]):
+  """Emits the PoolEvent of a deposit that added ai of token i to the pool and minted lpt LP tokens of type i."""
+  d_balances=zeros()
+  d_balances[i]=ai
+  d_lp_tokens=zeros()
+  d_lp_tokens[i]=lpt
+  PoolEvent(EVENT_DEPOSIT, user, pool, i, i, d_balances, d_lp_tokens, prices, 0.0).emit()
+
+
+def emit_withdrawal_event(user: Pubkey, pool: Pubkey, o: u8, amounts_out: Array[f64,3], lpt: f64, prices: Array[f64,3]):
+  """Emits the PoolEvent of a withdrawal that took amounts_out out of the pool and burned lpt LP tokens of type o."""
+  d_balances=zeros()
+  for j in range(N_TOKENS):
+    d_balances[j]=-amounts_out[j]
+  d_lp_tokens=zeros()
+  d_lp_tokens[o]=-lpt
+  PoolEvent(EVENT_WITHDRAWAL, user, pool, o, o, d_balances, d_lp_tokens, prices, 0.0).emit()
+
+
+class PoolCreated(Event):
+    # Emitted by create_pool, so that the pools of the program can be indexed from the logs.
+    pool: Pubkey
+    pool_id: u64
+    config: Pubkey
+    mints: Array[Pubkey,3]
+    base_fee: f64
+    protocol_fee: f64
+    base_leverage: f64
+    delta: f64
+    fixed_point: bool
+
+    def __init__(self, pool: Pubkey, pool_id: u64, config: Pubkey, mints: Array[Pubkey,3], base_fee: f64, protocol_fee: f64, base_leverage: f64, delta: f64, fixed_point: bool):
+        self.pool=pool
+        self.pool_id=pool_id
+        self.config=config
+        self.mints=mints
+        self.base_fee=base_fee
+        self.protocol_fee=protocol_fee
+        self.base_leverage=base_leverage
+        self.delta=delta
+        self.fixed_point=fixed_point
+
+
+class QuoteEvent(Event):
+    # Emitted by quote: what swap would do with the same arguments. ratio_in and ratio_out are the
+    # imbalance ratios of tokens i and o after the trade (before it if it cannot be executed).
+    pool: Pubkey
+    token_in: u8
+    token_out: u8
+    amount_in: f64
+    amount_out: f64
+    protocol_fee: f64
+    fee: f64
+    leverage: f64
+    ratio_in: f64
+    ratio_out: f64
+    execute_trade: bool
+
+    def __init__(self, pool: Pubkey, token_in: u8, token_out: u8, amount_in: f64, amount_out: f64, protocol_fee: f64, fee: f64, leverage: f64, ratio_in: f64, ratio_out: f64, execute_trade: bool):
+        self.pool=pool
+        self.token_in=token_in
+        self.token_out=token_out
+        self.amount_in=amount_in
+        self.amount_out=amount_out
+        self.protocol_fee=protocol_fee
+        self.fee=fee
+        self.leverage=leverage
+        self.ratio_in=ratio_in
+        self.ratio_out=ratio_out
+        self.execute_trade=execute_trade
 
 
 @instruction
-def init(owner: Signer, pool: Empty[oamm], basefee: f64, protocolfee: f64, baseleverage: f64, delta: f64, mint_lpsol: Empty[TokenMint], mint_lpusdc: Empty[TokenMint], mint_lpusdt: Empty[TokenMint]):
+def init_factory(owner: Signer, factory: Empty[oamm_factory]):
+  assert owner.key() == OWNER, "You are not allowed to call this instruction."
+  factory = factory.init(
+    payer=owner,
+    seeds=['oamm_factory']
+  )
+  factory.n_pools=u64(0)
+
 
+@instruction
+def create_pool(owner: Signer, factory: oamm_factory, pool: Empty[oamm], config: Empty[oamm_config], cache: Empty[price_cache], mint_usdc: TokenMint, mint_usdt: TokenMint, pool_usdc_tkn_acc: Empty[TokenAccount], pool_usdt_tkn_acc: Empty[TokenAccount], mint_lpsol: Empty[TokenMint], mint_lpusdc: Empty[TokenMint], mint_lpusdt: Empty[TokenMint], basefee: f64, protocolfee: f64, baseleverage: f64, delta: f64, fixedpoint: bool):
+  # Creates pool number factory.n_pools with its config account, its price cache, its token accounts
+  # and its LP token mints, all of them PDAs derived from the pool's key. The parameters are set here
+  # and can not be changed later.
+  assert owner.key() == OWNER, "You are not allowed to call this instruction."
+  assert mint_usdc.key() == MINT_USDC, "Invalid TokenMint account."
+  assert mint_usdt.key() == MINT_USDT, "Invalid TokenMint account."
+
+  pool_id = factory.n_pools
   bump = pool.bump()
   pool = pool.init(
     payer=owner,
-    seeds=['oamm']
+    seeds=['oamm', pool_id]
   )
   pool.bump=bump
+  pool.pool_id=pool_id
+
+  pool.balances=zeros()
+  pool.lp_tokens=zeros()
+  pool.fees=zeros_u64()
+
+  config = config.init(
+    payer=owner,
+    seeds=['oamm_config', pool]
+  )
+  config.base_fee=basefee
+  config.protocol_fee=protocolfee
+  config.base_leverage=baseleverage
+  config.delta=delta
+  config.fixed_point=fixedpoint
 
-  pool.balance_sol=0.0
-  pool.balance_usdc=0.0
-  pool.balance_usdt=0.0
-  pool.lp_sol_tokens=0.0
-  pool.lp_usdc_tokens=0.0
-  pool.lp_usdt_tokens=0.0
-  pool.base_fee=basefee
-  pool.protocol_fee=protocolfee
-  pool.base_leverage=baseleverage
-  pool.delta=delta
+  cache = cache.init(
+    payer=owner,
+    seeds=['price_cache', pool]
+  )
+  cache.pool=pool.key()
 
+  pool_usdc_tkn_acc = pool_usdc_tkn_acc.init(
+    payer = owner,
+    seeds = ['pool-token-account', pool, mint_usdc],
+    mint = mint_usdc,
+    authority = pool
+  )
 
-  mint_lpsol.init(
+  pool_usdt_tkn_acc = pool_usdt_tkn_acc.init(
     payer = owner,
-    seeds = ['lp_sol-token-mint'],
+    seeds = ['pool-token-account', pool, mint_usdt],
+    mint = mint_usdt,
+    authority = pool
+  )
+
+  mint_lpsol = mint_lpsol.init(
+    payer = owner,
+    seeds = ['lp_sol-token-mint', pool],
     decimals = 9,
     authority = pool
   )
 
-  mint_lpusdc.init(
+  mint_lpusdc = mint_lpusdc.init(
     payer = owner,
-    seeds = ['lp_usdc-token-mint'],
+    seeds = ['lp_usdc-token-mint', pool],
     decimals = 9,
     authority = pool
   )
 
-  mint_lpusdt.init(
+  mint_lpusdt = mint_lpusdt.init(
     payer = owner,
-    seeds = ['lp_usdt-token-mint'],
+    seeds = ['lp_usdt-token-mint', pool],
     decimals = 9,
     authority = pool
   )
 
+  # SOL is held as lamports of the pool account itself.
+  pool.config=config.key()
+  pool.mints=array(MINT_SOL,MINT_USDC,MINT_USDT)
+  pool.token_accounts=array(pool.key(),pool_usdc_tkn_acc.key(),pool_usdt_tkn_acc.key())
+  pool.lp_mints=array(mint_lpsol.key(),mint_lpusdc.key(),mint_lpusdt.key())
+
+  factory.n_pools=pool_id+1
+
+  PoolCreated(pool.key(), pool_id, config.key(), pool.mints, basefee, protocolfee, baseleverage, delta, fixedpoint).emit()
+
 
 
 
 @instruction
-def deposit_sol(user: Signer, user_lp_sol_tkn_acc: TokenAccount, pool: oamm, mint_lpsol: TokenMint, amount_sol: f64, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
-  # We check account mints.
-  owner_pubkey, mint_usdc_pubkey, mint_usdt_pubkey, pool_pubkey, pool_usdc_token_account_pubkey, pool_usdt_token_account_pubkey, pool_mint_lp_sol_pubkey, pool_mint_lp_usdc_pubkey, pool_mint_lp_usdt_pubkey, fee_account_sol_pubkey, fee_account_usdc_pubkey, fee_account_usdt_pubkey = get_public_keys()
-  assert str(mint_lpsol.key()) == pool_mint_lp_sol_pubkey, "Invalid TokenMint account."
-  #assert str(user_lp_sol_tkn_acc.mint()) == pool_mint_lp_sol_pubkey, f"Token account {user_lp_sol_tkn_acc.key()} is not of the correct mint type (expected mint {pool_mint_lp_sol_pubkey})."
-
-  n = f64_to_u64_9_decimal_places(amount_sol)
-  balances = array(pool.balance_sol,pool.balance_usdc,pool.balance_usdt)
-  LP_tokens_issued = array(pool.lp_sol_tokens,pool.lp_usdc_tokens,pool.lp_usdt_tokens)
-
-  x,y,z = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
-  prices = array(x,y,z)
+def deposit_sol(user: Signer, user_lp_sol_tkn_acc: TokenAccount, pool: oamm, config: oamm_config, cache: price_cache, clock: Clock, mint_lpsol: TokenMint, amount_sol: f64, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
+  # We check accounts and mints.
+  assert mint_lpsol.key() == pool.lp_mints[0], "Invalid TokenMint account."
+  assert config.key() == pool.config, "Invalid config account."
+  #assert user_lp_sol_tkn_acc.mint() == pool.lp_mints[0], f"Token account {user_lp_sol_tkn_acc.key()} is not of the correct mint type (expected mint {pool.lp_mints[0]})."
+
+  balances = pool.balances
+  LP_tokens_issued = pool.lp_tokens
+
+  prices = cached_prices(pool, cache, clock, price_account_sol, price_account_usdc, price_account_usdt)
   #prices = array(20.0,1.0,1.0) # take from oracle
-  amount_lp_sol,i = single_asset_deposit(0, amount_sol, balances, LP_tokens_issued, prices)
-  m = f64_to_u64_9_decimal_places(amount_lp_sol)
+  amount_lp_sol,n,m = single_asset_deposit_amounts(config.fixed_point, 0, amount_sol, balances, LP_tokens_issued, prices)
+  pool_id = pool.pool_id
   bump = pool.bump
 
   user.transfer_lamports(
@@ -97,35 +286,31 @@ def deposit_sol(user: Signer, user_lp_sol_tkn_acc: TokenAccount, pool: oamm, min
     authority = pool,
     to = user_lp_sol_tkn_acc,
     amount = m,
-    signer = ['oamm', bump]
+    signer = ['oamm', pool_id, bump]
   )
 
-  pool.balance_sol+=amount_sol
-  pool.lp_sol_tokens+=amount_lp_sol
+  pool.balances[0]+=amount_sol
+  pool.lp_tokens[0]+=amount_lp_sol
 
-  print(f'User {user.key()} deposited {amount_sol} SOL and received {amount_lp_sol} LPSOL tokens.')
+  emit_deposit_event(user.key(), pool.key(), 0, amount_sol, amount_lp_sol, prices)
 
 
 @instruction
-def withdraw_sol(user: Signer, user_lp_sol_tkn_acc: TokenAccount, user_usdc_tkn_acc: TokenAccount, user_usdt_tkn_acc: TokenAccount, pool: oamm, pool_usdc_tkn_acc: TokenAccount, pool_usdt_tkn_acc: TokenAccount, mint_lpsol: TokenMint, amount_lp_sol: f64, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
+def withdraw_sol(user: Signer, user_lp_sol_tkn_acc: TokenAccount, user_usdc_tkn_acc: TokenAccount, user_usdt_tkn_acc: TokenAccount, pool: oamm, config: oamm_config, cache: price_cache, clock: Clock, pool_usdc_tkn_acc: TokenAccount, pool_usdt_tkn_acc: TokenAccount, mint_lpsol: TokenMint, amount_lp_sol: f64, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
   # We check accounts and mints.
-  owner_pubkey, mint_usdc_pubkey, mint_usdt_pubkey, pool_pubkey, pool_usdc_token_account_pubkey, pool_usdt_token_account_pubkey, pool_mint_lp_sol_pubkey, pool_mint_lp_usdc_pubkey, pool_mint_lp_usdt_pubkey, fee_account_sol_pubkey, fee_account_usdc_pubkey, fee_account_usdt_pubkey = get_public_keys()
-  assert str(mint_lpsol.key()) == pool_mint_lp_sol_pubkey, "Invalid TokenMint account."
-  assert str(pool.key()) == pool_pubkey, "Invalid pool account."
-  assert str(pool_usdc_tkn_acc.key()) == pool_usdc_token_account_pubkey, "Invalid pool token account."
-  assert str(pool_usdt_tkn_acc.key()) == pool_usdt_token_account_pubkey, "Invalid pool token account."
-
-  balances = array(pool.balance_sol,pool.balance_usdc,pool.balance_usdt)
-  LP_tokens_issued = array(pool.lp_sol_tokens,pool.lp_usdc_tokens,pool.lp_usdt_tokens)
-  x,y,z = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
-  prices = array(x,y,z)
+  assert mint_lpsol.key() == pool.lp_mints[0], "Invalid TokenMint account."
+  assert config.key() == pool.config, "Invalid config account."
+  assert pool_usdc_tkn_acc.key() == pool.token_accounts[1], "Invalid pool token account."
+  assert pool_usdt_tkn_acc.key() == pool.token_accounts[2], "Invalid pool token account."
+
+  balances = pool.balances
+  LP_tokens_issued = pool.lp_tokens
+  prices = cached_prices(pool, cache, clock, price_account_sol, price_account_usdc, price_account_usdt)
   #prices = array(20.0,1.0,1.0) # take from oracle
-  delta=pool.delta
-  amount_sol_out,amount_usdc_out,amount_usdt_out,ao,remaining = single_asset_withdrawal(0, amount_lp_sol, balances, LP_tokens_issued, prices,delta)
-
-  amount_lp_sol_to_burn=amount_lp_sol*(ao-remaining)/ao
-  n_lp_sol = f64_to_u64_9_decimal_places(amount_lp_sol_to_burn)
+  delta=config.delta
+  amounts_out,amount_lp_sol_to_burn,n_out,n_lp_sol = single_asset_withdrawal_amounts(config.fixed_point, 0, amount_lp_sol, balances, LP_tokens_issued, prices, delta)
 
+  pool_id = pool.pool_id
   bump = pool.bump
 
   mint_lpsol.burn(
@@ -133,56 +318,50 @@ def withdraw_sol(user: Signer, user_lp_sol_tkn_acc: TokenAccount, user_usdc_tkn_
     holder = user_lp_sol_tkn_acc,
     amount = n_lp_sol
   )
-  pool.lp_sol_tokens-=amount_lp_sol_to_burn
-  print(f'{amount_lp_sol_to_burn} LPSOL burned from user {user.key()}.')
+  pool.lp_tokens[0]-=amount_lp_sol_to_burn
 
-  if amount_usdc_out != 0.0:
-    n_usdc = f64_to_u64_9_decimal_places(amount_usdc_out)
+  if amounts_out[1] != 0.0:
     pool_usdc_tkn_acc.transfer(
       authority = pool,
       to = user_usdc_tkn_acc,
-      amount = n_usdc,
-      signer = ['oamm', bump]
+      amount = n_out[1],
+      signer = ['oamm', pool_id, bump]
     )
-    pool.balance_usdc-=amount_usdc_out
-    print(f'User {user.key()} withdrew {amount_usdc_out} USDC.')
+    pool.balances[1]-=amounts_out[1]
 
-  if amount_usdt_out != 0.0:
-    n_usdt = f64_to_u64_9_decimal_places(amount_usdt_out)
+  if amounts_out[2] != 0.0:
     pool_usdt_tkn_acc.transfer(
       authority = pool,
       to = user_usdt_tkn_acc,
-      amount = n_usdt,
-      signer = ['oamm', bump]
+      amount = n_out[2],
+      signer = ['oamm', pool_id, bump]
     )
-    pool.balance_usdt-=amount_usdt_out
-    print(f'User {user.key()} withdrew {amount_usdt_out} USDT.')
+    pool.balances[2]-=amounts_out[2]
 
-  if amount_sol_out != 0.0:
-    n_sol = f64_to_u64_9_decimal_places(amount_sol_out)
+  if amounts_out[0] != 0.0:
     pool.transfer_lamports(
       to = user,
-      amount = n_sol
+      amount = n_out[0]
     )
-    pool.balance_sol-=amount_sol_out
-    print(f'User {user.key()} withdrew {amount_sol_out} SOL.')
+    pool.balances[0]-=amounts_out[0]
+
+  emit_withdrawal_event(user.key(), pool.key(), 0, amounts_out, amount_lp_sol_to_burn, prices)
 
 @instruction
-def deposit_usdc(user: Signer, user_usdc_tkn_acc: TokenAccount, user_lp_usdc_tkn_acc: TokenAccount, pool: oamm, pool_usdc_tkn_acc: TokenAccount, mint_lpusdc: TokenMint, amount_usdc: f64, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
-  # We check account mints.
-  owner_pubkey, mint_usdc_pubkey, mint_usdt_pubkey, pool_pubkey, pool_usdc_token_account_pubkey, pool_usdt_token_account_pubkey, pool_mint_lp_sol_pubkey, pool_mint_lp_usdc_pubkey, pool_mint_lp_usdt_pubkey, fee_account_sol_pubkey, fee_account_usdc_pubkey, fee_account_usdt_pubkey = get_public_keys()
-  assert str(mint_lpusdc.key()) == pool_mint_lp_usdc_pubkey, "Invalid TokenMint account."
-  #assert str(user_lp_usdc_tkn_acc.mint()) == pool_mint_lp_usdc_pubkey, f"Token account {user_lp_usdc_tkn_acc.key()} is not of the correct mint type (expected mint {pool_mint_lp_usdc_pubkey})."
-
-  n = f64_to_u64_9_decimal_places(amount_usdc)
-  balances = array(pool.balance_sol,pool.balance_usdc,pool.balance_usdt)
-  LP_tokens_issued = array(pool.lp_sol_tokens,pool.lp_usdc_tokens,pool.lp_usdt_tokens)
-
-  x,y,z = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
-  prices = array(x,y,z)
+def deposit_usdc(user: Signer, user_usdc_tkn_acc: TokenAccount, user_lp_usdc_tkn_acc: TokenAccount, pool: oamm, config: oamm_config, cache: price_cache, clock: Clock, pool_usdc_tkn_acc: TokenAccount, mint_lpusdc: TokenMint, amount_usdc: f64, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
+  # We check accounts and mints.
+  assert mint_lpusdc.key() == pool.lp_mints[1], "Invalid TokenMint account."
+  assert config.key() == pool.config, "Invalid config account."
+  assert pool_usdc_tkn_acc.key() == pool.token_accounts[1], "Invalid pool token account."
+  #assert user_lp_usdc_tkn_acc.mint() == pool.lp_mints[1], f"Token account {user_lp_usdc_tkn_acc.key()} is not of the correct mint type (expected mint {pool.lp_mints[1]})."
+
+  balances = pool.balances
+  LP_tokens_issued = pool.lp_tokens
+
+  prices = cached_prices(pool, cache, clock, price_account_sol, price_account_usdc, price_account_usdt)
   #prices = array(20.0,1.0,1.0) # take from oracle
-  amount_lp_usdc,i = single_asset_deposit(1, amount_usdc, balances, LP_tokens_issued, prices)
-  m = f64_to_u64_9_decimal_places(amount_lp_usdc)
+  amount_lp_usdc,n,m = single_asset_deposit_amounts(config.fixed_point, 1, amount_usdc, balances, LP_tokens_issued, prices)
+  pool_id = pool.pool_id
   bump = pool.bump
 
   user_usdc_tkn_acc.transfer(
@@ -195,35 +374,31 @@ def deposit_usdc(user: Signer, user_usdc_tkn_acc: TokenAccount, user_lp_usdc_tkn
     authority = pool,
     to = user_lp_usdc_tkn_acc,
     amount = m,
-    signer = ['oamm', bump]
+    signer = ['oamm', pool_id, bump]
   )
 
-  pool.balance_usdc+=amount_usdc
-  pool.lp_usdc_tokens+=amount_lp_usdc
+  pool.balances[1]+=amount_usdc
+  pool.lp_tokens[1]+=amount_lp_usdc
 
-  print(f'User {user.key()} deposited {amount_usdc} USDC.')
+  emit_deposit_event(user.key(), pool.key(), 1, amount_usdc, amount_lp_usdc, prices)
 
 
 @instruction
-def withdraw_usdc(user: Signer, user_lp_usdc_tkn_acc: TokenAccount, user_usdc_tkn_acc: TokenAccount, user_usdt_tkn_acc: TokenAccount, pool: oamm, pool_usdc_tkn_acc: TokenAccount, pool_usdt_tkn_acc: TokenAccount, mint_lpusdc: TokenMint, amount_lp_usdc: f64, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
+def withdraw_usdc(user: Signer, user_lp_usdc_tkn_acc: TokenAccount, user_usdc_tkn_acc: TokenAccount, user_usdt_tkn_acc: TokenAccount, pool: oamm, config: oamm_config, cache: price_cache, clock: Clock, pool_usdc_tkn_acc: TokenAccount, pool_usdt_tkn_acc: TokenAccount, mint_lpusdc: TokenMint, amount_lp_usdc: f64, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
   # We check accounts and mints.
-  owner_pubkey, mint_usdc_pubkey, mint_usdt_pubkey, pool_pubkey, pool_usdc_token_account_pubkey, pool_usdt_token_account_pubkey, pool_mint_lp_sol_pubkey, pool_mint_lp_usdc_pubkey, pool_mint_lp_usdt_pubkey, fee_account_sol_pubkey, fee_account_usdc_pubkey, fee_account_usdt_pubkey = get_public_keys()
-  assert str(mint_lpusdc.key()) == pool_mint_lp_usdc_pubkey, "Invalid TokenMint account."
-  assert str(pool.key()) == pool_pubkey, "Invalid pool account."
-  assert str(pool_usdc_tkn_acc.key()) == pool_usdc_token_account_pubkey, "Invalid pool token account."
-  assert str(pool_usdt_tkn_acc.key()) == pool_usdt_token_account_pubkey, "Invalid pool token account."
-
-  balances = array(pool.balance_sol,pool.balance_usdc,pool.balance_usdt)
-  LP_tokens_issued = array(pool.lp_sol_tokens,pool.lp_usdc_tokens,pool.lp_usdt_tokens)
-  x,y,z = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
-  prices = array(x,y,z)
+  assert mint_lpusdc.key() == pool.lp_mints[1], "Invalid TokenMint account."
+  assert config.key() == pool.config, "Invalid config account."
+  assert pool_usdc_tkn_acc.key() == pool.token_accounts[1], "Invalid pool token account."
+  assert pool_usdt_tkn_acc.key() == pool.token_accounts[2], "Invalid pool token account."
+
+  balances = pool.balances
+  LP_tokens_issued = pool.lp_tokens
+  prices = cached_prices(pool, cache, clock, price_account_sol, price_account_usdc, price_account_usdt)
   #prices = array(20.0,1.0,1.0) # take from oracle
-  delta=pool.delta
-  amount_sol_out,amount_usdc_out,amount_usdt_out,ao,remaining = single_asset_withdrawal(1, amount_lp_usdc, balances, LP_tokens_issued, prices,delta)
-
-  amount_lp_usdc_to_burn=amount_lp_usdc*(ao-remaining)/ao
-  n_lp_usdc = f64_to_u64_9_decimal_places(amount_lp_usdc_to_burn)
+  delta=config.delta
+  amounts_out,amount_lp_usdc_to_burn,n_out,n_lp_usdc = single_asset_withdrawal_amounts(config.fixed_point, 1, amount_lp_usdc, balances, LP_tokens_issued, prices, delta)
 
+  pool_id = pool.pool_id
   bump = pool.bump
 
   mint_lpusdc.burn(
@@ -231,57 +406,51 @@ def withdraw_usdc(user: Signer, user_lp_usdc_tkn_acc: TokenAccount, user_usdc_tk
     holder = user_lp_usdc_tkn_acc,
     amount = n_lp_usdc
   )
-  pool.lp_usdc_tokens-=amount_lp_usdc_to_burn
-  print(f'{amount_lp_usdc_to_burn} LPUSDC burned from user {user.key()}.')
+  pool.lp_tokens[1]-=amount_lp_usdc_to_burn
 
-  if amount_usdc_out != 0.0:
-    n_usdc = f64_to_u64_9_decimal_places(amount_usdc_out)
+  if amounts_out[1] != 0.0:
     pool_usdc_tkn_acc.transfer(
       authority = pool,
       to = user_usdc_tkn_acc,
-      amount = n_usdc,
-      signer = ['oamm', bump]
+      amount = n_out[1],
+      signer = ['oamm', pool_id, bump]
     )
-    pool.balance_usdc-=amount_usdc_out
-    print(f'User {user.key()} withdrew {amount_usdc_out} USDC.')
+    pool.balances[1]-=amounts_out[1]
 
-  if amount_usdt_out != 0.0:
-    n_usdt = f64_to_u64_9_decimal_places(amount_usdt_out)
+  if amounts_out[2] != 0.0:
     pool_usdt_tkn_acc.transfer(
       authority = pool,
       to = user_usdt_tkn_acc,
-      amount = n_usdt,
-      signer = ['oamm', bump]
+      amount = n_out[2],
+      signer = ['oamm', pool_id, bump]
     )
-    pool.balance_usdt-=amount_usdt_out
-    print(f'User {user.key()} withdrew {amount_usdt_out} USDT.')
+    pool.balances[2]-=amounts_out[2]
 
-  if amount_sol_out != 0.0:
-    n_sol = f64_to_u64_9_decimal_places(amount_sol_out)
+  if amounts_out[0] != 0.0:
     pool.transfer_lamports(
       to = user,
-      amount = n_sol
+      amount = n_out[0]
     )
-    pool.balance_sol-=amount_sol_out
-    print(f'User {user.key()} withdrew {amount_sol_out} SOL.')
+    pool.balances[0]-=amounts_out[0]
+
+  emit_withdrawal_event(user.key(), pool.key(), 1, amounts_out, amount_lp_usdc_to_burn, prices)
 
 
 
 @instruction
-def deposit_usdt(user: Signer, user_usdt_tkn_acc: TokenAccount, user_lp_usdt_tkn_acc: TokenAccount, pool: oamm, pool_usdt_tkn_acc: TokenAccount, mint_lpusdt: TokenMint, amount_usdt: f64, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
-  # We check account mints.
-  owner_pubkey, mint_usdc_pubkey, mint_usdt_pubkey, pool_pubkey, pool_usdc_token_account_pubkey, pool_usdt_token_account_pubkey, pool_mint_lp_sol_pubkey, pool_mint_lp_usdc_pubkey, pool_mint_lp_usdt_pubkey, fee_account_sol_pubkey, fee_account_usdc_pubkey, fee_account_usdt_pubkey = get_public_keys()
-  assert str(mint_lpusdt.key()) == pool_mint_lp_usdt_pubkey, "Invalid TokenMint account."
+def deposit_usdt(user: Signer, user_usdt_tkn_acc: TokenAccount, user_lp_usdt_tkn_acc: TokenAccount, pool: oamm, config: oamm_config, cache: price_cache, clock: Clock, pool_usdt_tkn_acc: TokenAccount, mint_lpusdt: TokenMint, amount_usdt: f64, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
+  # We check accounts and mints.
+  assert mint_lpusdt.key() == pool.lp_mints[2], "Invalid TokenMint account."
+  assert config.key() == pool.config, "Invalid config account."
+  assert pool_usdt_tkn_acc.key() == pool.token_accounts[2], "Invalid pool token account."
 
-  n = f64_to_u64_9_decimal_places(amount_usdt)
-  balances = array(pool.balance_sol,pool.balance_usdc,pool.balance_usdt)
-  LP_tokens_issued = array(pool.lp_sol_tokens,pool.lp_usdc_tokens,pool.lp_usdt_tokens)
+  balances = pool.balances
+  LP_tokens_issued = pool.lp_tokens
 
-  x,y,z = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
-  prices = array(x,y,z)
+  prices = cached_prices(pool, cache, clock, price_account_sol, price_account_usdc, price_account_usdt)
   #prices = array(20.0,1.0,1.0) # take from oracle
-  amount_lp_usdt,i = single_asset_deposit(2, amount_usdt, balances, LP_tokens_issued, prices)
-  m = f64_to_u64_9_decimal_places(amount_lp_usdt)
+  amount_lp_usdt,n,m = single_asset_deposit_amounts(config.fixed_point, 2, amount_usdt, balances, LP_tokens_issued, prices)
+  pool_id = pool.pool_id
   bump = pool.bump
 
   user_usdt_tkn_acc.transfer(
@@ -294,36 +463,32 @@ def deposit_usdt(user: Signer, user_usdt_tkn_acc: TokenAccount, user_lp_usdt_tkn
     authority = pool,
     to = user_lp_usdt_tkn_acc,
     amount = m,
-    signer = ['oamm', bump]
+    signer = ['oamm', pool_id, bump]
   )
 
-  pool.balance_usdt+=amount_usdt
-  pool.lp_usdt_tokens+=amount_lp_usdt
+  pool.balances[2]+=amount_usdt
+  pool.lp_tokens[2]+=amount_lp_usdt
 
-  print(f'User {user.key()} deposited {amount_usdt} USDT.')
+  emit_deposit_event(user.key(), pool.key(), 2, amount_usdt, amount_lp_usdt, prices)
 
 
 @instruction
-def withdraw_usdt(user: Signer, user_lp_usdt_tkn_acc: TokenAccount, user_usdc_tkn_acc: TokenAccount, user_usdt_tkn_acc: TokenAccount, pool: oamm, pool_usdc_tkn_acc: TokenAccount, pool_usdt_tkn_acc: TokenAccount, mint_lpusdt: TokenMint, amount_lp_usdt: f64, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
+def withdraw_usdt(user: Signer, user_lp_usdt_tkn_acc: TokenAccount, user_usdc_tkn_acc: TokenAccount, user_usdt_tkn_acc: TokenAccount, pool: oamm, config: oamm_config, cache: price_cache, clock: Clock, pool_usdc_tkn_acc: TokenAccount, pool_usdt_tkn_acc: TokenAccount, mint_lpusdt: TokenMint, amount_lp_usdt: f64, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
   # We check accounts and mints.
-  owner_pubkey, mint_usdc_pubkey, mint_usdt_pubkey, pool_pubkey, pool_usdc_token_account_pubkey, pool_usdt_token_account_pubkey, pool_mint_lp_sol_pubkey, pool_mint_lp_usdc_pubkey, pool_mint_lp_usdt_pubkey, fee_account_sol_pubkey, fee_account_usdc_pubkey, fee_account_usdt_pubkey = get_public_keys()
-  assert str(mint_lpusdt.key()) == pool_mint_lp_usdt_pubkey, "Invalid TokenMint account."
-  assert str(pool.key()) == pool_pubkey, "Invalid pool account."
-  assert str(pool_usdc_tkn_acc.key()) == pool_usdc_token_account_pubkey, "Invalid pool token account."
-  assert str(pool_usdt_tkn_acc.key()) == pool_usdt_token_account_pubkey, "Invalid pool token account."
+  assert mint_lpusdt.key() == pool.lp_mints[2], "Invalid TokenMint account."
+  assert config.key() == pool.config, "Invalid config account."
+  assert pool_usdc_tkn_acc.key() == pool.token_accounts[1], "Invalid pool token account."
+  assert pool_usdt_tkn_acc.key() == pool.token_accounts[2], "Invalid pool token account."
 
-  balances = array(pool.balance_sol,pool.balance_usdc,pool.balance_usdt)
-  LP_tokens_issued = array(pool.lp_sol_tokens,pool.lp_usdc_tokens,pool.lp_usdt_tokens)
+  balances = pool.balances
+  LP_tokens_issued = pool.lp_tokens
 
-  x,y,z = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
-  prices = array(x,y,z)
+  prices = cached_prices(pool, cache, clock, price_account_sol, price_account_usdc, price_account_usdt)
   #prices = array(20.0,1.0,1.0) # take from oracle
-  delta=pool.delta
-  amount_sol_out,amount_usdc_out,amount_usdt_out,ao,remaining = single_asset_withdrawal(2, amount_lp_usdt, balances, LP_tokens_issued, prices,delta)
-
-  amount_lp_usdt_to_burn=amount_lp_usdt*(ao-remaining)/ao
-  n_lp_usdt = f64_to_u64_9_decimal_places(amount_lp_usdt_to_burn)
+  delta=config.delta
+  amounts_out,amount_lp_usdt_to_burn,n_out,n_lp_usdt = single_asset_withdrawal_amounts(config.fixed_point, 2, amount_lp_usdt, balances, LP_tokens_issued, prices, delta)
 
+  pool_id = pool.pool_id
   bump = pool.bump
 
   mint_lpusdt.burn(
@@ -331,494 +496,271 @@ def withdraw_usdt(user: Signer, user_lp_usdt_tkn_acc: TokenAccount, user_usdc_tk
     holder = user_lp_usdt_tkn_acc,
     amount = n_lp_usdt
   )
-  pool.lp_usdt_tokens-=amount_lp_usdt_to_burn
-  print(f'{amount_lp_usdt_to_burn} LPUSDC burned from user {user.key()}.')
+  pool.lp_tokens[2]-=amount_lp_usdt_to_burn
 
-  if amount_usdc_out != 0.0:
-    n_usdc = f64_to_u64_9_decimal_places(amount_usdc_out)
+  if amounts_out[1] != 0.0:
     pool_usdc_tkn_acc.transfer(
       authority = pool,
       to = user_usdc_tkn_acc,
-      amount = n_usdc,
-      signer = ['oamm', bump]
+      amount = n_out[1],
+      signer = ['oamm', pool_id, bump]
     )
-    pool.balance_usdc-=amount_usdc_out
-    print(f'User {user.key()} withdrew {amount_usdc_out} USDC.')
+    pool.balances[1]-=amounts_out[1]
 
-  if amount_usdt_out != 0.0:
-    n_usdt = f64_to_u64_9_decimal_places(amount_usdt_out)
+  if amounts_out[2] != 0.0:
     pool_usdt_tkn_acc.transfer(
       authority = pool,
       to = user_usdt_tkn_acc,
-      amount = n_usdt,
-      signer = ['oamm', bump]
+      amount = n_out[2],
+      signer = ['oamm', pool_id, bump]
     )
-    pool.balance_usdt-=amount_usdt_out
-    print(f'User {user.key()} withdrew {amount_usdt_out} USDT.')
+    pool.balances[2]-=amounts_out[2]
 
-  if amount_sol_out != 0.0:
-    n_sol = f64_to_u64_9_decimal_places(amount_sol_out)
+  if amounts_out[0] != 0.0:
     pool.transfer_lamports(
       to = user,
-      amount = n_sol
-    )
-    pool.balance_sol-=amount_sol_out
-    print(f'User {user.key()} withdrew {amount_sol_out} SOL.')
-
-
-@instruction
-def trade_sol_in(user: Signer, user_usd_tkn_acc: TokenAccount, pool: oamm, pool_usd_tkn_acc: TokenAccount, amount_sol_in: f64, amount_usd_out: f64, token_out: str, fee_acc_sol: UncheckedAccount, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
-  # We check accounts and mints.
-  owner_pubkey, mint_usdc_pubkey, mint_usdt_pubkey, pool_pubkey, pool_usdc_token_account_pubkey, pool_usdt_token_account_pubkey, pool_mint_lp_sol_pubkey, pool_mint_lp_usdc_pubkey, pool_mint_lp_usdt_pubkey, fee_account_sol_pubkey, fee_account_usdc_pubkey, fee_account_usdt_pubkey = get_public_keys()
-  assert str(pool.key()) == pool_pubkey, "Invalid pool account."
-  assert str(fee_acc_sol.key()) == fee_account_sol_pubkey, "Invalid fee account."
-
-  out=[0]
-
-  if token_out == 'USDC':
-    assert str(pool_usd_tkn_acc.key()) == pool_usdc_token_account_pubkey, "Invalid pool token account."
-    out[0]=1
-  elif token_out == 'USDT':
-    assert str(pool_usd_tkn_acc.key()) == pool_usdt_token_account_pubkey, "Invalid pool token account."
-    out[0]=2
-  else:
-    return None
-
-  o=out[0]
-
-  balances = array(pool.balance_sol,pool.balance_usdc,pool.balance_usdt)
-  LP_tokens_issued = array(pool.lp_sol_tokens,pool.lp_usdc_tokens,pool.lp_usdt_tokens)
-
-  x,y,z = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
-  prices = array(x,y,z)
-  #prices = array(20.0,1.0,1.0) # take from oracle
-  delta=pool.delta
-  fee=pool.base_fee
-  protocol_fee=pool.protocol_fee
-  delta=pool.delta
-  leverage=pool.base_leverage
-
-  if amount_sol_in != 0.0:
-
-    balances_copy_1=array(balances[0],balances[1],balances[2])
-    LP_tokens_issued_copy_1=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-    prices_copy_1=array(prices[0],prices[1],prices[2])
-
-    ao,pr_fee,execute_trade=trade_i(0,o,amount_sol_in, balances_copy_1, LP_tokens_issued_copy_1, prices_copy_1,fee,protocol_fee,leverage,delta)
-
-    if not execute_trade:
-      print('Trade not performed.')
-      return None
-
-    amount_in = f64_to_u64_9_decimal_places(amount_sol_in)
-    n_pr_fee = f64_to_u64_9_decimal_places(pr_fee)
-    amount_out = f64_to_u64_9_decimal_places(ao)
-
-    bump = pool.bump
-
-    pool_usd_tkn_acc.transfer(
-      authority = pool,
-      to = user_usd_tkn_acc,
-      amount = amount_out,
-      signer = ['oamm', bump]
-    )
-    if token_out == 'USDC':
-      pool.balance_usdc-=ao
-    elif token_out == 'USDT':
-      pool.balance_usdt-=ao
-
-    user.transfer_lamports(
-      to = pool,
-      amount = amount_in
+      amount = n_out[0]
     )
-    pool.transfer_lamports(
-      to = fee_acc_sol,
-      amount = n_pr_fee
-    )
-    pool.balance_sol+=amount_sol_in-pr_fee
-
-  if amount_sol_in == 0.0:
+    pool.balances[0]-=amounts_out[0]
 
-    balances_copy_2=array(balances[0],balances[1],balances[2])
-    LP_tokens_issued_copy_2=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-    prices_copy_2=array(prices[0],prices[1],prices[2])
+  emit_withdrawal_event(user.key(), pool.key(), 2, amounts_out, amount_lp_usdt_to_burn, prices)
 
-    ai,pr_fee,execute_trade=trade_o(0,o,amount_usd_out, balances_copy_2, LP_tokens_issued_copy_2, prices_copy_2,fee,protocol_fee,leverage,delta)
 
-    if not execute_trade:
+@instruction
+def swap(user: Signer, user_tkn_acc_in: TokenAccount, user_tkn_acc_out: TokenAccount, pool: oamm, config: oamm_config, cache: price_cache, clock: Clock, pool_tkn_acc_in: TokenAccount, pool_tkn_acc_out: TokenAccount, i: u8, o: u8, amount: f64, exact_in: bool, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
+  # Token i goes into the pool and token o goes out (0: SOL, 1: USDC, 2: USDT). If exact_in, amount is the
+  # amount of token i to deposit; otherwise it is the amount of token o to obtain. SOL is moved as lamports
+  # of the user and pool accounts, so the token accounts of a SOL leg are not used.
+  # We check accounts.
+  assert config.key() == pool.config, "Invalid config account."
+  assert i<N_TOKENS and o<N_TOKENS and i!=o, "Invalid pair of tokens."
+  if i!=0:
+    assert pool_tkn_acc_in.key() == pool.token_accounts[i], "Invalid pool token account."
+  if o!=0:
+    assert pool_tkn_acc_out.key() == pool.token_accounts[o], "Invalid pool token account."
+
+  balances = pool.balances
+  LP_tokens_issued = pool.lp_tokens
+
+  prices = cached_prices(pool, cache, clock, price_account_sol, price_account_usdc, price_account_usdt)
+
+  ai,ao,pr_fee,execute_trade,amount_in,n_pr_fee,amount_out=swap_amounts(config.fixed_point,i,o,amount,exact_in,balances,LP_tokens_issued,prices,config.base_fee,config.protocol_fee,config.base_leverage,config.delta)
+
+  if not execute_trade:
+    if log_enabled(LOG_SUMMARY):
       print('Trade not performed.')
-      return None
-
-
-    amount_in = f64_to_u64_9_decimal_places(ai)
-    n_pr_fee = f64_to_u64_9_decimal_places(pr_fee)
-    amount_out = f64_to_u64_9_decimal_places(amount_usd_out)
-
-
-    bump = pool.bump
+    return None
 
-    pool_usd_tkn_acc.transfer(
-      authority = pool,
-      to = user_usd_tkn_acc,
-      amount = amount_out,
-      signer = ['oamm', bump]
-    )
-    if token_out == 'USDC':
-      pool.balance_usdc-=amount_usd_out
-    elif token_out == 'USDT':
-      pool.balance_usdt-=amount_usd_out
+  pool_id = pool.pool_id
+  bump = pool.bump
 
+  if i==0:
     user.transfer_lamports(
       to = pool,
       amount = amount_in
     )
-    pool.transfer_lamports(
-      to = fee_acc_sol,
-      amount = n_pr_fee
-    )
-    pool.balance_sol+=ai-pr_fee
-
-@instruction
-def trade_sol_out(user: Signer, user_usd_tkn_acc: TokenAccount, pool: oamm, pool_usd_tkn_acc: TokenAccount, amount_usd_in: f64, amount_sol_out: f64, token_in: str, fee_acc_usd: TokenAccount, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
-  # We check accounts and mints.
-  owner_pubkey, mint_usdc_pubkey, mint_usdt_pubkey, pool_pubkey, pool_usdc_token_account_pubkey, pool_usdt_token_account_pubkey, pool_mint_lp_sol_pubkey, pool_mint_lp_usdc_pubkey, pool_mint_lp_usdt_pubkey, fee_account_sol_pubkey, fee_account_usdc_pubkey, fee_account_usdt_pubkey = get_public_keys()
-  assert str(pool.key()) == pool_pubkey, "Invalid pool account."
-
-  tok_in=[0]
-
-  if token_in == 'USDC':
-    assert str(pool_usd_tkn_acc.key()) == pool_usdc_token_account_pubkey, "Invalid pool token account."
-    assert str(fee_acc_usd.key()) == fee_account_usdc_pubkey, "Invalid fee account."
-    tok_in[0]=1
-  elif token_in == 'USDT':
-    assert str(pool_usd_tkn_acc.key()) == pool_usdt_token_account_pubkey, "Invalid pool token account."
-    assert str(fee_acc_usd.key()) == fee_account_usdt_pubkey, "Invalid fee account."
-    tok_in[0]=2
   else:
-    return None
-
-  i=tok_in[0]
-
-  balances = array(pool.balance_sol,pool.balance_usdc,pool.balance_usdt)
-  LP_tokens_issued = array(pool.lp_sol_tokens,pool.lp_usdc_tokens,pool.lp_usdt_tokens)
-
-  x,y,z = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
-  prices = array(x,y,z)
-  #prices = array(20.0,1.0,1.0) # take from oracle
-  delta=pool.delta
-  fee=pool.base_fee
-  protocol_fee=pool.protocol_fee
-  delta=pool.delta
-  leverage=pool.base_leverage
-
-  if amount_usd_in != 0.0:
-
-    balances_copy_1=array(balances[0],balances[1],balances[2])
-    LP_tokens_issued_copy_1=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-    prices_copy_1=array(prices[0],prices[1],prices[2])
-
-    ao,pr_fee,execute_trade=trade_i(i,0,amount_usd_in, balances_copy_1, LP_tokens_issued_copy_1, prices_copy_1,fee,protocol_fee,leverage,delta)
-
-    if not execute_trade:
-      print('Trade not performed.')
-      return None
-
-
-    amount_in = f64_to_u64_9_decimal_places(amount_usd_in)
-    n_pr_fee = f64_to_u64_9_decimal_places(pr_fee)
-    amount_out = f64_to_u64_9_decimal_places(ao)
-    bump = pool.bump
-
-    user_usd_tkn_acc.transfer(
+    user_tkn_acc_in.transfer(
       authority = user,
-      to = pool_usd_tkn_acc,
+      to = pool_tkn_acc_in,
       amount = amount_in
     )
-    pool_usd_tkn_acc.transfer(
-      authority = pool,
-      to = fee_acc_usd,
-      amount = n_pr_fee,
-      signer = ['oamm', bump]
-    )
-    if token_in == 'USDC':
-      pool.balance_usdc+=amount_usd_in-pr_fee
-    elif token_in == 'USDT':
-      pool.balance_usdt+=amount_usd_in-pr_fee
+  pool.balances[i]+=ai-pr_fee
+  pool.fees[i]+=n_pr_fee
 
+  if o==0:
     pool.transfer_lamports(
       to = user,
       amount = amount_out
     )
-    pool.balance_sol-=ao
-
-  if amount_usd_in == 0.0:
-
-    balances_copy_2=array(balances[0],balances[1],balances[2])
-    LP_tokens_issued_copy_2=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-    prices_copy_2=array(prices[0],prices[1],prices[2])
-
-    ai,pr_fee,execute_trade=trade_o(i,0,amount_sol_out, balances_copy_2, LP_tokens_issued_copy_2, prices_copy_2,fee,protocol_fee,leverage,delta)
-
-    if not execute_trade:
-      print('Trade not performed.')
-      return None
+  else:
+    pool_tkn_acc_out.transfer(
+      authority = pool,
+      to = user_tkn_acc_out,
+      amount = amount_out,
+      signer = ['oamm', pool_id, bump]
+    )
+  pool.balances[o]-=ao
 
+  emit_trade_event(user.key(), pool.key(), i, o, ai, ao, pr_fee, prices)
 
-    amount_in = f64_to_u64_9_decimal_places(ai)
-    n_pr_fee = f64_to_u64_9_decimal_places(pr_fee)
-    amount_out = f64_to_u64_9_decimal_places(amount_sol_out)
-    bump = pool.bump
+@instruction
+def multi_swap(user: Signer, user_usdc_tkn_acc: TokenAccount, user_usdt_tkn_acc: TokenAccount, pool: oamm, config: oamm_config, cache: price_cache, clock: Clock, pool_usdc_tkn_acc: TokenAccount, pool_usdt_tkn_acc: TokenAccount, n: u8, tokens_in: Array[u8,4], tokens_out: Array[u8,4], amounts: Array[f64,4], exact_in: Array[bool,4], price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
+  # Performs the first n (at most 4) swaps described by tokens_in[k], tokens_out[k], amounts[k] and
+  # exact_in[k] (see swap) one after the other. Accounts are checked and prices are read once, every swap
+  # prices against the state left by the previous ones, and the transfers are netted per token, so each
+  # token moves at most once. If any swap is rejected, the whole instruction fails.
+  # We check accounts.
+  assert config.key() == pool.config, "Invalid config account."
+  assert pool_usdc_tkn_acc.key() == pool.token_accounts[1], "Invalid pool token account."
+  assert pool_usdt_tkn_acc.key() == pool.token_accounts[2], "Invalid pool token account."
+  assert n<=4, "At most 4 swaps per instruction."
+
+  balances = pool.balances
+  LP_tokens_issued = pool.lp_tokens
+
+  prices = cached_prices(pool, cache, clock, price_account_sol, price_account_usdc, price_account_usdt)
+
+  # Native amounts that go into and out of the pool, and protocol fees, per token.
+  n_in = zeros_u64()
+  n_out = zeros_u64()
+  n_fees = zeros_u64()
+
+  for k in range(n):
+    i=tokens_in[k]
+    o=tokens_out[k]
+    assert i<N_TOKENS and o<N_TOKENS and i!=o, "Invalid pair of tokens."
+    ai,ao,pr_fee,execute_trade,amount_in,n_pr_fee,amount_out=swap_amounts(config.fixed_point,i,o,amounts[k],exact_in[k],balances,LP_tokens_issued,prices,config.base_fee,config.protocol_fee,config.base_leverage,config.delta)
+    assert execute_trade, "Trade not performed."
+    balances[i]+=ai-pr_fee
+    balances[o]-=ao
+    n_in[i]+=amount_in
+    n_fees[i]+=n_pr_fee
+    n_out[o]+=amount_out
+    emit_trade_event(user.key(), pool.key(), i, o, ai, ao, pr_fee, prices)
+
+  pool_id = pool.pool_id
+  bump = pool.bump
 
-    user_usd_tkn_acc.transfer(
-      authority = user,
-      to = pool_usd_tkn_acc,
-      amount = amount_in
-    )
-    pool_usd_tkn_acc.transfer(
-      authority = pool,
-      to = fee_acc_usd,
-      amount = n_pr_fee,
-      signer = ['oamm', bump]
+  if n_in[0]>n_out[0]:
+    user.transfer_lamports(
+      to = pool,
+      amount = n_in[0]-n_out[0]
     )
-    if token_in == 'USDC':
-      pool.balance_usdc+=ai-pr_fee
-    elif token_in == 'USDT':
-      pool.balance_usdt+=ai-pr_fee
-
+  if n_out[0]>n_in[0]:
     pool.transfer_lamports(
       to = user,
-      amount = amount_out
+      amount = n_out[0]-n_in[0]
     )
-    pool.balance_sol-=amount_sol_out
-
-
-@instruction
-def trade_usdc_in_usdt_out(user: Signer, user_usdc_tkn_acc: TokenAccount, user_usdt_tkn_acc: TokenAccount, pool: oamm, pool_usdc_tkn_acc: TokenAccount, pool_usdt_tkn_acc: TokenAccount, amount_usdc_in: f64, amount_usdt_out: f64, fee_acc_usdc: TokenAccount, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
-  # We check accounts and mints.
-  owner_pubkey, mint_usdc_pubkey, mint_usdt_pubkey, pool_pubkey, pool_usdc_token_account_pubkey, pool_usdt_token_account_pubkey, pool_mint_lp_sol_pubkey, pool_mint_lp_usdc_pubkey, pool_mint_lp_usdt_pubkey, fee_account_sol_pubkey, fee_account_usdc_pubkey, fee_account_usdt_pubkey = get_public_keys()
-  assert str(pool.key()) == pool_pubkey, "Invalid pool account."
-  assert str(pool_usdc_tkn_acc.key()) == pool_usdc_token_account_pubkey, "Invalid pool token account."
-  assert str(pool_usdt_tkn_acc.key()) == pool_usdt_token_account_pubkey, "Invalid pool token account."
-  assert str(fee_acc_usdc.key()) == fee_account_usdc_pubkey, "Invalid fee account."
-
-  balances = array(pool.balance_sol,pool.balance_usdc,pool.balance_usdt)
-  LP_tokens_issued = array(pool.lp_sol_tokens,pool.lp_usdc_tokens,pool.lp_usdt_tokens)
-
-  x,y,z = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
-  prices = array(x,y,z)
-  #prices = array(20.0,1.0,1.0) # take from oracle
-  delta=pool.delta
-  fee=pool.base_fee
-  protocol_fee=pool.protocol_fee
-  delta=pool.delta
-  leverage=pool.base_leverage
-
-  if amount_usdc_in != 0.0:
-
-    balances_copy_1=array(balances[0],balances[1],balances[2])
-    LP_tokens_issued_copy_1=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-    prices_copy_1=array(prices[0],prices[1],prices[2])
-
-    ao,pr_fee,execute_trade=trade_i(1,2,amount_usdc_in, balances_copy_1, LP_tokens_issued_copy_1, prices_copy_1,fee,protocol_fee,leverage,delta)
-
-    if not execute_trade:
-      print('Trade not performed.')
-      return None
-
-
-    amount_in = f64_to_u64_9_decimal_places(amount_usdc_in)
-    n_pr_fee = f64_to_u64_9_decimal_places(pr_fee)
-    amount_out = f64_to_u64_9_decimal_places(ao)
-    bump = pool.bump
 
+  if n_in[1]>n_out[1]:
     user_usdc_tkn_acc.transfer(
       authority = user,
       to = pool_usdc_tkn_acc,
-      amount = amount_in
+      amount = n_in[1]-n_out[1]
     )
+  if n_out[1]>n_in[1]:
     pool_usdc_tkn_acc.transfer(
       authority = pool,
-      to = fee_acc_usdc,
-      amount = n_pr_fee,
-      signer = ['oamm', bump]
-    )
-
-    pool.balance_usdc+=amount_usdc_in-pr_fee
-
-    pool_usdt_tkn_acc.transfer(
-      authority = pool,
-      to = user_usdt_tkn_acc,
-      amount = amount_out,
-      signer = ['oamm', bump]
+      to = user_usdc_tkn_acc,
+      amount = n_out[1]-n_in[1],
+      signer = ['oamm', pool_id, bump]
     )
 
-    pool.balance_usdt-=ao
-
-
-  if amount_usdc_in == 0.0:
-
-    balances_copy_2=array(balances[0],balances[1],balances[2])
-    LP_tokens_issued_copy_2=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-    prices_copy_2=array(prices[0],prices[1],prices[2])
-
-    ai,pr_fee,execute_trade=trade_o(1,2,amount_usdt_out, balances_copy_2, LP_tokens_issued_copy_2, prices_copy_2,fee,protocol_fee,leverage,delta)
-
-    if not execute_trade:
-      print('Trade not performed.')
-      return None
-
-
-    amount_in = f64_to_u64_9_decimal_places(ai)
-    n_pr_fee = f64_to_u64_9_decimal_places(pr_fee)
-    amount_out = f64_to_u64_9_decimal_places(amount_usdt_out)
-    bump = pool.bump
-
-    user_usdc_tkn_acc.transfer(
+  if n_in[2]>n_out[2]:
+    user_usdt_tkn_acc.transfer(
       authority = user,
-      to = pool_usdc_tkn_acc,
-      amount = amount_in
-    )
-    pool_usdc_tkn_acc.transfer(
-      authority = pool,
-      to = fee_acc_usdc,
-      amount = n_pr_fee,
-      signer = ['oamm', bump]
+      to = pool_usdt_tkn_acc,
+      amount = n_in[2]-n_out[2]
     )
-
-    pool.balance_usdc+=ai-pr_fee
-
+  if n_out[2]>n_in[2]:
     pool_usdt_tkn_acc.transfer(
       authority = pool,
       to = user_usdt_tkn_acc,
-      amount = amount_out,
-      signer = ['oamm', bump]
+      amount = n_out[2]-n_in[2],
+      signer = ['oamm', pool_id, bump]
     )
-    pool.balance_usdt-=amount_usdt_out
-
 
+  pool.balances=balances
+  for j in range(N_TOKENS):
+    pool.fees[j]+=n_fees[j]
 
 @instruction
-def trade_usdt_in_usdc_out(user: Signer, user_usdc_tkn_acc: TokenAccount, user_usdt_tkn_acc: TokenAccount, pool: oamm, pool_usdc_tkn_acc: TokenAccount, pool_usdt_tkn_acc: TokenAccount, amount_usdt_in: f64, amount_usdc_out: f64, fee_acc_usdt: TokenAccount, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
-  # We check accounts and mints.
-  owner_pubkey, mint_usdc_pubkey, mint_usdt_pubkey, pool_pubkey, pool_usdc_token_account_pubkey, pool_usdt_token_account_pubkey, pool_mint_lp_sol_pubkey, pool_mint_lp_usdc_pubkey, pool_mint_lp_usdt_pubkey, fee_account_sol_pubkey, fee_account_usdc_pubkey, fee_account_usdt_pubkey = get_public_keys()
-  assert str(pool.key()) == pool_pubkey, "Invalid pool account."
-  assert str(pool_usdc_tkn_acc.key()) == pool_usdc_token_account_pubkey, "Invalid pool token account."
-  assert str(pool_usdt_tkn_acc.key()) == pool_usdt_token_account_pubkey, "Invalid pool token account."
-  assert str(fee_acc_usdt.key()) == fee_account_usdt_pubkey, "Invalid fee account."
+def quote(pool: oamm, config: oamm_config, cache: price_cache, clock: Clock, i: u8, o: u8, amount: f64, exact_in: bool, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
+  # Quotes a swap with the same arguments without performing it, as a QuoteEvent. The pool and config
+  # accounts are only read, so quotes (e.g. simulated transactions) never write-lock the pool.
+  assert config.key() == pool.config, "Invalid config account."
+  assert i<N_TOKENS and o<N_TOKENS and i!=o, "Invalid pair of tokens."
 
-  balances = array(pool.balance_sol,pool.balance_usdc,pool.balance_usdt)
-  LP_tokens_issued = array(pool.lp_sol_tokens,pool.lp_usdc_tokens,pool.lp_usdt_tokens)
+  # The cache is only read, so that quotes never write-lock it either.
+  assert cache.pool == pool.key(), "Invalid price cache account."
+  prices = cache.prices
+  if cache.slot != clock.slot():
+    prices = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
 
-  x,y,z = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
-  prices = array(x,y,z)
-  #prices = array(20.0,1.0,1.0) # take from oracle
-  delta=pool.delta
-  fee=pool.base_fee
-  protocol_fee=pool.protocol_fee
-  delta=pool.delta
-  leverage=pool.base_leverage
-
-  if amount_usdt_in != 0.0:
+  ai,ao,pr_fee,trading_fee,trading_leverage,ri_after,ro_after,execute_trade=swap_quote(config.fixed_point,i,o,amount,exact_in,pool.balances,pool.lp_tokens,prices,config.base_fee,config.protocol_fee,config.base_leverage,config.delta)
 
-    balances_copy_1=array(balances[0],balances[1],balances[2])
-    LP_tokens_issued_copy_1=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-    prices_copy_1=array(prices[0],prices[1],prices[2])
-
-    ao,pr_fee,execute_trade=trade_i(2,1,amount_usdt_in, balances_copy_1, LP_tokens_issued_copy_1, prices_copy_1,fee,protocol_fee,leverage,delta)
-
-    if not execute_trade:
-      print('Trade not performed.')
-      return None
+  QuoteEvent(pool.key(), i, o, ai, ao, pr_fee, trading_fee, trading_leverage, ri_after, ro_after, execute_trade).emit()
 
+@instruction
+def sweep_fees(owner: Signer, pool: oamm, pool_usdc_tkn_acc: TokenAccount, pool_usdt_tkn_acc: TokenAccount, fee_acc_sol: UncheckedAccount, fee_acc_usdc: TokenAccount, fee_acc_usdt: TokenAccount):
+  # We check accounts.
+  assert owner.key() == OWNER, "You are not allowed to call this instruction."
+  assert pool_usdc_tkn_acc.key() == pool.token_accounts[1], "Invalid pool token account."
+  assert pool_usdt_tkn_acc.key() == pool.token_accounts[2], "Invalid pool token account."
+  assert fee_acc_sol.key() == FEE_ACCOUNT_SOL, "Invalid fee account."
+  assert fee_acc_usdc.key() == FEE_ACCOUNT_USDC, "Invalid fee account."
+  assert fee_acc_usdt.key() == FEE_ACCOUNT_USDT, "Invalid fee account."
+
+  pool_id = pool.pool_id
+  bump = pool.bump
 
-    amount_in = f64_to_u64_9_decimal_places(amount_usdt_in)
-    n_pr_fee = f64_to_u64_9_decimal_places(pr_fee)
-    amount_out = f64_to_u64_9_decimal_places(ao)
-    bump = pool.bump
+  fees=pool.fees
 
-    user_usdt_tkn_acc.transfer(
-      authority = user,
-      to = pool_usdt_tkn_acc,
-      amount = amount_in
-    )
-    pool_usdt_tkn_acc.transfer(
-      authority = pool,
-      to = fee_acc_usdt,
-      amount = n_pr_fee,
-      signer = ['oamm', bump]
+  if fees[0] != 0:
+    pool.transfer_lamports(
+      to = fee_acc_sol,
+      amount = fees[0]
     )
+    pool.fees[0]=u64(0)
 
-    pool.balance_usdt+=amount_usdt_in-pr_fee
-
+  if fees[1] != 0:
     pool_usdc_tkn_acc.transfer(
       authority = pool,
-      to = user_usdc_tkn_acc,
-      amount = amount_out,
-      signer = ['oamm', bump]
+      to = fee_acc_usdc,
+      amount = fees[1],
+      signer = ['oamm', pool_id, bump]
     )
-    pool.balance_usdc-=ao
-
-
-
-  if amount_usdt_in == 0.0:
-
-    balances_copy_2=array(balances[0],balances[1],balances[2])
-    LP_tokens_issued_copy_2=array(LP_tokens_issued[0],LP_tokens_issued[1],LP_tokens_issued[2])
-    prices_copy_2=array(prices[0],prices[1],prices[2])
-
-    ai,pr_fee,execute_trade=trade_o(2,1,amount_usdc_out, balances_copy_2, LP_tokens_issued_copy_2, prices_copy_2,fee,protocol_fee,leverage,delta)
-
-    if not execute_trade:
-      print('Trade not performed.')
-      return None
-
+    pool.fees[1]=u64(0)
 
-    amount_in = f64_to_u64_9_decimal_places(ai)
-    n_pr_fee = f64_to_u64_9_decimal_places(pr_fee)
-    amount_out = f64_to_u64_9_decimal_places(amount_usdc_out)
-    bump = pool.bump
-
-    user_usdt_tkn_acc.transfer(
-      authority = user,
-      to = pool_usdt_tkn_acc,
-      amount = amount_in
-    )
+  if fees[2] != 0:
     pool_usdt_tkn_acc.transfer(
       authority = pool,
       to = fee_acc_usdt,
-      amount = n_pr_fee,
-      signer = ['oamm', bump]
+      amount = fees[2],
+      signer = ['oamm', pool_id, bump]
     )
+    pool.fees[2]=u64(0)
 
-    pool.balance_usdt+=ai-pr_fee
-
-    pool_usdc_tkn_acc.transfer(
-      authority = pool,
-      to = user_usdc_tkn_acc,
-      amount = amount_out,
-      signer = ['oamm', bump]
-    )
-
-    pool.balance_usdc-=amount_usdc_out
-
+  if log_enabled(LOG_SUMMARY):
+    print(f'Protocol fees swept: {fees[0]} SOL - {fees[1]} USDC - {fees[2]} USDT (native units).')
 
 @instruction
 def pool_state(user: Signer, pool: oamm, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount):
-  print(f'Balances: {pool.balance_sol} SOL - {pool.balance_usdc} USDC - {pool.balance_usdt} USDT.')
-  print(f'LP tokens issued: {pool.lp_sol_tokens} LPSOL - {pool.lp_usdc_tokens} LPUSDC - {pool.lp_usdt_tokens} LPUSDT.')
+  print(f'Balances: {pool.balances[0]} SOL - {pool.balances[1]} USDC - {pool.balances[2]} USDT.')
+  print(f'LP tokens issued: {pool.lp_tokens[0]} LPSOL - {pool.lp_tokens[1]} LPUSDC - {pool.lp_tokens[2]} LPUSDT.')
 
-  balances = array(pool.balance_sol, pool.balance_usdc, pool.balance_usdt)
-  LP_tokens_issued = array(pool.lp_sol_tokens,pool.lp_usdc_tokens,pool.lp_usdt_tokens)
+  balances = pool.balances
+  LP_tokens_issued = pool.lp_tokens
 
-  x,y,z = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
-  prices = array(x,y,z)
+  prices = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
   #prices = array(20.0,1.0,1.0) # take from oracle
   imb_ratios = imbalance_ratios(balances, LP_tokens_issued, prices)
 
   print(f'Imbalance ratios: {imb_ratios[0]}, {imb_ratios[1]}, {imb_ratios[2]}.')
 
 
-def retrieve_prices(price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount) -> Tuple[f64,f64,f64]:
+def cached_prices(pool: oamm, cache: price_cache, clock: Clock, price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount) -> Array[f64,3]:
+  # Returns the prices cached in the current slot, or reads them from the price accounts and caches
+  # them. The price accounts are not parsed when the cache is used, but their keys are still checked
+  # against the feeds that retrieve_prices validates. The aggregate price of a feed changes at most
+  # once per slot, so a price cached before that change is one aggregate behind for the rest of the
+  # slot.
+  assert cache.pool == pool.key(), "Invalid price cache account."
+  prices = cache.prices
+  slot = clock.slot()
+  if cache.slot != slot:
+    prices = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
+    cache.slot = slot
+    cache.prices = prices
+  else:
+    # Like retrieve_prices, which does not read the USDC feed yet, only SOL and USDT are checked.
+    assert price_account_sol.key() == PRICE_ACCOUNT_SOL, "Invalid price account."
+    assert price_account_usdt.key() == PRICE_ACCOUNT_USDT, "Invalid price account."
+  return prices
+
+
+def retrieve_prices(price_account_sol: PriceAccount, price_account_usdc: PriceAccount, price_account_usdt: PriceAccount) -> Array[f64,3]:
   price_feed = price_account_sol.validate_price_feed('devnet-SOL/USD')
   price = price_feed.get_price()
   x: f64 = price.num()
@@ -830,7 +772,7 @@ def retrieve_prices(price_account_sol: PriceAccount, price_account_usdc: PriceAc
   price = price_feed.get_price()
   z: f64 = price.num()
   print(f'The current prices are: {x}, {y}, {z}.')
-  return x,y,z
+  return array(x,y,z)
 
 
 # The following instructions are for testing purposes only.
@@ -838,13 +780,13 @@ def retrieve_prices(price_account_sol: PriceAccount, price_account_usdc: PriceAc
 
 @instruction
 def update_pool_state(user: Signer, pool: oamm, sol_update: f64, usdc_update: f64, usdt_update: f64, lp_sol_update: f64, lp_usdc_update: f64, lp_usdt_update: f64):
-    assert str(user.key()) == 'DzgBxedPKCuWbK4a4P9Bj4nNdayVzZEqc7n6YZ1A4sLa', "You are not allowed to call this instruction."
-    pool.balance_sol+=sol_update
-    pool.balance_usdc+=usdc_update
-    pool.balance_usdt+=usdt_update
-    pool.lp_sol_tokens+=lp_sol_update
-    pool.lp_usdc_tokens+=lp_usdc_update
-    pool.lp_usdt_tokens+=lp_usdt_update
+    assert user.key() == OWNER, "You are not allowed to call this instruction."
+    d_balances=array(sol_update,usdc_update,usdt_update)
+    d_lp_tokens=array(lp_sol_update,lp_usdc_update,lp_usdt_update)
+    for j in range(N_TOKENS):
+      pool.balances[j]+=d_balances[j]
+      pool.lp_tokens[j]+=d_lp_tokens[j]
+    PoolEvent(EVENT_UPDATE, user.key(), pool.key(), u8(0), u8(0), d_balances, d_lp_tokens, zeros(), 0.0).emit()
 
 @instruction
 def test(signer: Signer, balancesol: f64, balanceusdc: f64, balanceusdt: f64, pricesol: f64 , priceusdc: f64, priceusdt: f64, lptoksol: f64,lptokusdc: f64,lptokusdt: f64, basefee: f64, protocolfee: f64, baseleverage: f64, delta: f64, i: u8, o: u8, amount: f64,inout: str):
@@ -886,7 +828,7 @@ def test(signer: Signer, balancesol: f64, balanceusdc: f64, balanceusdt: f64, pr
         balancearray4=array(balancesol,balanceusdc,balanceusdt)
         lptokenarray4=array(lptoksol,lptokusdc,lptokusdt)
         pricearray4=array(pricesol,priceusdc,priceusdt)
-        amount_sol_out,amount_usdc_out,amount_usdt_out,ao,a_remaining=single_asset_withdrawal(o, amount, balancearray4,lptokenarray4,pricearray4,delta)
+        amounts_out,ao,a_remaining=single_asset_withdrawal(o, amount, balancearray4,lptokenarray4,pricearray4,delta)
         if o==0:
           print(f'Withdrawal: User redeems {amount} LPSOL tokens.')
           print(f'User receives {ao-a_remaining} SOL (in value). There are {a_remaining} SOL remaining to give to the user.')
@@ -896,7 +838,7 @@ def test(signer: Signer, balancesol: f64, balanceusdc: f64, balanceusdt: f64, pr
         if o==2:
           print(f'Withdrawal: User redeems {amount} LPUSDT tokens.')
           print(f'User receives {ao-a_remaining} USDT (in value). There are {a_remaining} USDT remaining to give to the user.')
-        print(f'User receives {amount_sol_out} SOL, {amount_usdc_out} USDC and {amount_usdt_out} USDT.')
+        print(f'User receives {amounts_out[0]} SOL, {amounts_out[1]} USDC and {amounts_out[2]} USDT.')
 
 
 @instruction
@@ -913,8 +855,8 @@ def test_prices(price_account_sol: PriceAccount, price_account_usdc: PriceAccoun
   price = price_feed.get_price()
   z: f64 = price.num()
   print(z)
-  x,y,z = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
-  print(f'The current prices are: {x}, {y}, {z}.')
+  prices = retrieve_prices(price_account_sol, price_account_usdc, price_account_usdt)
+  print(f'The current prices are: {prices[0]}, {prices[1]}, {prices[2]}.')
 
 @instruction
 def test_USDC_price(price_account_usdc: PriceAccount):
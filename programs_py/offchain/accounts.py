@@ -0,0 +1,104 @@
+# oamm
+# Off-chain account decoder.
+#
+# Anchor stores an account as an 8-byte discriminator (the first bytes of
+# sha256("account:<name>")) followed by the Borsh encoding of its fields in
+# declaration order. Every field of oamm, oamm_config and price_cache is
+# fixed-size, so the data is a packed NumPy record: a buffer holding many
+# snapshots of the same account type back to back decodes with one
+# np.frombuffer call, without copying. The fields of the records are views into the buffer, e.g.
+# pools['balances'] is an (n, 3) float array that can be passed as is to
+# offchain.batch.trade_i_batch/trade_o_batch, and a single record can be passed
+# to offchain.quote.quote.
+
+import hashlib
+from typing import Iterable, Union
+
+import numpy as np
+
+OAMM_DISCRIMINATOR = hashlib.sha256(b'account:oamm').digest()[:8]
+CONFIG_DISCRIMINATOR = hashlib.sha256(b'account:oamm_config').digest()[:8]
+PRICE_CACHE_DISCRIMINATOR = hashlib.sha256(b'account:price_cache').digest()[:8]
+
+OAMM_DTYPE = np.dtype([
+    ('balances', '<f8', (3,)),
+    ('lp_tokens', '<f8', (3,)),
+    ('fees', '<u8', (3,)),
+    ('pool_id', '<u8'),
+    ('config', 'V32'),
+    ('mints', 'V32', (3,)),
+    ('token_accounts', 'V32', (3,)),
+    ('lp_mints', 'V32', (3,)),
+    ('bump', 'u1'),
+])
+
+CONFIG_DTYPE = np.dtype([
+    ('base_fee', '<f8'),
+    ('protocol_fee', '<f8'),
+    ('base_leverage', '<f8'),
+    ('delta', '<f8'),
+    ('fixed_point', '?'),
+])
+
+PRICE_CACHE_DTYPE = np.dtype([
+    ('pool', 'V32'),
+    ('slot', '<u8'),
+    ('prices', '<f8', (3,)),
+])
+
+Buffer = Union[bytes, bytearray, memoryview, np.ndarray]
+
+
+def _decode(data: Union[Buffer, Iterable[bytes]], dtype: np.dtype, discriminator: bytes) -> np.ndarray:
+    size = 8+dtype.itemsize
+    if isinstance(data, (bytes, bytearray, memoryview, np.ndarray)):
+        if memoryview(data).nbytes % size:
+            raise ValueError(f'Account data of {memoryview(data).nbytes} bytes, not a multiple of {size}.')
+    else:
+        # Separate buffers, e.g. from getProgramAccounts: join them (the only copy).
+        accounts = [bytes(x[:size]) for x in data]
+        if any(len(x) < size for x in accounts):
+            raise ValueError(f'Account data shorter than {size} bytes.')
+        data = b''.join(accounts)
+    raw = np.frombuffer(data, dtype=np.dtype([('discriminator', 'V8'), ('data', dtype)]))
+    if not (raw['discriminator'] == np.void(discriminator)).all():
+        raise ValueError('Account data of another type.')
+    return raw['data']
+
+
+def decode_pools(data: Union[Buffer, Iterable[bytes]]) -> np.ndarray:
+    """Returns the oamm accounts in data as an array of OAMM_DTYPE records.
+
+    data is either one buffer holding whole accounts back to back, each
+    exactly 8+OAMM_DTYPE.itemsize bytes (decoded in place), or an iterable of
+    the data of single accounts, which may be longer than the account
+    (trailing bytes are ignored). Raises ValueError on shorter data.
+    """
+    return _decode(data, OAMM_DTYPE, OAMM_DISCRIMINATOR)
+
+
+def decode_configs(data: Union[Buffer, Iterable[bytes]]) -> np.ndarray:
+    """Returns the oamm_config accounts in data as an array of CONFIG_DTYPE records, taking data
+    like decode_pools."""
+    return _decode(data, CONFIG_DTYPE, CONFIG_DISCRIMINATOR)
+
+
+def decode_price_caches(data: Union[Buffer, Iterable[bytes]]) -> np.ndarray:
+    """Returns the price_cache accounts in data as an array of PRICE_CACHE_DTYPE records, taking
+    data like decode_pools."""
+    return _decode(data, PRICE_CACHE_DTYPE, PRICE_CACHE_DISCRIMINATOR)
+
+
+def encode_pool(pool: np.void) -> bytes:
+    """Returns the account data of an OAMM_DTYPE record."""
+    return OAMM_DISCRIMINATOR+np.asarray(pool, dtype=OAMM_DTYPE).tobytes()
+
+
+def encode_config(config: np.void) -> bytes:
+    """Returns the account data of a CONFIG_DTYPE record."""
+    return CONFIG_DISCRIMINATOR+np.asarray(config, dtype=CONFIG_DTYPE).tobytes()
+
+
+def encode_price_cache(cache: np.void) -> bytes:
+    """Returns the account data of a PRICE_CACHE_DTYPE record."""
+    return PRICE_CACHE_DISCRIMINATOR+np.asarray(cache, dtype=PRICE_CACHE_DTYPE).tobytes()
@@ -0,0 +1,244 @@
+# oamm
+# Off-chain backtesting.
+#
+# Replays a history of oracle prices and orders (trades, deposits and
+# withdrawals) against a simulated pool. Orders are priced with the program's
+# own math (the *_amounts functions of lib.fixed_point, which run lib.math's
+# trade_i/trade_o/single_asset_deposit/single_asset_withdrawal or their
+# fixed-point counterparts) and applied to the pool state in place, as the
+# instructions do. Prices and orders are read lazily from CSV or binary files
+# and merged by time, and the metrics are accumulated as the stream goes, so
+# memory does not depend on the length of the history.
+#
+# CSV files have a header row. Prices: time, price_sol, price_usdc, price_usdt.
+# Orders: time, kind (deposit, withdrawal or trade), token_in, token_out,
+# amount, exact_in. The amount of a deposit is in token_in, the amount of a
+# withdrawal in LP tokens of token_out. Binary files are arrays of PRICE_DTYPE
+# or ORDER_DTYPE records, e.g. written with ndarray.tofile.
+
+import csv
+import heapq
+from typing import Iterable, Iterator, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from lib.fixed_point import single_asset_deposit_amounts, single_asset_withdrawal_amounts, swap_amounts
+from lib.math import imbalance_ratios
+from offchain.indexer import DEPOSIT, TRADE, WITHDRAWAL
+from seahorse.prelude import array
+
+PRICE_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('price', '<f8', (3,)),
+])
+
+ORDER_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('kind', 'u1'),
+    ('token_in', 'u1'),
+    ('token_out', 'u1'),
+    ('amount', '<f8'),
+    ('exact_in', '?'),
+])
+
+KINDS = {'deposit': DEPOSIT, 'withdrawal': WITHDRAWAL, 'trade': TRADE}
+
+
+class Price(NamedTuple):
+    time: float
+    price: Tuple[float, float, float]
+
+
+class Order(NamedTuple):
+    time: float
+    kind: int
+    token_in: int
+    token_out: int
+    amount: float
+    exact_in: bool = True
+
+
+def read_prices_csv(path: str) -> Iterator[Price]:
+    """Yields the prices of a CSV file, one row at a time."""
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            yield Price(float(row['time']), (float(row['price_sol']), float(row['price_usdc']), float(row['price_usdt'])))
+
+
+def read_orders_csv(path: str) -> Iterator[Order]:
+    """Yields the orders of a CSV file, one row at a time."""
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            kind = row['kind'].strip().lower()
+            yield Order(
+                float(row['time']), KINDS[kind] if kind in KINDS else int(kind), int(row['token_in'] or 0),
+                int(row['token_out'] or 0), float(row['amount']),
+                row.get('exact_in', '1').strip().lower() not in ('0', 'false', 'no'))
+
+
+def records(data: np.ndarray, chunk_size: int = 65536) -> Iterator[tuple]:
+    """Yields the records of an array of PRICE_DTYPE or ORDER_DTYPE records (e.g. a memory map) as
+    Price or Order tuples, converting chunk_size records at a time."""
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start+chunk_size]
+        if data.dtype == PRICE_DTYPE:
+            for t, p in zip(chunk['time'].tolist(), chunk['price'].tolist()):
+                yield Price(t, tuple(p))
+        else:
+            for row in chunk.tolist():
+                yield Order(*row)
+
+
+def read_binary(path: str, dtype: np.dtype, chunk_size: int = 65536) -> Iterator[tuple]:
+    """Yields the records of a binary file of PRICE_DTYPE or ORDER_DTYPE records as Price or Order
+    tuples, mapping the file into memory instead of reading it."""
+    return records(np.memmap(path, dtype=dtype, mode='r'), chunk_size)
+
+
+def write_binary(items: Iterable[tuple], path: str, dtype: np.dtype, chunk_size: int = 65536) -> int:
+    """Writes a stream of Price or Order tuples (e.g. from a CSV file) to a binary file of dtype
+    records, chunk_size records at a time. Returns the number of records written."""
+    n = 0
+    with open(path, 'wb') as f:
+        chunk = []
+        for item in items:
+            chunk.append(tuple(item))
+            if len(chunk) == chunk_size:
+                np.array(chunk, dtype=dtype).tofile(f)
+                n += len(chunk)
+                chunk = []
+        if chunk:
+            np.array(chunk, dtype=dtype).tofile(f)
+            n += len(chunk)
+    return n
+
+
+def merge(prices: Iterable[Price], orders: Iterable[Order]) -> Iterator[Union[Price, Order]]:
+    """Merges a price stream and an order stream, each sorted by time, into one. At equal times,
+    prices come first, so that an order is priced with the last price at or before it."""
+    return heapq.merge(prices, orders, key=lambda event: event.time)
+
+
+class Summary(NamedTuple):
+    """Metrics of a backtest. Values are in USD at the last prices: value is the value of the pool
+    (B), lp_value the value of the LP tokens in circulation at par (L), hold_value the value of the
+    tokens deposited into the pool minus those withdrawn, had they been held, and pnl the
+    difference between value and hold_value. volume and protocol_fees are valued at the prices of
+    each trade. min_ratio and max_ratio are the extreme imbalance ratios after an order."""
+    trades: int
+    rejected_trades: int
+    deposits: int
+    withdrawals: int
+    rejected_withdrawals: int
+    partial_withdrawals: int
+    volume: float
+    protocol_fees: float
+    value: float
+    lp_value: float
+    hold_value: float
+    pnl: float
+    min_ratio: float
+    max_ratio: float
+
+
+class Backtest:
+    """A simulated pool with the given parameters, starting from the given state."""
+
+    def __init__(self, base_fee: float, protocol_fee: float, base_leverage: float, delta: float,
+                 fixed_point: bool = False, balances: Sequence[float] = (0.0, 0.0, 0.0),
+                 lp_tokens: Sequence[float] = (0.0, 0.0, 0.0)):
+        self.base_fee = base_fee
+        self.protocol_fee = protocol_fee
+        self.base_leverage = base_leverage
+        self.delta = delta
+        self.fixed_point = fixed_point
+        self.balances = array(*(float(x) for x in balances))
+        self.lp_tokens = array(*(float(x) for x in lp_tokens))
+        self.held = [float(x) for x in balances]
+        self.prices: Optional[list] = None
+        self.trades = 0
+        self.rejected_trades = 0
+        self.deposits = 0
+        self.withdrawals = 0
+        self.rejected_withdrawals = 0
+        self.partial_withdrawals = 0
+        self.volume = 0.0
+        self.protocol_fees = 0.0
+        self.min_ratio = float('inf')
+        self.max_ratio = float('-inf')
+
+    def update_prices(self, prices: Sequence[float]) -> None:
+        """Sets the oracle prices used by the next orders."""
+        self.prices = array(*(float(x) for x in prices))
+
+    def apply(self, order: Order) -> bool:
+        """Applies one order to the pool. Returns whether it was executed."""
+        if self.prices is None:
+            raise ValueError('Order before the first price.')
+        i, o, amount = order.token_in, order.token_out, order.amount
+        if order.kind == TRADE:
+            ai, ao, pr_fee, execute_trade, n_in, n_pr_fee, n_out = swap_amounts(
+                self.fixed_point, i, o, amount, order.exact_in, self.balances, self.lp_tokens, self.prices,
+                self.base_fee, self.protocol_fee, self.base_leverage, self.delta)
+            if not execute_trade:
+                self.rejected_trades += 1
+                return False
+            self.balances[i] += ai-pr_fee
+            self.balances[o] -= ao
+            self.trades += 1
+            self.volume += ai*self.prices[i]
+            self.protocol_fees += pr_fee*self.prices[i]
+        elif order.kind == DEPOSIT:
+            lpt, n_in, n_lpt = single_asset_deposit_amounts(
+                self.fixed_point, i, amount, self.balances, self.lp_tokens, self.prices)
+            self.balances[i] += amount
+            self.lp_tokens[i] += lpt
+            self.held[i] += amount
+            self.deposits += 1
+        elif order.kind == WITHDRAWAL:
+            if not 0.0 < amount <= self.lp_tokens[o]:
+                self.rejected_withdrawals += 1
+                return False
+            amounts_out, lpt_to_burn, n_out, n_burn = single_asset_withdrawal_amounts(
+                self.fixed_point, o, amount, self.balances, self.lp_tokens, self.prices, self.delta)
+            self.lp_tokens[o] -= lpt_to_burn
+            for j in range(3):
+                self.balances[j] -= amounts_out[j]
+                self.held[j] -= amounts_out[j]
+            self.withdrawals += 1
+            # Partially paid if more than one native unit of LP tokens is left unburned.
+            if amount-lpt_to_burn > 1e-9:
+                self.partial_withdrawals += 1
+        else:
+            raise ValueError(f'Unknown kind of order: {order.kind}.')
+        self._track_ratios()
+        return True
+
+    def _track_ratios(self) -> None:
+        if sum(p*b for p, b in zip(self.prices, self.balances)) == 0.0:
+            return
+        for r in imbalance_ratios(self.balances, self.lp_tokens, self.prices):
+            if r >= 0.0:
+                self.min_ratio = min(self.min_ratio, r)
+                self.max_ratio = max(self.max_ratio, r)
+
+    def run(self, events: Iterable[Union[Price, Order]]) -> Summary:
+        """Consumes a stream of prices and orders (e.g. merge(prices, orders)) and returns the
+        summary at its end."""
+        for event in events:
+            if isinstance(event, Price):
+                self.update_prices(event.price)
+            else:
+                self.apply(event)
+        return self.summary()
+
+    def summary(self) -> Summary:
+        """Returns the metrics of the orders applied so far."""
+        prices = self.prices if self.prices is not None else (0.0, 0.0, 0.0)
+        value = sum(p*b for p, b in zip(prices, self.balances))
+        lp_value = sum(p*l for p, l in zip(prices, self.lp_tokens))
+        hold_value = sum(p*h for p, h in zip(prices, self.held))
+        return Summary(
+            self.trades, self.rejected_trades, self.deposits, self.withdrawals, self.rejected_withdrawals,
+            self.partial_withdrawals, self.volume, self.protocol_fees, value, lp_value, hold_value,
+            value-hold_value, self.min_ratio, self.max_ratio)
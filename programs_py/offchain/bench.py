@@ -0,0 +1,260 @@
+# oamm
+# Off-chain benchmarks of lib.math.
+#
+# Times the hot functions of lib.math (weights, compute_B_and_L,
+# imbalance_ratios, scaled_fee_and_leverage, every branch of trade_i/trade_o,
+# single_asset_deposit and single_asset_withdrawal with and without spill-over)
+# over a matrix of pool states: balanced, imbalance ratios near 1-delta and
+# 1+delta, ratios beyond them, a token with no balance, a token with no LP
+# tokens and an empty pool. Every case checks its result, so a change that
+# sends it down another branch fails instead of timing something else.
+#
+# Results (the best of a few repeats, in ns per call) are saved per commit in
+# .benchmarks/<commit>.json at the root of the repository, so a run can be
+# compared with the one of any earlier commit:
+#
+#   python -m offchain.bench --save --compare main
+#
+# exits with status 1 if a case got slower than the baseline by more than the
+# threshold. Timings only compare on the same machine and Python version.
+# The cases are timed with logging off (LOG_LEVEL of lib/log.py), which is
+# saved with the results; runs at different levels are not compared.
+# With --cu, the results compared are instead the compute units of the
+# instructions saved in .benchmarks/cu by tests/cu.sh (see
+# offchain/localnet.py), which are exact, so any increase is reported.
+
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import lib.log
+import lib.math
+from lib.math import (
+    compute_B_and_L, imbalance_ratios, scaled_fee_and_leverage, single_asset_deposit, single_asset_withdrawal,
+    trade_i, trade_o, weights)
+from seahorse.prelude import array
+
+# Log level of the timed runs, recorded with their results.
+LOG_LEVEL = lib.log.LOG_OFF
+
+BASE_FEE = 0.001
+PROTOCOL_FEE = 0.5
+BASE_LEVERAGE = 100.0
+DELTA = 0.25
+PRICES = (20.0, 1.0, 1.0)
+
+# Pool states as (balances, LP tokens), with prices PRICES.
+STATES = {
+    'balanced': ((100.0, 2000.0, 2000.0), (100.0, 2000.0, 2000.0)),
+    # Imbalance ratios 1.0, 0.765 and 1.235.
+    'near_delta': ((100.0, 1530.0, 2470.0), (100.0, 2000.0, 2000.0)),
+    # Imbalance ratios 1.3, 0.7 and 1.0.
+    'beyond_delta': ((130.0, 1400.0, 2000.0), (100.0, 2000.0, 2000.0)),
+    'empty_balance': ((0.0, 2000.0, 2000.0), (100.0, 2000.0, 2000.0)),
+    'zero_lp': ((100.0, 2000.0, 500.0), (100.0, 2000.0, 0.0)),
+    'empty_pool': ((0.0, 0.0, 0.0), (0.0, 0.0, 0.0)),
+}
+
+
+class Case(NamedTuple):
+    """A call to time: function(*args) on a pool state, and a check of its result."""
+    name: str
+    function: Callable
+    args: Tuple
+    check: Callable[[Any], bool]
+
+
+def _accepted(result) -> bool:
+    return result[-1] and result[0] > 0.0
+
+
+def _rejected(result) -> bool:
+    return not result[-1]
+
+
+def _spilled(o: int) -> Callable[[Any], bool]:
+    return lambda result: any(result[0][k] > 0.0 for k in range(3) if k != o)
+
+
+def _not_spilled(o: int) -> Callable[[Any], bool]:
+    return lambda result: result[0][o] > 0.0 and not _spilled(o)(result)
+
+
+def cases() -> List[Case]:
+    """Returns the benchmark cases, named function/branch/state."""
+    def state(name):
+        balances, lp_tokens = STATES[name]
+        return array(*balances), array(*lp_tokens), array(*PRICES)
+
+    def trade(function, branch, name, i, o, amount, check):
+        return Case(f'{function.__name__}/{branch}/{name}', function,
+                    (i, o, amount, *state(name), BASE_FEE, PROTOCOL_FEE, BASE_LEVERAGE, DELTA), check)
+
+    def deposit(branch, name, i, amount):
+        return Case(f'single_asset_deposit/{branch}/{name}', single_asset_deposit,
+                    (i, amount, *state(name)), lambda result: result[0] > 0.0)
+
+    def withdrawal(branch, name, o, lpt, check):
+        return Case(f'single_asset_withdrawal/{branch}/{name}', single_asset_withdrawal,
+                    (o, lpt, *state(name), DELTA), check)
+
+    balances, lp_tokens, prices = state('balanced')
+    result = [
+        Case('weights/balanced', weights, (balances, prices), lambda w: abs(sum(w)-1.0) < 1e-12),
+        Case('compute_B_and_L/balanced', compute_B_and_L, (balances, lp_tokens, prices), lambda r: r[0] > 0.0),
+        Case('imbalance_ratios/balanced', imbalance_ratios, (balances, lp_tokens, prices),
+             lambda r: all(x == 1.0 for x in r)),
+        Case('imbalance_ratios/zero_lp', imbalance_ratios, state('zero_lp'), lambda r: r[2] < 0.0),
+    ]
+    for name in ('balanced', 'near_delta'):
+        result.append(Case(f'scaled_fee_and_leverage/{name}', scaled_fee_and_leverage,
+                           (*state(name), BASE_FEE, BASE_LEVERAGE, 0, 1), lambda r: r[0] > 0.0))
+    for function, amount in ((trade_i, 1.0), (trade_o, 20.0)):
+        result += [
+            trade(function, 'scaled', 'balanced', 0, 1, amount, _accepted),
+            trade(function, 'scaled', 'near_delta', 2, 1, amount/20.0, _accepted),
+            trade(function, 'empty_in', 'empty_balance', 0, 1, amount, _accepted),
+            trade(function, 'no_lp_out', 'zero_lp', 0, 2, amount, _accepted),
+            trade(function, 'no_lp_in', 'zero_lp', 2, 0, amount, _rejected),
+            trade(function, 'ratio_out_low', 'beyond_delta', 2, 1, amount, _rejected),
+            trade(function, 'ratio_in_high', 'beyond_delta', 0, 2, amount, _rejected),
+        ]
+    result.append(trade(trade_o, 'no_balance', 'balanced', 0, 1, 2000.0, _rejected))
+    result += [
+        deposit('ratio', 'balanced', 0, 1.0),
+        deposit('ratio', 'near_delta', 1, 100.0),
+        deposit('empty_in', 'empty_balance', 0, 1.0),
+        deposit('no_lp_in', 'zero_lp', 2, 100.0),
+        deposit('empty_pool', 'empty_pool', 0, 1.0),
+        withdrawal('direct', 'balanced', 1, 100.0, _not_spilled(1)),
+        withdrawal('spill_over', 'near_delta', 1, 800.0, _spilled(1)),
+        withdrawal('spill_over', 'empty_balance', 0, 10.0, _spilled(0)),
+        withdrawal('all_lp', 'balanced', 1, 2000.0, _not_spilled(1)),
+    ]
+    return result
+
+
+def time_case(case: Case, repeat: int = 5) -> float:
+    """Returns the time of one call of the case in ns, the best of repeat runs."""
+    if not case.check(case.function(*case.args)):
+        raise AssertionError(f'{case.name}: unexpected result, the case no longer takes its branch.')
+    timer = timeit.Timer(lambda: case.function(*case.args))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number))/number*1e9
+
+
+def run(patterns: Sequence[str] = (), repeat: int = 5) -> Dict[str, float]:
+    """Times the cases whose names match one of the glob patterns (all by default), at LOG_LEVEL."""
+    level = lib.log.LOG_LEVEL
+    lib.log.LOG_LEVEL = LOG_LEVEL
+    try:
+        return {case.name: time_case(case, repeat) for case in cases()
+                if not patterns or any(fnmatch.fnmatch(case.name, p) for p in patterns)}
+    finally:
+        lib.log.LOG_LEVEL = level
+
+
+def _git(*args: str) -> str:
+    return subprocess.run(['git', *args], capture_output=True, text=True, check=True).stdout.strip()
+
+
+LIB_DIR = os.path.dirname(os.path.abspath(lib.math.__file__))
+
+
+def commit(path: str = LIB_DIR) -> str:
+    """Returns the hash of the current commit, with a -dirty suffix if path (lib by default) has
+    uncommitted changes."""
+    sha = _git('rev-parse', '--verify', 'HEAD^{commit}')
+    if _git('status', '--porcelain', '--', path):
+        sha += '-dirty'
+    return sha
+
+
+def results_dir() -> str:
+    return os.path.join(_git('rev-parse', '--show-toplevel'), '.benchmarks')
+
+
+def save(results: Dict[str, float], directory: Optional[str] = None) -> str:
+    """Saves results as those of the current commit. Returns the path of the file."""
+    directory = directory or results_dir()
+    os.makedirs(directory, exist_ok=True)
+    sha = commit()
+    path = os.path.join(directory, f'{sha}.json')
+    with open(path, 'w') as f:
+        json.dump({
+            'commit': sha, 'python': platform.python_version(), 'machine': platform.machine(),
+            'fast_math': lib.math.FAST_MATH, 'log_level': int(LOG_LEVEL), 'results': results,
+        }, f, indent=1, sort_keys=True)
+    return path
+
+
+def load(ref: str, directory: Optional[str] = None, log_level: Optional[int] = None) -> Dict[str, float]:
+    """Returns the saved results of a commit (any git revision, or a hash with a -dirty suffix).
+    With log_level, raises ValueError if they were timed at another log level."""
+    sha = ref if ref.endswith('-dirty') else _git('rev-parse', '--verify', f'{ref}^{{commit}}')
+    path = os.path.join(directory or results_dir(), f'{sha}.json')
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'No saved results for {ref}; run with --save on it first.')
+    with open(path) as f:
+        saved = json.load(f)
+    if log_level is not None and saved.get('log_level') != log_level:
+        raise ValueError(f'The results of {ref} were timed at log level {saved.get("log_level")}, not {log_level}; '
+                         f'run with --save on it again.')
+    return saved['results']
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float],
+            threshold: float = 0.1) -> List[Tuple[str, float, float]]:
+    """Returns the cases costlier than in baseline by more than threshold, as (name, baseline, result)."""
+    return [(name, baseline[name], x) for name, x in results.items()
+            if name in baseline and x > baseline[name]*(1.0+threshold)]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m offchain.bench', description='Benchmarks of lib.math.')
+    parser.add_argument('patterns', nargs='*', help='glob patterns of the cases to run, e.g. "trade_i/*"')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs per case (the best is kept)')
+    parser.add_argument('--save', action='store_true', help='save the results as those of the current commit')
+    parser.add_argument('--compare', metavar='REF', help='compare with the saved results of a commit')
+    parser.add_argument('--threshold', type=float, help='increase reported as a regression (default: 0.1, 0 with --cu)')
+    parser.add_argument('--dir', help='directory of the saved results (default: .benchmarks, .benchmarks/cu with --cu)')
+    parser.add_argument('--cu', action='store_true',
+                        help='instead of timing, compare the compute units saved by tests/cu.sh for the current commit')
+    parser.add_argument('--list', action='store_true', help='list the cases and exit')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for case in cases():
+            sys.stdout.write(case.name+'\n')
+        return 0
+    unit = 'CU' if args.cu else 'ns'
+    directory = args.dir or (os.path.join(results_dir(), 'cu') if args.cu else None)
+    threshold = args.threshold if args.threshold is not None else 0.0 if args.cu else 0.1
+    baseline = load(args.compare, directory, None if args.cu else int(LOG_LEVEL)) if args.compare else {}
+    if args.cu:
+        results = {name: x for name, x in load(commit(os.path.dirname(LIB_DIR)), directory).items()
+                   if not args.patterns or any(fnmatch.fnmatch(name, p) for p in args.patterns)}
+    else:
+        results = run(args.patterns, args.repeat)
+    width = max(map(len, results), default=0)
+    for name, x in results.items():
+        line = f'{name:<{width}} {x:10.0f} {unit}'
+        if name in baseline:
+            line += f' {x/baseline[name]-1.0:+8.1%}'
+        sys.stdout.write(line+'\n')
+    if args.save and not args.cu:
+        sys.stdout.write(f'Saved to {save(results, directory)}\n')
+    regressions = compare(results, baseline, threshold)
+    for name, before, after in regressions:
+        sys.stdout.write(f'Regression: {name} {before:.0f} {unit} -> {after:.0f} {unit}\n')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# oamm
+# Off-chain event indexer.
+#
+# Streams the PoolEvents emitted by the program out of transaction logs and
+# keeps the pool state after every event in a fixed-size columnar buffer.
+#
+# Anchor's emit! writes an event as a "Program data: <base64>" log line. The
+# payload is an 8-byte discriminator (the first bytes of
+# sha256("event:PoolEvent")) followed by the Borsh encoding of the fields in
+# declaration order. Every PoolEvent field is fixed-size, so a payload is
+# decoded with one np.frombuffer call on EVENT_DTYPE; the human-readable logs
+# are never parsed. The d_* fields of an event are exactly what the
+# instruction added to the pool account, so summing them from create_pool in
+# event order reproduces the f64 pool state bit for bit.
+
+import base64
+import hashlib
+import time
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
+
+DEPOSIT = 0
+WITHDRAWAL = 1
+TRADE = 2
+UPDATE = 3
+
+DISCRIMINATOR = hashlib.sha256(b'event:PoolEvent').digest()[:8]
+LOG_PREFIX = 'Program data: '
+
+TOKENS = ('sol', 'usdc', 'usdt')
+
+EVENT_DTYPE = np.dtype([
+    ('kind', 'u1'),
+    ('user', 'V32'),
+    ('pool', 'V32'),
+    ('token_in', 'u1'),
+    ('token_out', 'u1'),
+    *[(f'd_balance_{t}', '<f8') for t in TOKENS],
+    *[(f'd_lp_{t}_tokens', '<f8') for t in TOKENS],
+    *[(f'price_{t}', '<f8') for t in TOKENS],
+    ('protocol_fee', '<f8'),
+])
+
+STATE_DTYPE = np.dtype([
+    ('seq', '<i8'),
+    ('kind', 'u1'),
+    ('token_in', 'u1'),
+    ('token_out', 'u1'),
+    *[(f'balance_{t}', '<f8') for t in TOKENS],
+    *[(f'lp_{t}_tokens', '<f8') for t in TOKENS],
+    *[(f'price_{t}', '<f8') for t in TOKENS],
+    ('protocol_fee', '<f8'),
+])
+
+_BALANCES = [f'd_balance_{t}' for t in TOKENS]
+_LP_TOKENS = [f'd_lp_{t}_tokens' for t in TOKENS]
+
+
+def encode_event(event: np.void) -> str:
+    """Returns the log line that emit! writes for an EVENT_DTYPE record."""
+    payload = DISCRIMINATOR+np.asarray(event, dtype=EVENT_DTYPE).tobytes()
+    return LOG_PREFIX+base64.b64encode(payload).decode('ascii')
+
+
+def decode_event(line: str, dtype: np.dtype = EVENT_DTYPE, discriminator: bytes = DISCRIMINATOR) -> Optional[np.void]:
+    """Returns the PoolEvent (or the event of the given dtype and discriminator) logged on
+    line, or None if line is not one."""
+    if not line.startswith(LOG_PREFIX):
+        return None
+    try:
+        payload = base64.b64decode(line[len(LOG_PREFIX):].strip(), validate=True)
+    except ValueError:
+        return None
+    if len(payload) != 8+dtype.itemsize or payload[:8] != discriminator:
+        return None
+    return np.frombuffer(payload, dtype=dtype, count=1, offset=8)[0]
+
+
+def read_events(lines: Iterable[str], pool: Optional[bytes] = None) -> Iterator[np.void]:
+    """Yields the PoolEvents found in a stream of log lines, skipping everything else.
+    If pool (the 32 bytes of a pool's key) is given, only the events of that pool are yielded."""
+    for line in lines:
+        event = decode_event(line)
+        if event is not None and (pool is None or event['pool'].tobytes() == pool):
+            yield event
+
+
+def follow(path: str, poll_interval: float = 0.5, stop: Optional[Callable[[], bool]] = None) -> Iterator[str]:
+    """Yields the lines of a log file, then waits for more like tail -f.
+
+    This is the stand-in for a validator subscription: point `solana logs`
+    (or a local test validator's log) at a file and index it while it grows.
+    Stops at the end of the file once stop() returns True, or immediately at
+    the end of the file if poll_interval is None.
+    """
+    with open(path) as f:
+        pending = ''
+        while True:
+            line = f.readline()
+            if line:
+                pending += line
+                if pending.endswith('\n'):
+                    yield pending
+                    pending = ''
+                continue
+            if poll_interval is None or (stop is not None and stop()):
+                if pending:
+                    yield pending
+                return
+            time.sleep(poll_interval)
+
+
+class PoolHistory:
+    """Pool state after each of the last `capacity` events, stored column-wise.
+
+    Rows live in a preallocated ring buffer, so memory does not grow with the
+    length of the stream. The running state starts from the given balances and
+    LP token supplies (zero for a pool indexed from create_pool).
+    """
+
+    def __init__(self, capacity: int = 65536, balances=(0.0, 0.0, 0.0), lp_tokens=(0.0, 0.0, 0.0)):
+        self.capacity = capacity
+        self.n_events = 0
+        self.balances = [float(x) for x in balances]
+        self.lp_tokens = [float(x) for x in lp_tokens]
+        self.protocol_fees = [0.0, 0.0, 0.0]
+        self._rows = np.zeros(capacity, dtype=STATE_DTYPE)
+
+    def append(self, event: np.void) -> None:
+        """Applies one PoolEvent to the running state and records the result."""
+        for j in range(3):
+            self.balances[j] += float(event[_BALANCES[j]])
+            self.lp_tokens[j] += float(event[_LP_TOKENS[j]])
+        if event['kind'] == TRADE:
+            self.protocol_fees[event['token_in']] += float(event['protocol_fee'])
+        row = self._rows[self.n_events % self.capacity]
+        row['seq'] = self.n_events
+        row['kind'] = event['kind']
+        row['token_in'] = event['token_in']
+        row['token_out'] = event['token_out']
+        for j, t in enumerate(TOKENS):
+            row[f'balance_{t}'] = self.balances[j]
+            row[f'lp_{t}_tokens'] = self.lp_tokens[j]
+            row[f'price_{t}'] = event[f'price_{t}']
+        row['protocol_fee'] = event['protocol_fee']
+        self.n_events += 1
+
+    def consume(self, events: Iterable[np.void]) -> 'PoolHistory':
+        """Appends every event of a stream, e.g. read_events(follow(path))."""
+        for event in events:
+            self.append(event)
+        return self
+
+    def __len__(self) -> int:
+        return min(self.n_events, self.capacity)
+
+    def history(self) -> np.ndarray:
+        """Returns a copy of the retained rows, oldest first."""
+        if self.n_events <= self.capacity:
+            return self._rows[:self.n_events].copy()
+        start = self.n_events % self.capacity
+        return np.concatenate((self._rows[start:], self._rows[:start]))
+
+    def column(self, name: str) -> np.ndarray:
+        """Returns one column of the retained rows, oldest first."""
+        column = self._rows[name]
+        if self.n_events <= self.capacity:
+            return column[:self.n_events].copy()
+        start = self.n_events % self.capacity
+        return np.concatenate((column[start:], column[:start]))
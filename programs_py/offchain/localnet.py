@@ -0,0 +1,349 @@
+# oamm
+# Off-chain local validator fixtures.
+#
+# Writes the accounts of a set of pools as JSON account files, which
+# solana-test-validator loads at genesis with --account-dir, so that the
+# instructions can run on a local validator without network access and without
+# init_factory/create_pool (only OWNER can sign them):
+#
+# - the USDC and USDT mints at their devnet addresses, with the given wallet as
+#   mint authority, and the wallet's token accounts;
+# - Pyth price accounts at the devnet feeds of retrieve_prices (offchain/pyth.py),
+#   with the wallet as their publisher (see offchain/oracle.py);
+# - for every pool state of offchain.bench.STATES and both engines (f64 and
+#   fixed point), a pool with its config, price cache, token accounts and LP
+#   mints at the addresses create_pool derives, and the wallet's LP token
+#   accounts holding every LP token of the pool.
+#
+# manifest.json, next to the accounts directory, lists the accounts and the
+# compute-unit cases run by tests/cu.ts: the trade, deposit and withdrawal cases
+# of offchain/bench.py as swap, deposit_* and withdraw_* instructions, plus SOL
+# out and USDC to USDT swaps, multi_swap with 1 to 4 legs and quote, and a swap,
+# a deposit and a withdrawal sent twice in one transaction (the .../cached/...
+# cases, whose second instruction reads the prices cached by the first).
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lib.accounts import MINT_SOL, MINT_USDC, MINT_USDT
+from lib.fixed_point import swap_amounts
+from lib.math import f64_to_u64_9_decimal_places
+from offchain.accounts import CONFIG_DTYPE, OAMM_DTYPE, PRICE_CACHE_DTYPE, encode_config, encode_pool, encode_price_cache
+from offchain.bench import BASE_FEE, BASE_LEVERAGE, DELTA, PRICES, PROTOCOL_FEE, STATES, cases
+from offchain.pyth import FEEDS, PRICE_ACCOUNT_DTYPE, PYTH_PROGRAM_ID, encode_price_account, price_account
+from seahorse.prelude import array
+
+SYSTEM_PROGRAM_ID = '11111111111111111111111111111111'
+TOKEN_PROGRAM_ID = 'TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA'
+RENT_SYSVAR_ID = 'SysvarRent111111111111111111111111111111111'
+CLOCK_SYSVAR_ID = 'SysvarC1ock11111111111111111111111111111111'
+
+# The declare_id of oamm.py.
+with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'oamm.py')) as _f:
+    PROGRAM_ID = re.search(r"declare_id\('(\w+)'\)", _f.read()).group(1)
+
+ENGINES = {'f64': False, 'fixed': True}
+
+# Tokens held by the wallet, in native units.
+WALLET_TOKENS = 10**15
+
+MINT_DTYPE = np.dtype([
+    ('mint_authority_option', '<u4'),
+    ('mint_authority', 'V32'),
+    ('supply', '<u8'),
+    ('decimals', 'u1'),
+    ('is_initialized', '?'),
+    ('freeze_authority_option', '<u4'),
+    ('freeze_authority', 'V32'),
+])
+
+TOKEN_ACCOUNT_DTYPE = np.dtype([
+    ('mint', 'V32'),
+    ('owner', 'V32'),
+    ('amount', '<u8'),
+    ('delegate_option', '<u4'),
+    ('delegate', 'V32'),
+    ('state', 'u1'),
+    ('is_native_option', '<u4'),
+    ('is_native', '<u8'),
+    ('delegated_amount', '<u8'),
+    ('close_authority_option', '<u4'),
+    ('close_authority', 'V32'),
+])
+
+_B58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+def b58encode(data: bytes) -> str:
+    n = int.from_bytes(data, 'big')
+    s = ''
+    while n:
+        n, r = divmod(n, 58)
+        s = _B58[r]+s
+    return '1'*(len(data)-len(data.lstrip(b'\0')))+s
+
+
+def b58decode(s: str) -> bytes:
+    n = 0
+    for c in s:
+        n = n*58+_B58.index(c)
+    return b'\0'*(len(s)-len(s.lstrip('1')))+n.to_bytes((n.bit_length()+7)//8, 'big')
+
+
+def key(address: str) -> np.void:
+    return np.void(b58decode(address).rjust(32, b'\0'))
+
+
+_P = 2**255-19
+_D = -121665*pow(121666, _P-2, _P) % _P
+
+
+def _on_curve(point: bytes) -> bool:
+    # Whether point is the compressed form of an ed25519 point, i.e. x^2 = (y^2-1)/(d*y^2+1) has a root.
+    y = int.from_bytes(point, 'little') & (2**255-1)
+    x2 = (y*y-1)*pow(_D*y*y+1, _P-2, _P) % _P
+    return x2 == 0 or pow(x2, (_P-1)//2, _P) == 1
+
+
+def find_program_address(seeds: Sequence[bytes], program_id: str) -> Tuple[str, int]:
+    """Returns the program derived address of seeds and its bump, like Pubkey::find_program_address."""
+    for bump in range(255, -1, -1):
+        h = hashlib.sha256(b''.join(seeds)+bytes([bump])+b58decode(program_id)+b'ProgramDerivedAddress').digest()
+        if not _on_curve(h):
+            return b58encode(h), bump
+    raise ValueError('No program address for these seeds.')
+
+
+def _address(*parts: str) -> str:
+    # Address of an account with no seeds (the wallet's token accounts).
+    return b58encode(hashlib.sha256('/'.join(('oamm-localnet',)+parts).encode()).digest())
+
+
+def mint(authority: str, supply: int, decimals: int = 9) -> bytes:
+    record = np.zeros((), dtype=MINT_DTYPE)
+    record['mint_authority_option'] = 1
+    record['mint_authority'] = key(authority)
+    record['supply'] = supply
+    record['decimals'] = decimals
+    record['is_initialized'] = True
+    return record.tobytes()
+
+
+def token_account(mint: str, owner: str, amount: int) -> bytes:
+    record = np.zeros((), dtype=TOKEN_ACCOUNT_DTYPE)
+    record['mint'] = key(mint)
+    record['owner'] = key(owner)
+    record['amount'] = amount
+    record['state'] = 1
+    return record.tobytes()
+
+
+def rent_exempt(size: int) -> int:
+    """Returns the rent-exempt minimum balance of an account of size bytes."""
+    return (size+128)*3480*2
+
+
+def native(amount: float) -> int:
+    return int(f64_to_u64_9_decimal_places(amount))
+
+
+class _Writer:
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def account(self, address: str, data: bytes, owner: str, lamports: Optional[int] = None) -> str:
+        with open(os.path.join(self.directory, f'{address}.json'), 'w') as f:
+            json.dump({'pubkey': address, 'account': {
+                'lamports': rent_exempt(len(data)) if lamports is None else lamports,
+                'data': [base64.b64encode(data).decode(), 'base64'], 'owner': owner, 'executable': False,
+                'rentEpoch': 0, 'space': len(data)}}, f)
+        return address
+
+
+def _pool(writer: _Writer, wallet: str, program_id: str, pool_id: int, balances: Sequence[float],
+          lp_tokens: Sequence[float], fixed_point: bool) -> Dict[str, str]:
+    pool, bump = find_program_address([b'oamm', pool_id.to_bytes(8, 'little')], program_id)
+    config = find_program_address([b'oamm_config', b58decode(pool)], program_id)[0]
+    cache = find_program_address([b'price_cache', b58decode(pool)], program_id)[0]
+    token_accounts = [pool]+[find_program_address([b'pool-token-account', b58decode(pool), b58decode(m)], program_id)[0]
+                             for m in (MINT_USDC, MINT_USDT)]
+    lp_mints = [find_program_address([f'lp_{name}-token-mint'.encode(), b58decode(pool)], program_id)[0]
+                for name in ('sol', 'usdc', 'usdt')]
+
+    record = np.zeros((), dtype=OAMM_DTYPE)
+    record['balances'] = balances
+    record['lp_tokens'] = lp_tokens
+    record['pool_id'] = pool_id
+    record['config'] = key(config)
+    record['mints'] = [key(m) for m in (MINT_SOL, MINT_USDC, MINT_USDT)]
+    record['token_accounts'] = [key(a) for a in token_accounts]
+    record['lp_mints'] = [key(m) for m in lp_mints]
+    record['bump'] = bump
+    data = encode_pool(record)
+    writer.account(pool, data, program_id, rent_exempt(len(data))+native(balances[0]))
+    writer.account(config, encode_config(np.array(
+        (BASE_FEE, PROTOCOL_FEE, BASE_LEVERAGE, DELTA, fixed_point), dtype=CONFIG_DTYPE)), program_id)
+    # Slot 0: the first instruction reads the price accounts.
+    writer.account(cache, encode_price_cache(np.array((key(pool), 0, (0.0, 0.0, 0.0)), dtype=PRICE_CACHE_DTYPE)),
+                   program_id)
+    for k, m in ((1, MINT_USDC), (2, MINT_USDT)):
+        writer.account(token_accounts[k], token_account(m, pool, native(balances[k])), TOKEN_PROGRAM_ID)
+
+    accounts = {'pool': pool, 'config': config, 'cache': cache, 'pool_usdc_tkn_acc': token_accounts[1],
+                'pool_usdt_tkn_acc': token_accounts[2]}
+    for name, lp_mint, lpt in zip(('sol', 'usdc', 'usdt'), lp_mints, lp_tokens):
+        writer.account(lp_mint, mint(pool, native(lpt)), TOKEN_PROGRAM_ID)
+        user_lp = writer.account(_address(pool, lp_mint), token_account(lp_mint, wallet, native(lpt)), TOKEN_PROGRAM_ID)
+        accounts[f'mint_lp{name}'] = lp_mint
+        accounts[f'user_lp_{name}_tkn_acc'] = user_lp
+    return accounts
+
+
+def _swap_accounts(accounts: Dict[str, str], i: int, o: int) -> Dict[str, str]:
+    # The token accounts of a SOL leg are not used, but must be token accounts: USDC's are passed.
+    names = ('usdc', 'usdc', 'usdt')
+    return {**accounts,
+            'user_tkn_acc_in': accounts[f'user_{names[i]}_tkn_acc'], 'pool_tkn_acc_in': accounts[f'pool_{names[i]}_tkn_acc'],
+            'user_tkn_acc_out': accounts[f'user_{names[o]}_tkn_acc'], 'pool_tkn_acc_out': accounts[f'pool_{names[o]}_tkn_acc']}
+
+
+def _executes(legs: Sequence[Tuple[int, int, float, bool]], state: str, fixed_point: bool) -> bool:
+    balances, lp_tokens = (array(*x) for x in STATES[state])
+    for i, o, amount, exact_in in legs:
+        ai, ao, pr_fee, execute_trade, n_in, n_pr_fee, n_out = swap_amounts(
+            fixed_point, i, o, amount, exact_in, balances, lp_tokens, array(*PRICES), BASE_FEE, PROTOCOL_FEE,
+            BASE_LEVERAGE, DELTA)
+        if not execute_trade:
+            return False
+        balances[i] += ai-pr_fee
+        balances[o] -= ao
+    return True
+
+
+# Branches of trade_i/trade_o in which the trade is rejected (offchain/bench.py).
+REJECTED = {'no_lp_in', 'ratio_out_low', 'ratio_in_high', 'no_balance'}
+
+TOKENS = ('sol', 'usdc', 'usdt')
+
+# Swaps that are not bench cases, as (branch, state, i, o, amount, exact_in), and multi_swap legs.
+SWAPS = [
+    ('sol_out', 'balanced', 1, 0, 20.0, True),
+    ('usdc_in_usdt_out', 'balanced', 1, 2, 20.0, True),
+    ('usdc_in_usdt_out/exact_out', 'balanced', 1, 2, 20.0, False),
+]
+MULTI_SWAP_LEGS = [(0, 1, 1.0, True), (1, 2, 20.0, True), (2, 0, 20.0, True), (1, 0, 1.0, False)]
+
+
+def _cases() -> List[Tuple[str, str, str, list]]:
+    # (name, instruction, state, args) of every case, for one engine.
+    result = []
+    for case in cases():
+        function, _, rest = case.name.partition('/')
+        branch, _, state = rest.rpartition('/')
+        if function in ('trade_i', 'trade_o'):
+            i, o, amount = case.args[:3]
+            result.append((f'swap/{function}/{branch}/{state}', 'swap', state, [i, o, amount, function == 'trade_i']))
+        elif function == 'single_asset_deposit':
+            i, amount = case.args[:2]
+            result.append((f'deposit_{TOKENS[i]}/{branch}/{state}', f'deposit_{TOKENS[i]}', state, [amount]))
+        elif function == 'single_asset_withdrawal':
+            o, lpt = case.args[:2]
+            result.append((f'withdraw_{TOKENS[o]}/{branch}/{state}', f'withdraw_{TOKENS[o]}', state, [lpt]))
+    for branch, state, i, o, amount, exact_in in SWAPS:
+        result.append((f'swap/{branch}/{state}', 'swap', state, [i, o, amount, exact_in]))
+    for n in range(1, len(MULTI_SWAP_LEGS)+1):
+        legs = list(zip(*MULTI_SWAP_LEGS))
+        result.append((f'multi_swap/{n}_legs/balanced', 'multi_swap', 'balanced',
+                       [n, list(legs[0]), list(legs[1]), list(legs[2]), list(legs[3])]))
+    result.append(('quote/trade_i/balanced', 'quote', 'balanced', [0, 1, 1.0, True]))
+    result.append(('quote/trade_i/beyond_delta', 'quote', 'beyond_delta', [0, 2, 1.0, True]))
+    return result
+
+
+# Cases sent twice in one transaction, measuring the second instruction, which reads the prices
+# cached by the first instead of the price accounts.
+CACHED = ['swap/usdc_in_usdt_out/balanced', 'deposit_sol/ratio/balanced', 'withdraw_usdc/direct/balanced']
+
+
+def write_fixtures(directory: str, wallet: str, program_id: str = PROGRAM_ID,
+                   timestamp: Optional[int] = None, price_account_size: int = PRICE_ACCOUNT_DTYPE.itemsize) -> dict:
+    """Writes the accounts to directory/accounts and the manifest to directory/manifest.json, for
+    the given wallet (base58 address), which is also the publisher of the price accounts. Returns
+    the manifest."""
+    writer = _Writer(os.path.join(directory, 'accounts'))
+    common = {'user': wallet, 'system_program': SYSTEM_PROGRAM_ID, 'token_program': TOKEN_PROGRAM_ID,
+              'rent': RENT_SYSVAR_ID, 'clock': CLOCK_SYSVAR_ID}
+    for name, address, price in zip(TOKENS, FEEDS.values(), PRICES):
+        account = encode_price_account(
+            price_account(price, timestamp=timestamp, publisher=b58decode(wallet)), price_account_size)
+        common[f'price_account_{name}'] = writer.account(address, account, PYTH_PROGRAM_ID)
+
+    pools = {}
+    supply = {MINT_USDC: WALLET_TOKENS, MINT_USDT: WALLET_TOKENS}
+    for pool_id, (state, engine) in enumerate((s, e) for s in STATES for e in ENGINES):
+        balances, lp_tokens = STATES[state]
+        pools[f'{state}/{engine}'] = _pool(writer, wallet, program_id, pool_id, balances, lp_tokens, ENGINES[engine])
+        supply[MINT_USDC] += native(balances[1])
+        supply[MINT_USDT] += native(balances[2])
+    for name, m in (('usdc', MINT_USDC), ('usdt', MINT_USDT)):
+        writer.account(m, mint(wallet, supply[m]), TOKEN_PROGRAM_ID)
+        common[f'user_{name}_tkn_acc'] = writer.account(
+            _address(wallet, m), token_account(m, wallet, WALLET_TOKENS), TOKEN_PROGRAM_ID)
+
+    manifest_cases = []
+    base = _cases()
+    cached = [(f'{name.rpartition("/")[0]}/cached/{state}', instruction, state, args)
+              for name, instruction, state, args in base if name in CACHED]
+    if len(cached) != len(CACHED):
+        raise ValueError('A cached case is not a case.')
+    for name, instruction, state, args in base+cached:
+        repeat = 2 if '/cached/' in name else 1
+        for engine, fixed_point in ENGINES.items():
+            accounts = {**common, **pools[f'{state}/{engine}']}
+            if instruction in ('swap', 'quote'):
+                accounts = _swap_accounts(accounts, args[0], args[1])
+                expected = name.split('/')[2] not in REJECTED if name.startswith('swap/trade_') else True
+                if instruction == 'swap' and _executes([args]*repeat, state, fixed_point) != expected:
+                    raise ValueError(f'{name}/{engine}: the trade no longer takes its branch.')
+            if instruction == 'multi_swap' and not _executes(MULTI_SWAP_LEGS[:args[0]], state, fixed_point):
+                raise ValueError(f'{name}/{engine}: a leg is rejected.')
+            manifest_cases.append({'name': f'{name}/{engine}', 'instruction': instruction, 'args': args,
+                                   'accounts': accounts, 'repeat': repeat})
+
+    manifest = {'program_id': program_id, 'wallet': wallet, 'pools': pools, 'cases': manifest_cases}
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def wallet_address(keypair_path: str) -> str:
+    """Returns the address of a keypair file of the Solana CLI (64 bytes as a JSON array)."""
+    with open(os.path.expanduser(keypair_path)) as f:
+        return b58encode(bytes(json.load(f)[32:]))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m offchain.localnet', description='Local validator fixtures.')
+    parser.add_argument('directory')
+    parser.add_argument('--keypair', default='~/.config/solana/id.json', help='keypair file of the wallet')
+    parser.add_argument('--program-id', default=PROGRAM_ID)
+    parser.add_argument('--price-account-size', type=int, default=PRICE_ACCOUNT_DTYPE.itemsize,
+                        help='size of the price accounts, if the oracle program expects larger ones')
+    args = parser.parse_args(argv)
+    manifest = write_fixtures(args.directory, wallet_address(args.keypair), args.program_id,
+                              price_account_size=args.price_account_size)
+    print(f'{len(os.listdir(os.path.join(args.directory, "accounts")))} accounts and {len(manifest["cases"])} cases '
+          f'written to {args.directory}.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# oamm
+# Off-chain floating-point operation counts.
+#
+# On-chain, f64 arithmetic is emulated in software, so the compute units of the
+# math follow the number of float operations, not the time CPython spends. This
+# module runs an instrumented copy of lib/math.py and lib/fast_math.py: their
+# sources are compiled again with every float literal wrapped in F, a float
+# whose operators count themselves, and every float argument is passed as an F,
+# so every float operation of the math is counted, including those between
+# constants. Counts are attributed to the call path of lib functions they happen
+# in (e.g. trade_i > check_trade_imbalance_ratios > imbalance_ratios_after_trade),
+# as add, sub, mul, div, pow (** only, FAST_MATH off), cmp, neg, floor, cast
+# (f64 to an integer type), array (arrays created) and copy (list(...) copies).
+#
+# COSTS weighs them into an estimate of compute units: rough costs of the
+# soft-float routines on BPF, to be calibrated against the units measured by
+# tests/cu.sh. They predict the effect of a change on the math's share of an
+# instruction's units, and show which branch is expensive, without deploying:
+#
+#   python -m offchain.opcount 'trade_i/*' --paths
+#   python -m offchain.opcount --save --compare main
+
+import argparse
+import ast
+import fnmatch
+import math
+import os
+import sys
+import types
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import lib.log
+import lib.math
+from offchain import bench
+from seahorse.prelude import Array, array
+
+OPS = ('add', 'sub', 'mul', 'div', 'pow', 'cmp', 'neg', 'floor', 'cast', 'array', 'copy')
+
+# Estimated compute units per operation.
+COSTS = {
+    'add': 60.0, 'sub': 60.0, 'mul': 75.0, 'div': 160.0, 'pow': 2500.0, 'cmp': 25.0, 'neg': 2.0,
+    'floor': 50.0, 'cast': 30.0, 'array': 12.0, 'copy': 12.0,
+}
+
+_FILENAME = '<opcount {}>'
+
+# Counts of the running profile, by call path.
+_counts: Optional[Dict[Tuple[str, ...], Counter]] = None
+_stack = []
+
+
+def _count(op: str) -> None:
+    if _counts is not None:
+        _counts[tuple(_stack)][op] += 1
+
+
+def _binary(op: str, method: Callable) -> Callable:
+    def f(self, other):
+        result = method(self, other)
+        if result is NotImplemented:
+            return result
+        _count(op)
+        return F(result) if type(result) is float else result
+    return f
+
+
+def _compare(method: Callable) -> Callable:
+    def f(self, other):
+        _count('cmp')
+        return method(self, other)
+    return f
+
+
+class F(float):
+    """A float whose operations are counted."""
+
+    __slots__ = ()
+    __hash__ = float.__hash__
+
+    __add__ = _binary('add', float.__add__)
+    __radd__ = _binary('add', float.__radd__)
+    __sub__ = _binary('sub', float.__sub__)
+    __rsub__ = _binary('sub', float.__rsub__)
+    __mul__ = _binary('mul', float.__mul__)
+    __rmul__ = _binary('mul', float.__rmul__)
+    __truediv__ = _binary('div', float.__truediv__)
+    __rtruediv__ = _binary('div', float.__rtruediv__)
+    __pow__ = _binary('pow', float.__pow__)
+    __rpow__ = _binary('pow', float.__rpow__)
+    __lt__ = _compare(float.__lt__)
+    __le__ = _compare(float.__le__)
+    __gt__ = _compare(float.__gt__)
+    __ge__ = _compare(float.__ge__)
+    __eq__ = _compare(float.__eq__)
+    __ne__ = _compare(float.__ne__)
+
+    def __neg__(self):
+        _count('neg')
+        return F(float.__neg__(self))
+
+    def __abs__(self):
+        _count('neg')
+        return F(float.__abs__(self))
+
+    def __int__(self):
+        _count('cast')
+        return float.__int__(self)
+
+
+def _floor(x):
+    # Seahorse's floor of an f64 is an f64.
+    _count('floor')
+    return F(math.floor(float(x)))
+
+
+def _array(*elements):
+    _count('array')
+    return array(*elements)
+
+
+def _copy(iterable):
+    _count('copy')
+    return list(iterable)
+
+
+class _Literals(ast.NodeTransformer):
+
+    def visit_Constant(self, node):
+        if type(node.value) is float:
+            return ast.copy_location(ast.Call(ast.Name('F', ast.Load()), [node], []), node)
+        return node
+
+    def visit_UnaryOp(self, node):
+        # A negative literal is a constant, not a negation.
+        if isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant) and type(node.operand.value) is float:
+            return self.visit_Constant(ast.copy_location(ast.Constant(-node.operand.value), node))
+        return self.generic_visit(node)
+
+
+def _instrument(module: types.ModuleType) -> types.ModuleType:
+    with open(module.__file__) as f:
+        tree = ast.fix_missing_locations(_Literals().visit(ast.parse(f.read())))
+    clone = types.ModuleType(module.__name__)
+    clone.__file__ = module.__file__
+    clone.F = F
+    saved = sys.modules[module.__name__]
+    sys.modules[module.__name__] = clone
+    try:
+        exec(compile(tree, _FILENAME.format(module.__name__), 'exec'), clone.__dict__)
+    finally:
+        sys.modules[module.__name__] = saved
+    clone.__dict__.update(floor=_floor, array=_array, list=_copy)
+    return clone
+
+
+_modules: Dict[bool, types.ModuleType] = {}
+
+
+def instrumented(fast_math: Optional[bool] = None) -> types.ModuleType:
+    """Returns the instrumented copy of lib.math, with FAST_MATH set to fast_math (by default, the
+    current value of lib.math.FAST_MATH)."""
+    fast_math = lib.math.FAST_MATH if fast_math is None else fast_math
+    if fast_math not in _modules:
+        fast = _instrument(sys.modules['lib.fast_math'])
+        saved = sys.modules['lib.fast_math']
+        sys.modules['lib.fast_math'] = fast
+        try:
+            _modules[fast_math] = _instrument(lib.math)
+        finally:
+            sys.modules['lib.fast_math'] = saved
+        _modules[fast_math].FAST_MATH = fast_math
+    return _modules[fast_math]
+
+
+def _wrap(x: Any) -> Any:
+    if type(x) is float:
+        return F(x)
+    if isinstance(x, Array):
+        return Array(_wrap(v) for v in x)
+    return x
+
+
+def _profiler(frame, event, arg):
+    if frame.f_code.co_filename.startswith('<opcount'):
+        if event == 'call':
+            _stack.append(frame.f_code.co_name)
+            _counts[tuple(_stack)]['call'] += 1
+        elif event == 'return':
+            _stack.pop()
+
+
+def profile(function: str, *args, fast_math: Optional[bool] = None) -> Tuple[Any, Dict[Tuple[str, ...], Counter]]:
+    """Calls the function of lib.math named function with args on the instrumented math. Returns
+    its result and the operation counts by call path (a tuple of function names, outermost
+    first). The 'call' count of a path is the number of calls of its last function."""
+    global _counts
+    f = getattr(instrumented(fast_math), function)
+    _counts = defaultdict(Counter)
+    counts = _counts
+    sys.setprofile(_profiler)
+    try:
+        result = f(*(_wrap(a) for a in args))
+    finally:
+        sys.setprofile(None)
+        _counts = None
+        _stack.clear()
+    return result, dict(counts)
+
+
+def by_function(counts: Dict[Tuple[str, ...], Counter], inclusive: bool = True) -> Dict[str, Counter]:
+    """Aggregates counts by function: every operation counts for each function of its path if
+    inclusive, else only for the innermost one."""
+    result = defaultdict(Counter)
+    for path, ops in counts.items():
+        for name in (set(path) if inclusive else path[-1:]):
+            result[name].update(ops)
+    return dict(result)
+
+
+def total(counts: Dict[Tuple[str, ...], Counter]) -> Counter:
+    """Returns the operation counts of all paths together."""
+    result = Counter()
+    for ops in counts.values():
+        result.update(ops)
+    return result
+
+
+def cost(ops: Counter, costs: Dict[str, float] = COSTS) -> float:
+    """Returns the estimated compute units of operation counts."""
+    return sum(n*costs.get(op, 0.0) for op, n in ops.items())
+
+
+def run(patterns: Sequence[str] = (), fast_math: Optional[bool] = None) -> Dict[str, Dict[Tuple[str, ...], Counter]]:
+    """Profiles the cases of offchain/bench.py whose names match one of the glob patterns (all by
+    default), at the log level of the benchmarks."""
+    level = lib.log.LOG_LEVEL
+    lib.log.LOG_LEVEL = bench.LOG_LEVEL
+    try:
+        return {case.name: profile(case.function.__name__, *case.args, fast_math=fast_math)[1]
+                for case in bench.cases()
+                if not patterns or any(fnmatch.fnmatch(case.name, p) for p in patterns)}
+    finally:
+        lib.log.LOG_LEVEL = level
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m offchain.opcount',
+                                     description='Floating-point operation counts of lib.math.')
+    parser.add_argument('patterns', nargs='*', help='glob patterns of the benchmark cases, e.g. "trade_i/*"')
+    parser.add_argument('--paths', action='store_true', help='break the counts down by call path')
+    parser.add_argument('--fast-math', action='store_true', help='profile with FAST_MATH on')
+    parser.add_argument('--save', action='store_true', help='save the estimated units as those of the current commit')
+    parser.add_argument('--compare', metavar='REF', help='compare with the estimated units saved for a commit')
+    parser.add_argument('--dir', help='directory of the saved estimates (default: .benchmarks/ops)')
+    args = parser.parse_args(argv)
+
+    directory = args.dir or os.path.join(bench.results_dir(), 'ops')
+    baseline = bench.load(args.compare, directory) if args.compare else {}
+    profiles = run(args.patterns, True if args.fast_math else None)
+    estimates = {}
+    for name, counts in profiles.items():
+        ops = total(counts)
+        estimates[name] = cost(ops)
+        line = f'{name:<50} {estimates[name]:9.0f} CU  ' + ' '.join(f'{op}={ops[op]}' for op in OPS if ops[op])
+        if name in baseline:
+            line += f'  {estimates[name]-baseline[name]:+.0f} CU'
+        sys.stdout.write(line+'\n')
+        if args.paths:
+            for path, ops in sorted(counts.items()):
+                sys.stdout.write(f'    {" > ".join(path):<70} {cost(ops):9.0f} CU  '
+                                 + ' '.join(f'{op}={ops[op]}' for op in ('call',)+OPS if ops[op])+'\n')
+    if args.save:
+        sys.stdout.write(f'Saved to {bench.save(estimates, directory)}\n')
+    regressions = bench.compare(estimates, baseline, 0.0)
+    for name, before, after in regressions:
+        sys.stdout.write(f'Regression: {name} {before:.0f} CU -> {after:.0f} CU\n')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+# oamm
+# Off-chain Pyth oracle stand-in.
+#
+# Replays a recorded price history (the price files of offchain/backtest.py) to
+# the price accounts of a local validator, so that the program reads moving
+# prices without network access, e.g. under load tests. The price accounts of
+# the fixtures (offchain/localnet.py) list the wallet as their publisher, and
+# the oracle program is loaded on the validator at PYTH_PROGRAM_ID (dumped once
+# from devnet, see tests/localnet.sh). Every price of the history is sent as an
+# upd_price transaction signed by the wallet, updating the three feeds, at its
+# time divided by the replay speed from the start of the replay.
+#
+# The oracle takes at most one update per slot, and aggregates it on the first
+# update of a later slot, so the program sees a price about a slot after it is
+# sent. When the history is faster than the slots, the prices that are overtaken
+# before they can be sent are skipped. Transactions are signed and sent with
+# the standard library only (ed25519 of RFC 8032 and the JSON RPC API):
+#
+#   python -m offchain.oracle prices.csv --speed 60
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import time
+import urllib.request
+from typing import Any, Iterable, Optional, Sequence, Tuple
+
+from offchain.backtest import PRICE_DTYPE, Price, read_binary, read_prices_csv
+from offchain.localnet import _D, _P, CLOCK_SYSVAR_ID, b58decode, b58encode
+from offchain.pyth import EXPONENT, FEEDS, PYTH_PROGRAM_ID, upd_price_data
+
+_L = 2**252+27742317777372353535851937790883648493
+_I = pow(2, (_P-1)//4, _P)
+
+
+def _recover_x(y: int, sign: int) -> int:
+    x2 = (y*y-1)*pow(_D*y*y+1, _P-2, _P) % _P
+    x = pow(x2, (_P+3)//8, _P)
+    if (x*x-x2) % _P:
+        x = x*_I % _P
+    return _P-x if x & 1 != sign else x
+
+
+_BY = 4*pow(5, _P-2, _P) % _P
+_B = (_recover_x(_BY, 0), _BY, 1, _recover_x(_BY, 0)*_BY % _P)
+
+
+def _add(p: Tuple[int, ...], q: Tuple[int, ...]) -> Tuple[int, ...]:
+    # Addition in extended coordinates (X, Y, Z, T), x = X/Z, y = Y/Z, x*y = T/Z.
+    a = (p[1]-p[0])*(q[1]-q[0]) % _P
+    b = (p[1]+p[0])*(q[1]+q[0]) % _P
+    c = 2*p[3]*q[3]*_D % _P
+    d = 2*p[2]*q[2] % _P
+    e, f, g, h = b-a, d-c, d+c, b+a
+    return e*f % _P, g*h % _P, f*g % _P, e*h % _P
+
+
+def _multiply(s: int, p: Tuple[int, ...]) -> Tuple[int, ...]:
+    q = (0, 1, 1, 0)
+    while s:
+        if s & 1:
+            q = _add(q, p)
+        p = _add(p, p)
+        s >>= 1
+    return q
+
+
+def _compress(p: Tuple[int, ...]) -> bytes:
+    z = pow(p[2], _P-2, _P)
+    x, y = p[0]*z % _P, p[1]*z % _P
+    return (y | (x & 1) << 255).to_bytes(32, 'little')
+
+
+def _sha512(*parts: bytes) -> int:
+    return int.from_bytes(hashlib.sha512(b''.join(parts)).digest(), 'little')
+
+
+class Keypair:
+    """An ed25519 keypair, as in the keypair files of the Solana CLI (the 32-byte secret seed
+    followed by the public key)."""
+
+    def __init__(self, seed: bytes):
+        h = hashlib.sha512(seed).digest()
+        self._scalar = int.from_bytes(h[:32], 'little') & (2**254-8) | 2**254
+        self._prefix = h[32:]
+        self.public_key = _compress(_multiply(self._scalar, _B))
+
+    @classmethod
+    def read(cls, path: str) -> 'Keypair':
+        with open(os.path.expanduser(path)) as f:
+            return cls(bytes(json.load(f)[:32]))
+
+    @property
+    def address(self) -> str:
+        return b58encode(self.public_key)
+
+    def sign(self, message: bytes) -> bytes:
+        r = _sha512(self._prefix, message) % _L
+        R = _compress(_multiply(r, _B))
+        k = _sha512(R, self.public_key, message) % _L
+        return R+((r+k*self._scalar) % _L).to_bytes(32, 'little')
+
+
+def _compact(n: int) -> bytes:
+    # The compact-u16 length prefix of the wire format.
+    out = bytearray()
+    while True:
+        if n < 0x80:
+            out.append(n)
+            return bytes(out)
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+
+
+def upd_price_transaction(keypair: Keypair, prices: Sequence[float], pub_slot: int, blockhash: str,
+                          conf: float = 0.0, expo: int = EXPONENT) -> bytes:
+    """Returns a signed transaction publishing prices (in token order, to the feeds of FEEDS) at
+    pub_slot, with the keypair as publisher and fee payer."""
+    feeds = list(FEEDS.values())
+    # Writable signer, writable price accounts, then the read-only clock and program.
+    keys = [keypair.public_key]+[b58decode(feed) for feed in feeds]+[b58decode(CLOCK_SYSVAR_ID),
+                                                                     b58decode(PYTH_PROGRAM_ID)]
+    program, clock = len(keys)-1, len(keys)-2
+    instructions = b''.join(
+        bytes([program])+_compact(3)+bytes([0, 1+i, clock])+_compact(len(data))+data
+        for i, data in enumerate(upd_price_data(price, conf, pub_slot, expo) for price in prices))
+    message = (bytes([1, 0, 2])+_compact(len(keys))+b''.join(keys)+b58decode(blockhash)
+               + _compact(len(prices))+instructions)
+    return _compact(1)+keypair.sign(message)+message
+
+
+class Rpc:
+    """A client of the JSON RPC API of a validator."""
+
+    def __init__(self, url: str = 'http://127.0.0.1:8899'):
+        self.url = url
+        self._id = 0
+
+    def call(self, method: str, *params: Any) -> Any:
+        self._id += 1
+        request = urllib.request.Request(
+            self.url, json.dumps({'jsonrpc': '2.0', 'id': self._id, 'method': method, 'params': list(params)}).encode(),
+            {'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            reply = json.load(response)
+        if 'error' in reply:
+            raise RuntimeError(f'{method}: {reply["error"].get("message", reply["error"])}')
+        return reply['result']
+
+    def slot(self) -> int:
+        return self.call('getSlot', {'commitment': 'processed'})
+
+    def blockhash(self) -> str:
+        return self.call('getLatestBlockhash', {'commitment': 'processed'})['value']['blockhash']
+
+    def send(self, transaction: bytes) -> str:
+        return self.call('sendTransaction', base64.b64encode(transaction).decode(),
+                         {'encoding': 'base64', 'skipPreflight': True})
+
+
+class Replay:
+    """Publishes prices to the feeds of a local validator, at most one update per slot."""
+
+    def __init__(self, rpc: Rpc, keypair: Keypair, conf: float = 0.0, expo: int = EXPONENT):
+        self.rpc = rpc
+        self.keypair = keypair
+        self.conf = conf
+        self.expo = expo
+        self.published = 0
+        self.skipped = 0
+        self._slot = -1
+
+    def publish(self, prices: Sequence[float]) -> str:
+        """Sends an update of the feeds to prices, waiting for a slot later than the previous
+        update's. Returns the transaction signature."""
+        slot = self.rpc.slot()
+        while slot <= self._slot:
+            time.sleep(0.05)
+            slot = self.rpc.slot()
+        signature = self.rpc.send(
+            upd_price_transaction(self.keypair, prices, slot, self.rpc.blockhash(), self.conf, self.expo))
+        self._slot = slot
+        self.published += 1
+        return signature
+
+    def run(self, prices: Iterable[Price], speed: float = 1.0) -> None:
+        """Publishes every price of a stream at its time divided by speed from the start (as fast as
+        the slots allow if speed is 0), skipping the prices overtaken by the next one."""
+        start = t0 = None
+        stream = iter(prices)
+        current = next(stream, None)
+        while current is not None:
+            following = next(stream, None)
+            if start is None:
+                start, t0 = time.monotonic(), current.time
+            if speed > 0:
+                if following is not None and start+(following.time-t0)/speed <= time.monotonic():
+                    self.skipped += 1
+                    current = following
+                    continue
+                time.sleep(max(0.0, start+(current.time-t0)/speed-time.monotonic()))
+            self.publish(current.price)
+            current = following
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m offchain.oracle',
+                                     description='Replays a price history to the Pyth feeds of a local validator.')
+    parser.add_argument('prices', help='price file (.csv, or binary PRICE_DTYPE records)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='time units of the history per second (0: one price per slot)')
+    parser.add_argument('--conf', type=float, default=0.0, help='confidence interval of the prices')
+    parser.add_argument('--loop', action='store_true', help='replay the history again when it ends')
+    parser.add_argument('--url', default='http://127.0.0.1:8899')
+    parser.add_argument('--keypair', default='~/.config/solana/id.json', help='keypair file of the publisher')
+    args = parser.parse_args(argv)
+
+    replay = Replay(Rpc(args.url), Keypair.read(args.keypair), args.conf)
+    print(f'Publishing as {replay.keypair.address} to {args.url}.')
+    try:
+        while True:
+            replay.run(read_prices_csv(args.prices) if args.prices.endswith('.csv')
+                       else read_binary(args.prices, PRICE_DTYPE), args.speed)
+            if not args.loop:
+                break
+    except KeyboardInterrupt:
+        pass
+    print(f'{replay.published} updates published, {replay.skipped} prices skipped.')
+
+
+if __name__ == '__main__':
+    main()
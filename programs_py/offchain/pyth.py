@@ -0,0 +1,133 @@
+# oamm
+# Off-chain Pyth price accounts.
+#
+# The layout of a Pyth v2 price account (the account behind a price feed, 3312
+# bytes) as a NumPy record, and an encoder for it. The program only checks the
+# key of a price account (validate_price_feed) and then reads it with the Pyth
+# SDK, which checks the magic number, the version and the account type, so an
+# account of this layout stored at a feed's devnet address (see FEEDS) stands in
+# for the real feed on a local validator.
+#
+# A price account can list a publisher, whose upd_price instructions to the
+# oracle program (loaded on the validator at PYTH_PROGRAM_ID) move the price:
+# the oracle aggregates the latest prices of the publishers on the first update
+# of every slot. offchain/oracle.py replays price histories this way.
+
+import time
+from typing import Optional
+
+import numpy as np
+
+# Oracle program of devnet, which owns the price accounts.
+PYTH_PROGRAM_ID = 'gSbePebfvPy7tRqimPoVecS2UsBvYv46ynrzWocc92s'
+
+# Devnet price accounts of the feeds passed to the instructions, in token order.
+FEEDS = {
+    'devnet-SOL/USD': 'J83w4HKfqxwcq3BEMMkPFSppX3gqekLyLJBexebFVkix',
+    'devnet-USDC/USD': '5SSkXsEKQepHHAewytPVwdej4epN1nxgLVM84L4KXgy7',
+    'devnet-USDT/USD': '38xoQ4oeJCBrcVvca2cGk7iV1dAfrmTR1kmhSCJQ8Jto',
+}
+
+MAGIC = 0xa1b2c3d4
+VERSION = 2
+ACCOUNT_TYPE_PRICE = 3
+PRICE_TYPE_PRICE = 1
+STATUS_TRADING = 1
+EXPONENT = -8
+COMMAND_UPD_PRICE = 7
+
+UPD_PRICE_DTYPE = np.dtype([
+    ('version', '<u4'),
+    ('command', '<i4'),
+    ('status', '<u4'),
+    ('unused', '<u4'),
+    ('price', '<i8'),
+    ('conf', '<u8'),
+    ('pub_slot', '<u8'),
+])
+
+PRICE_INFO_DTYPE = np.dtype([
+    ('price', '<i8'),
+    ('conf', '<u8'),
+    ('status', '<u4'),
+    ('corp_act', '<u4'),
+    ('pub_slot', '<u8'),
+])
+
+COMPONENT_DTYPE = np.dtype([
+    ('publisher', 'V32'),
+    ('agg', PRICE_INFO_DTYPE),
+    ('latest', PRICE_INFO_DTYPE),
+])
+
+PRICE_ACCOUNT_DTYPE = np.dtype([
+    ('magic', '<u4'),
+    ('ver', '<u4'),
+    ('atype', '<u4'),
+    ('size', '<u4'),
+    ('ptype', '<u4'),
+    ('expo', '<i4'),
+    ('num', '<u4'),
+    ('num_qt', '<u4'),
+    ('last_slot', '<u8'),
+    ('valid_slot', '<u8'),
+    # Rationals: value, numerator, denominator.
+    ('ema_price', '<i8', (3,)),
+    ('ema_conf', '<i8', (3,)),
+    ('timestamp', '<i8'),
+    ('min_pub', 'u1'),
+    ('drv2', 'u1'),
+    ('drv3', '<u2'),
+    ('drv4', '<u4'),
+    ('product', 'V32'),
+    ('next', 'V32'),
+    ('prev_slot', '<u8'),
+    ('prev_price', '<i8'),
+    ('prev_conf', '<u8'),
+    ('prev_timestamp', '<i8'),
+    ('agg', PRICE_INFO_DTYPE),
+    ('comp', COMPONENT_DTYPE, (32,)),
+])
+
+
+def price_account(price: float, conf: float = 0.0, slot: int = 0, timestamp: Optional[int] = None,
+                  expo: int = EXPONENT, publisher: Optional[bytes] = None) -> np.void:
+    """Returns a trading price account whose aggregate (and previous and EMA) price is price, with
+    confidence conf, published at slot and timestamp (now by default), and optionally publisher (a
+    32-byte key) as its only publisher."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    p = round(price*10.0**-expo)
+    c = round(conf*10.0**-expo)
+    account = np.zeros((), dtype=PRICE_ACCOUNT_DTYPE)
+    account['magic'] = MAGIC
+    account['ver'] = VERSION
+    account['atype'] = ACCOUNT_TYPE_PRICE
+    account['size'] = PRICE_ACCOUNT_DTYPE.itemsize
+    account['ptype'] = PRICE_TYPE_PRICE
+    account['expo'] = expo
+    account['last_slot'] = account['valid_slot'] = account['prev_slot'] = slot
+    account['ema_price'] = (p, p, 1)
+    account['ema_conf'] = (c, c, 1)
+    account['timestamp'] = account['prev_timestamp'] = timestamp
+    account['min_pub'] = 1
+    account['prev_price'] = p
+    account['prev_conf'] = c
+    account['agg'] = (p, c, STATUS_TRADING, 0, slot)
+    if publisher is not None:
+        account['num'] = 1
+        account['comp'][0] = (np.void(publisher), account['agg'], account['agg'])
+    return account[()]
+
+
+def encode_price_account(account: np.void, size: int = PRICE_ACCOUNT_DTYPE.itemsize) -> bytes:
+    """Returns the account data of a PRICE_ACCOUNT_DTYPE record, padded with zeros to size bytes
+    (for oracle versions with larger accounts)."""
+    return np.asarray(account, dtype=PRICE_ACCOUNT_DTYPE).tobytes().ljust(size, b'\0')
+
+
+def upd_price_data(price: float, conf: float = 0.0, pub_slot: int = 0, expo: int = EXPONENT) -> bytes:
+    """Returns the data of an upd_price instruction publishing price with confidence conf at
+    pub_slot, which must be later than the publisher's previous update."""
+    return np.array(
+        (VERSION, COMMAND_UPD_PRICE, STATUS_TRADING, 0, round(price*10.0**-expo), round(conf*10.0**-expo), pub_slot),
+        dtype=UPD_PRICE_DTYPE).tobytes()
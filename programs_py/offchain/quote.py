@@ -0,0 +1,89 @@
+# oamm
+# Off-chain quotes.
+#
+# quote() prices a swap against a decoded oamm account with the same lib code
+# as the swap instruction (lib.fixed_point.swap_quote, which follows the pool's
+# engine), so no transaction is needed and nothing contends with real swaps.
+# The quote instruction computes the same values on-chain, with the pool and
+# config accounts read-only, and logs them as a QuoteEvent; read_quotes decodes
+# them from the logs of a simulated transaction like the PoolEvents in
+# offchain/indexer.py.
+
+import hashlib
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+import numpy as np
+
+from lib.fixed_point import swap_quote
+from offchain.indexer import decode_event
+from seahorse.prelude import array
+
+QUOTE_DISCRIMINATOR = hashlib.sha256(b'event:QuoteEvent').digest()[:8]
+
+QUOTE_DTYPE = np.dtype([
+    ('pool', 'V32'),
+    ('token_in', 'u1'),
+    ('token_out', 'u1'),
+    ('amount_in', '<f8'),
+    ('amount_out', '<f8'),
+    ('protocol_fee', '<f8'),
+    ('fee', '<f8'),
+    ('leverage', '<f8'),
+    ('ratio_in', '<f8'),
+    ('ratio_out', '<f8'),
+    ('execute_trade', '?'),
+])
+
+
+class Quote(NamedTuple):
+    """What a swap of token_in for token_out would do. ratio_in and ratio_out are the imbalance
+    ratios of the two tokens after the trade (before it if it cannot be executed)."""
+    token_in: int
+    token_out: int
+    amount_in: float
+    amount_out: float
+    protocol_fee: float
+    fee: float
+    leverage: float
+    ratio_in: float
+    ratio_out: float
+    execute_trade: bool
+
+
+PARAMS = ('base_fee', 'protocol_fee', 'base_leverage', 'delta')
+
+
+def quote(pool, params, prices, i: int, o: int, amount: float, exact_in: bool = True) -> Quote:
+    """Quotes a swap of token i for token o, where amount goes in (exact_in) or out.
+
+    pool is a decoded oamm account (anything with 'balances' and 'lp_tokens'
+    items), params the pool's parameters (a decoded oamm_config account, or
+    anything with its fields as attributes, e.g. a PoolInfo from
+    offchain.registry) and prices the three oracle prices.
+    """
+    if not (0 <= i < 3 and 0 <= o < 3 and i != o):
+        raise ValueError('Invalid pair of tokens.')
+    if isinstance(params, np.void):
+        fixed_point, values = bool(params['fixed_point']), [float(params[name]) for name in PARAMS]
+    else:
+        fixed_point, values = bool(params.fixed_point), [float(getattr(params, name)) for name in PARAMS]
+    amount_in, amount_out, protocol_fee, fee, leverage, ratio_in, ratio_out, execute_trade = swap_quote(
+        fixed_point, i, o, float(amount), exact_in,
+        array(*(float(x) for x in pool['balances'])), array(*(float(x) for x in pool['lp_tokens'])),
+        array(*(float(x) for x in prices)), *values)
+    return Quote(
+        int(i), int(o), float(amount_in), float(amount_out), float(protocol_fee), float(fee), float(leverage),
+        float(ratio_in), float(ratio_out), bool(execute_trade))
+
+
+def read_quotes(lines: Iterable[str], pool: Optional[bytes] = None) -> Iterator[Quote]:
+    """Yields the QuoteEvents found in a stream of log lines (e.g. the logs of a simulated quote
+    transaction), optionally only those of one pool."""
+    for line in lines:
+        event = decode_event(line, QUOTE_DTYPE, QUOTE_DISCRIMINATOR)
+        if event is not None and (pool is None or event['pool'].tobytes() == pool):
+            yield Quote(
+                int(event['token_in']), int(event['token_out']), float(event['amount_in']),
+                float(event['amount_out']), float(event['protocol_fee']), float(event['fee']),
+                float(event['leverage']), float(event['ratio_in']), float(event['ratio_out']),
+                bool(event['execute_trade']))
@@ -0,0 +1,125 @@
+# oamm
+# Off-chain pool registry.
+#
+# Keeps every pool created by the program's factory in memory, indexed by the
+# unordered pair of mints it trades, so that a router finds the candidate pools
+# for a pair with one dict lookup instead of scanning the program's accounts.
+# Pools are added from the PoolCreated events that create_pool emits (decoded
+# like the PoolEvents in offchain/indexer.py), or directly with add(), e.g.
+# from a getProgramAccounts snapshot taken once at startup. Keys are the raw 32
+# bytes of a Pubkey; the methods that take keys also accept base58 strings.
+
+import hashlib
+from itertools import combinations
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+import numpy as np
+
+from offchain.indexer import decode_event
+
+CREATED_DISCRIMINATOR = hashlib.sha256(b'event:PoolCreated').digest()[:8]
+
+CREATED_DTYPE = np.dtype([
+    ('pool', 'V32'),
+    ('pool_id', '<u8'),
+    ('config', 'V32'),
+    ('mints', 'V32', (3,)),
+    ('base_fee', '<f8'),
+    ('protocol_fee', '<f8'),
+    ('base_leverage', '<f8'),
+    ('delta', '<f8'),
+    ('fixed_point', '?'),
+])
+
+_B58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+Key = Union[bytes, str]
+
+
+def b58encode(key: bytes) -> str:
+    """Returns the base58 encoding of a key, as printed by Solana tools."""
+    n = int.from_bytes(key, 'big')
+    digits = ''
+    while n:
+        n, r = divmod(n, 58)
+        digits = _B58[r]+digits
+    return '1'*(len(key)-len(key.lstrip(b'\0')))+digits
+
+
+def b58decode(key: str) -> bytes:
+    """Returns the 32 bytes of a base58-encoded key."""
+    n = 0
+    for c in key:
+        n = n*58+_B58.index(c)
+    return n.to_bytes(32, 'big')
+
+
+def _key(key: Key) -> bytes:
+    return b58decode(key) if isinstance(key, str) else bytes(key)
+
+
+class PoolInfo(NamedTuple):
+    """A pool as recorded by create_pool."""
+    pool: bytes
+    pool_id: int
+    config: bytes
+    mints: Tuple[bytes, ...]
+    base_fee: float
+    protocol_fee: float
+    base_leverage: float
+    delta: float
+    fixed_point: bool
+
+
+def read_pools(lines: Iterable[str]) -> Iterator[PoolInfo]:
+    """Yields the pools created in a stream of log lines, skipping everything else."""
+    for line in lines:
+        event = decode_event(line, CREATED_DTYPE, CREATED_DISCRIMINATOR)
+        if event is not None:
+            yield PoolInfo(
+                event['pool'].tobytes(), int(event['pool_id']), event['config'].tobytes(),
+                tuple(m.tobytes() for m in event['mints']), float(event['base_fee']),
+                float(event['protocol_fee']), float(event['base_leverage']), float(event['delta']),
+                bool(event['fixed_point']))
+
+
+def pair(mint_a: Key, mint_b: Key) -> Tuple[bytes, bytes]:
+    """Returns the index key of an unordered pair of mints."""
+    a, b = _key(mint_a), _key(mint_b)
+    return (a, b) if a <= b else (b, a)
+
+
+class PoolRegistry:
+    """The pools of the program, by key and by pair of mints."""
+
+    def __init__(self):
+        self.pools: Dict[bytes, PoolInfo] = {}
+        self._by_pair: Dict[Tuple[bytes, bytes], List[PoolInfo]] = {}
+
+    def add(self, info: PoolInfo) -> None:
+        """Adds a pool under every pair of its mints. Adding a pool twice has no effect."""
+        if info.pool in self.pools:
+            return
+        self.pools[info.pool] = info
+        for a, b in combinations(sorted(set(info.mints)), 2):
+            self._by_pair.setdefault((a, b), []).append(info)
+
+    def consume(self, lines: Iterable[str]) -> 'PoolRegistry':
+        """Adds every pool created in a stream of log lines, e.g. follow(path)."""
+        for info in read_pools(lines):
+            self.add(info)
+        return self
+
+    def candidates(self, mint_a: Key, mint_b: Key) -> List[PoolInfo]:
+        """Returns the pools that trade mint_a for mint_b, in order of creation."""
+        return list(self._by_pair.get(pair(mint_a, mint_b), ()))
+
+    def get(self, pool: Key) -> PoolInfo:
+        """Returns the pool with the given key."""
+        return self.pools[_key(pool)]
+
+    def __contains__(self, pool: Key) -> bool:
+        return _key(pool) in self.pools
+
+    def __len__(self) -> int:
+        return len(self.pools)
@@ -0,0 +1,70 @@
+# oamm
+# Off-chain parameter sweep.
+#
+# Runs the same price and order history (binary files of PRICE_DTYPE and
+# ORDER_DTYPE records, see offchain/backtest.py; CSV files are converted once
+# with write_binary) through a backtest for every combination of pool
+# parameters, in a pool of worker processes. The history is never pickled:
+# every worker maps the two files into memory once, so all processes read the
+# same pages of the OS cache, and a task only carries its parameters. Results
+# come back as one row of RESULT_DTYPE per combination.
+
+import itertools
+import multiprocessing
+from typing import Iterable, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from offchain.backtest import ORDER_DTYPE, PRICE_DTYPE, Backtest, Summary, merge, records
+
+
+class Params(NamedTuple):
+    base_fee: float
+    protocol_fee: float
+    base_leverage: float
+    delta: float
+
+
+RESULT_DTYPE = np.dtype(
+    [(name, '<f8') for name in Params._fields]
+    + [(name, '<i8' if Summary.__annotations__[name] is int else '<f8') for name in Summary._fields]
+    + [('rejection_rate', '<f8')]
+)
+
+
+def grid(base_fee: Sequence[float], protocol_fee: Sequence[float], base_leverage: Sequence[float], delta: Sequence[float]) -> List[Params]:
+    """Returns every combination of the given parameter values."""
+    return [Params(*p) for p in itertools.product(base_fee, protocol_fee, base_leverage, delta)]
+
+
+# History of the worker process, mapped by _init_worker.
+_prices: Optional[np.ndarray] = None
+_orders: Optional[np.ndarray] = None
+_setup: dict = {}
+
+
+def _init_worker(prices_path: str, orders_path: str, setup: dict) -> None:
+    global _prices, _orders, _setup
+    _prices = np.memmap(prices_path, dtype=PRICE_DTYPE, mode='r')
+    _orders = np.memmap(orders_path, dtype=ORDER_DTYPE, mode='r')
+    _setup = setup
+
+
+def _run(params: Params) -> tuple:
+    summary = Backtest(*params, **_setup).run(merge(records(_prices), records(_orders)))
+    attempted = summary.trades+summary.rejected_trades
+    return (*params, *summary, summary.rejected_trades/attempted if attempted else 0.0)
+
+
+def sweep(prices_path: str, orders_path: str, params: Iterable[Params], processes: Optional[int] = None,
+          fixed_point: bool = False, balances: Sequence[float] = (0.0, 0.0, 0.0),
+          lp_tokens: Sequence[float] = (0.0, 0.0, 0.0)) -> np.ndarray:
+    """Backtests every set of parameters over the same history, on processes workers (one per
+    core by default), starting from the given pool state. Returns one row of RESULT_DTYPE per set
+    of parameters, in order: the parameters, the fields of the backtest's Summary (LP P&L,
+    volume served, ...) and the fraction of trades rejected."""
+    params = [Params(*p) for p in params]
+    setup = {'fixed_point': fixed_point, 'balances': tuple(balances), 'lp_tokens': tuple(lp_tokens)}
+    with multiprocessing.Pool(processes, _init_worker, (prices_path, orders_path, setup)) as pool:
+        rows = pool.map(_run, params, chunksize=max(1, len(params)//(4*(processes or multiprocessing.cpu_count()))))
+    return np.array(rows, dtype=RESULT_DTYPE)
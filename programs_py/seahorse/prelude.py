@@ -1,8 +1,12 @@
 # seahorse.prelude: the basis for writing Seahorse programs.
 #
-# NOTE: this file just contains types and documentation for your editor. This
-# is NOT executable code, and you won't be able to change the behavior of your
-# Seahorse programs by editing this file.
+# NOTE: the stubs in this file just contain types and documentation for your
+# editor. The Seahorse compiler does not read them, and you won't be able to
+# change the behavior of your Seahorse programs by editing this file.
+#
+# The "Host runtime" section at the bottom of the file gives the stubs that
+# lib/math.py relies on a real implementation, so the on-chain math can be
+# imported and executed by plain CPython (quoting, risk, simulations).
 
 from typing import *
 from math import floor, ceil
@@ -660,6 +664,13 @@ class Enum:
 class Pubkey:
     """32-byte account identifier."""
 
+    def __init__(self, key: str):
+        """
+        Pubkey literal. The key is decoded at compile time, so comparing an account's key() to it is a 32-byte compare.
+
+        @param key: The base58-encoded key, as a string literal.
+        """
+
 class AccountWithKey:
     """Generic Solana account."""
 
@@ -855,3 +866,39 @@ def size(ob: str) -> u64:
     
     @param ob: The object to get the size of.
     """
+
+
+# ============
+# Host runtime
+# ============
+#
+# Everything above is what your editor sees. When this module is imported by
+# CPython the definitions below replace the stubs, so that code written
+# against the prelude (e.g. lib/math.py) runs off-chain unchanged. Integer
+# types are plain ints (no overflow emulation) and f64 is the native float,
+# which is IEEE-754 binary64 exactly like the on-chain f64.
+# The program's print calls (msg! logs on-chain) are Python's print: their
+# level is LOG_LEVEL of lib/log.py, which off-chain code can set directly.
+
+if not TYPE_CHECKING:
+    u8 = u16 = u32 = u64 = u128 = int
+    i8 = i16 = i32 = i64 = i128 = int
+    f64 = float
+    # Pubkey literals are their base58 strings.
+    Pubkey = str
+
+    class Array(list):
+        """Host-side fixed-length array, backed by a list with no instance dict."""
+
+        __slots__ = ()
+
+        def __init__(self, iterable=(), len=None):
+            list.__init__(self, iterable)
+            if len is not None and list.__len__(self) != len:
+                raise ValueError(f'Array expected {len} elements, got {list.__len__(self)}.')
+
+    def array(*elements):
+        return Array(elements)
+
+    def instruction(function):
+        return function
@@ -0,0 +1,60 @@
+# Fixtures shared by the tests of the pool math: the pool parameters most tests
+# use, the arguments of the math functions for a pool, and random pools.
+
+import math
+import random
+
+import pytest
+
+from seahorse.prelude import array
+
+# Base fee, protocol fee, base leverage parameter and delta.
+PARAMS = (0.003, 0.5, 100.0, 0.25)
+
+
+def pool_args(b, l, p, params=PARAMS):
+    """Returns the arguments of the math functions that follow the amount: the balances, LP token
+    supplies and prices as arrays, then the pool parameters."""
+    return (array(*b), array(*l), array(*p), *params)
+
+
+def random_pools(n, seed, balances=(10.0, 1000.0), prices=(0.5, 30.0), log=False, lp_spread=0.2,
+                 empty_in=0.1, empty_out=0.0, no_lp_out=0.0):
+    """Yields n random pools as (rng, i, o, b, l, p), with the generator to draw the rest of a case
+    from. Balances and prices are uniform in their ranges (log-uniform if log), and LP token supplies
+    within lp_spread of the balances. Token i has no balance, token o no balance and token o no LP
+    tokens with the probabilities empty_in, empty_out and no_lp_out."""
+    rng = random.Random(seed)
+
+    def draw(low, high):
+        if log:
+            return 10**rng.uniform(math.log10(low), math.log10(high))
+        return rng.uniform(low, high)
+
+    for _ in range(n):
+        i, o = rng.sample(range(3), 2)
+        b = [draw(*balances) for _ in range(3)]
+        l = [x*rng.uniform(1.0-lp_spread, 1.0+lp_spread) for x in b]
+        p = [draw(*prices) for _ in range(3)]
+        if rng.random() < empty_in:
+            b[i] = 0.0
+        if rng.random() < empty_out:
+            b[o] = 0.0
+        if rng.random() < no_lp_out:
+            l[o] = 0.0
+        yield rng, i, o, b, l, p
+
+
+@pytest.fixture
+def params():
+    return PARAMS
+
+
+@pytest.fixture(name='pool_args')
+def pool_args_fixture():
+    return pool_args
+
+
+@pytest.fixture(name='random_pools')
+def random_pools_fixture():
+    return random_pools
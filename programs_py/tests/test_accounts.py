@@ -0,0 +1,32 @@
+# Checks the account decoder of offchain/accounts.py on malformed data.
+
+import numpy as np
+import pytest
+
+from offchain.accounts import OAMM_DTYPE, decode_pools, encode_pool
+
+
+def pools(n):
+    result = np.zeros(n, OAMM_DTYPE)
+    result['balances'] = np.arange(3*n, dtype=float).reshape(n, 3)
+    return result
+
+
+def test_separate_accounts_with_trailing_bytes():
+    data = [encode_pool(pool)+b'\0'*k for k, pool in enumerate(pools(3))]
+    assert (decode_pools(data)['balances'] == pools(3)['balances']).all()
+
+
+def test_short_account_is_rejected():
+    data = [encode_pool(pool) for pool in pools(3)]
+    data[1] = data[1][:-1]
+    with pytest.raises(ValueError):
+        decode_pools(data)
+
+
+def test_buffer_of_partial_account_is_rejected():
+    data = b''.join(encode_pool(pool) for pool in pools(3))
+    assert len(decode_pools(data)) == 3
+    for extra in (data[:-1], data+b'\0'):
+        with pytest.raises(ValueError):
+            decode_pools(extra)
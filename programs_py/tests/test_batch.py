@@ -0,0 +1,65 @@
+# Checks offchain/batch.py against the scalar trade functions of lib.math: the
+# same amounts, protocol fees and decisions, bit for bit, with FAST_MATH on and
+# off, on random pools with empty balances and LP token supplies.
+
+import math
+
+import numpy as np
+import pytest
+
+import lib.log
+import lib.math as m
+from offchain.batch import trade_i_batch, trade_o_batch
+
+
+def same(x, y):
+    return x == y or (x != x and y != y)
+
+
+def trades(random_pools, n, seed):
+    """Yields n random trades (i, o, amount, b, l, p) where any balance, LP token supply or price
+    can also be zero."""
+    for rng, i, o, b, l, p in random_pools(n, seed, empty_out=0.1, no_lp_out=0.1):
+        for x in (b, l, p):
+            if rng.random() < 0.1:
+                x[rng.randrange(3)] = 0.0
+        yield i, o, 10**rng.uniform(-3, 3), b, l, p
+
+
+@pytest.fixture
+def math_settings():
+    saved = m.FAST_MATH, lib.log.LOG_LEVEL
+    # The batch functions do not log.
+    lib.log.LOG_LEVEL = lib.log.LOG_OFF
+    yield
+    m.FAST_MATH, lib.log.LOG_LEVEL = saved
+
+
+@pytest.mark.parametrize('fast', [True, False])
+@pytest.mark.parametrize('scalar,batch', [(m.trade_i, trade_i_batch), (m.trade_o, trade_o_batch)])
+def test_batch_matches_scalar(math_settings, random_pools, pool_args, params, fast, scalar, batch):
+    m.FAST_MATH = fast
+    cases = list(trades(random_pools, 2000, 7))
+    i, o, a, b, l, p = (list(x) for x in zip(*cases))
+    result = batch(i, o, a, np.array(b), np.array(l), np.array(p), *params)
+    failures = 0
+    for k in range(len(cases)):
+        got = (float(result[0][k]), float(result[1][k]), bool(result[2][k]))
+        try:
+            expected = scalar(i[k], o[k], a[k], *pool_args(b[k], l[k], p[k]))
+        except ZeroDivisionError:
+            # The batch reports the failure of the trade.
+            assert math.isnan(got[0]) and math.isnan(got[1]) and not got[2], k
+            failures += 1
+            continue
+        assert got[2] == expected[2] and same(got[0], expected[0]) and same(got[1], expected[1]), k
+    assert failures
+
+
+@pytest.mark.parametrize('scalar,batch', [(m.trade_i, trade_i_batch), (m.trade_o, trade_o_batch)])
+@pytest.mark.parametrize('b,p', [((100.0, 2000.0, 2000.0), (0.0, 0.0, 0.0)), ((0.0, 0.0, 0.0), (20.0, 1.0, 1.0))])
+def test_empty_pool_matches_scalar(math_settings, pool_args, params, scalar, batch, b, p):
+    # B is 0, so pool_metrics leaves the weights and imbalance ratios at 0.0 instead of dividing.
+    l = (100.0, 2000.0, 2000.0)
+    result = batch([0], [1], [1.0], np.array(b), np.array(l), np.array(p), *params)
+    assert (float(result[0][0]), float(result[1][0]), bool(result[2][0])) == scalar(0, 1, 1.0, *pool_args(b, l, p))
@@ -0,0 +1,164 @@
+# Checks the fixed-point engine against the error bounds stated in the header
+# of lib/fixed_point.py, over the range of pools stated there, and its
+# behaviour at the limits of u128 arithmetic, where the program must reject
+# instead of panicking.
+
+import random
+from decimal import Decimal, localcontext
+
+import pytest
+
+from lib import fixed_point as fp
+from seahorse.prelude import array
+
+def q(x):
+    # Both engines and the exact reference are evaluated on the same 9-decimal inputs.
+    return round(x*1e9)/1e9
+
+
+@pytest.fixture
+def states(random_pools):
+    def states(n, seed):
+        """Yields random pools over the range of the header of lib/fixed_point.py, as (rng, i, o, b,
+        lp, p, params), with no balance of token i one time in ten."""
+        for rng, i, o, b, lp, p in random_pools(n, seed, balances=(1.0, 1e5), prices=(0.1, 1000.0), log=True,
+                                                lp_spread=0.3):
+            params = (q(rng.uniform(0, 0.05)), q(rng.uniform(0, 1)), q(10**rng.uniform(0, 3)),
+                      q(rng.uniform(0.05, 0.5)))
+            yield rng, i, o, [q(x) for x in b], [q(x) for x in lp], [q(x) for x in p], params
+    return states
+
+
+def amounts(rng, balance):
+    # Half relative to the balance of token o, half from 0.01 to 10000 tokens.
+    if rng.random() < 0.5:
+        return q(balance*10**rng.uniform(-4, -0.3))
+    return q(10**rng.uniform(-2, 4))
+
+
+def exact_trade(i, o, amount, exact_in, b, lp, p, params):
+    """Returns the amount out (exact_in) or in and the protocol fee of a trade, to 50 digits."""
+    with localcontext() as context:
+        context.prec = 50
+        b, lp, p = [Decimal(x) for x in b], [Decimal(x) for x in lp], [Decimal(x) for x in p]
+        fee, protocol_fee, leverage, delta = [Decimal(x) for x in params]
+        amount = Decimal(amount)
+        B = sum(p[j]*b[j] for j in range(3))
+        L = sum(p[j]*lp[j] for j in range(3))
+        if b[i] == 0:
+            if exact_in:
+                return (1-fee)*amount*p[i]/p[o], protocol_fee*fee*amount
+            ai = amount*p[o]/p[i]/(1-fee)
+            return ai, protocol_fee*fee*ai
+        if lp[o] != 0:
+            ri, ro = b[i]/lp[i]*L/B, b[o]/lp[o]*L/B
+            fee, leverage = fee*ri**3/ro**3, leverage*ro**3/ri**3
+        bil, bol = b[i]*leverage, b[o]*leverage
+        wi, wo = p[i]*b[i]/B, p[o]*b[o]/B
+        if exact_in:
+            return bol*(1-(wi/wo*(bil/(bil+(1-fee)*amount)).ln()).exp()), protocol_fee*fee*amount
+        ai = bil/(1-fee)*((wo/wi*(bol/(bol-amount)).ln()).exp()-1)
+        return ai, protocol_fee*fee*ai
+
+
+def within(x, y, units, relative):
+    return abs(x-y) <= max(units*type(y)(1e-9), relative*abs(y))
+
+
+def test_trades_within_bound_of_exact(states, pool_args):
+    for rng, i, o, b, lp, p, params in states(3000, 3):
+        amount = amounts(rng, b[o])
+        for exact_in in (True, False):
+            state = pool_args(b, lp, p, params)
+            f = fp.swap_amounts(True, i, o, amount, exact_in, *state)
+            try:
+                assert f[3] == fp.swap_amounts(False, i, o, amount, exact_in, *state)[3]
+            except OverflowError:
+                # The power of the f64 engine overflows: ** raises on the host where it is inf
+                # on-chain, and the trade is rejected.
+                assert f[3] is False
+            if f[3]:
+                result, pr_fee = exact_trade(i, o, amount, exact_in, b, lp, p, params)
+                assert within(Decimal(f[1] if exact_in else f[0]), result, 16, Decimal('1e-9'))
+                assert within(Decimal(f[2]), pr_fee, 16, Decimal('1e-9'))
+
+
+def test_liquidity_agrees_with_f64(states, pool_args):
+    for rng, i, o, b, lp, p, params in states(2000, 4):
+        amount = q(10**rng.uniform(-2, 4))
+        f = fp.single_asset_deposit_amounts(True, i, amount, *pool_args(b, lp, p, ()))
+        g = fp.single_asset_deposit_amounts(False, i, amount, *pool_args(b, lp, p, ()))
+        assert within(f[0], g[0], 100, 1e-7)
+        lpt = q(lp[o]*rng.uniform(0.001, 1.2))
+        f = fp.single_asset_withdrawal_amounts(True, o, lpt, *pool_args(b, lp, p, params[3:]))
+        g = fp.single_asset_withdrawal_amounts(False, o, lpt, *pool_args(b, lp, p, params[3:]))
+        for j in range(3):
+            # 100 native units of token j or of token o, whichever is worth more.
+            assert within(f[0][j], g[0][j], 100*max(1.0, p[o]/p[j]), 1e-7)
+
+
+@pytest.mark.parametrize('fixed_point', [True, False])
+def test_trade_at_oracle_price_beyond_balance_is_rejected(params, fixed_point):
+    # No balance of token i, so the trade is priced at the oracle price: 1000 SOL buy 19980 USDC,
+    # more than the 100 in the pool.
+    result = fp.swap_amounts(fixed_point, 0, 1, 1000.0, True, array(0.0, 100.0, 2000.0),
+                             array(100.0, 2000.0, 2000.0), array(20.0, 1.0, 1.0), *params)
+    assert result[3] is False
+
+
+def test_imbalance_check_rejects_instead_of_underflowing():
+    b = fp.to_fixed_array(array(100.0, 100.0, 2000.0))
+    lp = fp.to_fixed_array(array(100.0, 2000.0, 2000.0))
+    p = fp.to_fixed_array(array(20.0, 1.0, 1.0))
+    B, L, W, R = fp.pool_metrics_fixed(b, lp, p)
+    # More of token 1 out than the pool holds, and more value out than the pool is worth.
+    assert not fp.check_trade_imbalance_ratios_fixed(B, L, R, b, lp, p, 0, 1, fp.ONE, 101*fp.ONE, 0, fp.to_fixed(0.25))
+    assert not fp.check_trade_imbalance_ratios_fixed(B, L, R, b, lp, p, 0, 2, fp.ONE, 4000*fp.ONE, 0, fp.to_fixed(0.25))
+
+
+@pytest.mark.parametrize('fixed_point', [True, False])
+def test_withdrawing_nothing_burns_nothing(fixed_point):
+    amounts, burn, n_amounts, n_burn = fp.single_asset_withdrawal_amounts(
+        fixed_point, 0, 0.0, array(100.0, 2000.0, 2000.0), array(100.0, 2000.0, 2000.0), array(20.0, 1.0, 1.0), 0.25)
+    assert list(amounts) == [0.0, 0.0, 0.0] and burn == 0.0
+    assert list(n_amounts) == [0, 0, 0] and n_burn == 0
+
+
+@pytest.mark.parametrize('ratio', [1, 18, 19, 100, 10**4])
+def test_cube_wad_does_not_overflow(ratio):
+    # x*x overflows a u128 above a ratio of 18.4, where mul_div divides the product in two halves.
+    x = ratio*fp.WAD+fp.WAD//3
+    assert fp.cube_wad(x) == (x*x//fp.WAD)*x//fp.WAD
+
+
+def test_mul_div_is_exact():
+    rng = random.Random(0)
+    for _ in range(5000):
+        a, b = rng.getrandbits(rng.randrange(1, 129)), rng.getrandbits(rng.randrange(1, 129))
+        c = rng.getrandbits(rng.randrange(1, 129)) or 1
+        if a*b//c <= fp.U128_MAX:
+            assert fp.mul_div(a, b, c) == a*b//c
+        else:
+            with pytest.raises(AssertionError):
+                fp.mul_div(a, b, c)
+
+
+def test_exact_out_beyond_u64_is_rejected():
+    # The power of trade_o_fixed leaves the u128 range: the amount in used to be scaled down to 0
+    # and rounded up to 1 native unit, for 399 of token 1 worth 79000 USD.
+    state = (array(2558.204487891, 22626.902083057, 76765.075123413),
+             array(2089.282673237, 24301.191812319, 69407.556892817), array(0.236751517, 197.809776301, 94.067259695),
+             0.014768567, 0.639258489, 6.204593602, 0.318096962)
+    result = fp.swap_amounts(True, 0, 1, 399.219941804, False, *state)
+    assert result[3] is False and result[4] == 0
+    assert fp.swap_quote(True, 0, 1, 399.219941804, False, *state)[7] is False
+    assert fp.swap_amounts(False, 0, 1, 399.219941804, False, *state)[3] is False
+
+
+@pytest.mark.parametrize('exact_in', [True, False])
+def test_protocol_fee_at_oracle_price_is_not_truncated(exact_in):
+    # protocol_fee*fee=0.000186562 (to 15 places) used to be truncated to 9 decimal places first.
+    state = (array(0.0, 16.894869322, 16.894869322), array(180.815035103, 20.0, 20.0), array(0.126316745, 1.0, 1.0),
+             0.00034736, 0.537079488, 84.248879738, 0.129278877)
+    ai, ao, pr_fee = fp.swap_amounts(True, 0, 1, 22.843486346 if exact_in else 2.8, exact_in, *state)[:3]
+    assert abs(pr_fee-0.537079488*0.00034736*ai) <= 1e-9
@@ -0,0 +1,52 @@
+# Checks lib.math and its batch counterpart in offchain/batch.py at the edges
+# of the trade branches.
+
+import numpy as np
+import pytest
+
+import lib.math as m
+from lib import fixed_point as fp
+from offchain.batch import trade_i_batch, trade_o_batch
+
+
+def test_trade_at_oracle_price_beyond_balance_is_rejected(pool_args, params):
+    # No balance of token i and no LP tokens of token o, so neither the curve nor the imbalance
+    # ratio of token o bounds the trade: 1000 SOL buy 19940 USDC, more than the 100 in the pool.
+    b, lp, p = (0.0, 100.0, 2000.0), (100.0, 0.0, 2000.0), (20.0, 1.0, 1.0)
+    assert m.trade_i(0, 1, 1000.0, *pool_args(b, lp, p)) == (0.0, 0.0, False)
+    ao, pr_fee, execute_trade = trade_i_batch([0], [1], [1000.0], np.array(b), np.array(lp), np.array(p), *params)
+    assert (ao[0], pr_fee[0], execute_trade[0]) == (0.0, 0.0, False)
+    # Within the balance, the trade goes through.
+    assert m.trade_i(0, 1, 4.0, *pool_args(b, lp, p))[2]
+
+
+@pytest.mark.parametrize('fast', [True, False])
+def test_exact_out_beyond_leveraged_balance_is_rejected(monkeypatch, pool_args, fast):
+    # The ratio of token 1 scales the leverage down to 0.235, so the curve holds 1.21 of token 2:
+    # 3.04 of the 5.16 in the pool used to take a power of a negative number (NaN on-chain,
+    # which passes the imbalance check).
+    monkeypatch.setattr(m, 'FAST_MATH', fast)
+    b, lp, p = (67.364049804, 67.017516571, 5.155481665), (72.917510042, 49.894847602, 6.361030916), \
+        (58.864213771, 11.975208672, 8.349509465)
+    params = (0.021248709, 0.535132741, 1.069593626, 0.423677489)
+    args = pool_args(b, lp, p, params)
+    assert m.trade_o(1, 2, 3.035910106, *args) == (0.0, 0.0, False)
+    assert fp.swap_amounts(True, 1, 2, 3.035910106, False, *args)[3] is False
+    ai, pr_fee, execute_trade = trade_o_batch([1], [2], [3.035910106], np.array(b), np.array(lp), np.array(p), *params)
+    assert (ai[0], pr_fee[0], execute_trade[0]) == (0.0, 0.0, False)
+    ai_max, ao_max = m.max_trade(1, 2, *args)
+    assert m.trade_o(1, 2, ao_max, *args)[2]
+
+
+@pytest.mark.parametrize('amount', [0.0, 1e-13])
+def test_trade_into_ratio_above_delta_is_rejected_however_small(pool_args, params, amount):
+    # The imbalance ratio of token 0 is 1.29, above 1+delta. A trade too small to move it in f64
+    # would pass check_imbalance_ratios, but it is rejected up front, as intended.
+    b, lp, p = (100.0, 2000.0, 2000.0), (70.0, 2000.0, 2000.0), (20.0, 1.0, 1.0)
+    args = pool_args(b, lp, p, params)
+    assert m.check_imbalance_ratios(*args[:3], 0, 1, 0.0, 0.0, 0.0, params[3])
+    assert m.trade_i(0, 1, amount, *args) == (0.0, 0.0, False)
+    assert m.trade_o(0, 1, 1e-13, *args) == (0.0, 0.0, False)
+    ao, pr_fee, execute_trade = trade_i_batch([0], [1], [amount], np.array(b), np.array(lp), np.array(p), *params)
+    assert (ao[0], pr_fee[0], execute_trade[0]) == (0.0, 0.0, False)
+    assert m.max_trade(0, 1, *args) == (0.0, 0.0)
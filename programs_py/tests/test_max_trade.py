@@ -0,0 +1,22 @@
+# Checks lib.math.max_trade against the trade functions: the limits it returns
+# are accepted and one step past them (a relative 1e-3) is rejected.
+
+import pytest
+
+import lib.math as m
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_limits_are_tight(random_pools, pool_args, seed):
+    for _, i, o, b, l, p in random_pools(1000, seed, no_lp_out=0.1):
+        args = pool_args(b, l, p)
+        ai, ao = m.max_trade(i, o, *args)
+        if ai == 0.0:
+            assert not m.trade_i(i, o, 1e-3, *args)[2]
+            continue
+        if ai > 0.0:
+            assert m.trade_i(i, o, ai, *args)[2]
+            assert not m.trade_i(i, o, ai*1.001, *args)[2]
+        if ao > 0.0:
+            assert m.trade_o(i, o, ao, *args)[2]
+            assert ao*1.001 >= b[o] or not m.trade_o(i, o, ao*1.001, *args)[2]
@@ -0,0 +1,28 @@
+# Checks the program's print and log level off-chain.
+
+import builtins
+
+import pytest
+
+import lib.log
+from lib.math import *
+from seahorse.prelude import array
+
+
+@pytest.fixture
+def log_level():
+    level = lib.log.LOG_LEVEL
+    yield
+    lib.log.LOG_LEVEL = level
+
+
+def test_star_import_keeps_print():
+    assert print is builtins.print
+
+
+@pytest.mark.parametrize('level, logged', [('LOG_OFF', False), ('LOG_SUMMARY', True), ('LOG_DEBUG', True)])
+def test_log_level_is_read_from_lib_log(log_level, capsys, level, logged):
+    lib.log.LOG_LEVEL = getattr(lib.log, level)
+    balances = array(100.0, 2000.0, 2000.0)
+    trade_i(0, 1, 1.0, balances, balances, array(20.0, 1.0, 1.0), 0.001, 0.5, 100.0, 0.25)
+    assert bool(capsys.readouterr().out) == logged
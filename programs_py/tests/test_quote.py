@@ -0,0 +1,23 @@
+# Checks offchain/quote.py on the kinds of parameters it takes.
+
+import numpy as np
+
+from offchain.accounts import CONFIG_DTYPE, decode_configs, encode_config
+from offchain.quote import quote
+from offchain.registry import PoolInfo
+
+POOL = {'balances': np.array([100.0, 2000.0, 2000.0]), 'lp_tokens': np.array([100.0, 2000.0, 2000.0])}
+PRICES = np.array([20.0, 1.0, 1.0])
+
+
+def test_decoded_config_matches_pool_info():
+    config = np.zeros((), CONFIG_DTYPE)
+    config['base_fee'], config['protocol_fee'], config['base_leverage'], config['delta'] = 0.001, 0.5, 100.0, 0.25
+    for fixed_point in (False, True):
+        config['fixed_point'] = fixed_point
+        info = PoolInfo(b'', 0, b'', (), 0.001, 0.5, 100.0, 0.25, fixed_point)
+        for exact_in in (True, False):
+            q = quote(POOL, decode_configs([encode_config(config)])[0], PRICES, 0, 1, 1.0, exact_in)
+            assert q.execute_trade
+            assert q == quote(POOL, info, PRICES, 0, 1, 1.0, exact_in)
+            assert [type(x) for x in q] == [int, int] + [float]*7 + [bool]
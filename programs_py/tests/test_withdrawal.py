@@ -0,0 +1,16 @@
+# Checks lib.math.single_asset_withdrawal: the payouts are worth the LP tokens
+# burnt, less what is left unpaid, and never negative or above the balances.
+
+import pytest
+
+import lib.math as m
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_payouts_conserve_value(random_pools, pool_args, params, seed):
+    for rng, _, o, b, l, p in random_pools(2000, seed, lp_spread=0.4, empty_in=0.0, empty_out=0.1):
+        lpt = l[o]*rng.uniform(0.01, 1.0)
+        out, ao, remaining = m.single_asset_withdrawal(o, lpt, *pool_args(b, l, p, params[3:]))
+        value = sum(out[j]*p[j] for j in range(3))/p[o]
+        assert abs(value-(ao-remaining)) <= 1e-7*max(1.0, ao)
+        assert all(0.0 <= out[j] <= b[j]*(1.0+1e-12) for j in range(3))
@@ -0,0 +1,24 @@
+#!/usr/bin/env bash
+# Measures the compute units of every instruction and branch (tests/cu.ts) on a local validator
+# loaded with the fixtures of programs_py/offchain/localnet.py, with the program built at
+# target/deploy/oamm.so and its IDL at target/idl/oamm.json. No network access is needed.
+set -euo pipefail
+cd "$(dirname "$0")/.."
+
+WALLET="${ANCHOR_WALLET:-$HOME/.config/solana/id.json}"
+URL=http://127.0.0.1:8899
+
+rm -rf .cu
+(cd programs_py && python -m offchain.localnet ../.cu --keypair "$WALLET")
+PROGRAM_ID=$(python -c "import json; print(json.load(open('.cu/manifest.json'))['program_id'])")
+
+solana-test-validator --reset --quiet --ledger .cu/ledger \
+  --mint "$(solana-keygen pubkey "$WALLET")" \
+  --bpf-program "$PROGRAM_ID" target/deploy/oamm.so \
+  --account-dir .cu/accounts &
+VALIDATOR=$!
+trap 'kill $VALIDATOR' EXIT
+until solana cluster-version -u "$URL" >/dev/null 2>&1; do sleep 1; done
+
+ANCHOR_PROVIDER_URL="$URL" ANCHOR_WALLET="$WALLET" \
+  yarn run ts-mocha -p ./tsconfig.json -t 1000000 tests/cu.ts
@@ -0,0 +1,96 @@
+import * as anchor from "@project-serum/anchor";
+import { assert } from "chai";
+import { execSync } from "child_process";
+import * as fs from "fs";
+import * as path from "path";
+
+const { ComputeBudgetProgram, PublicKey, Transaction } = anchor.web3;
+
+// Compute units consumed by every instruction and branch, on a local validator loaded with the
+// fixtures of programs_py/offchain/localnet.py (run through tests/cu.sh). Every case is simulated
+// against the fixture state, so the cases do not depend on each other. A case with a repeat count
+// sends its instruction that many times in one transaction and measures the last one. The units
+// consumed by the program (including its CPIs) are written to .benchmarks/cu/<commit>.json, or
+// CU_OUTPUT, in the format of programs_py/offchain/bench.py, which compares them between builds.
+
+const MANIFEST = process.env.CU_MANIFEST || ".cu/manifest.json";
+const IDL = process.env.CU_IDL || "target/idl/oamm.json";
+const MAX_UNITS = 1400000;
+
+const camel = (name: string) =>
+  name.replace(/_([a-z0-9])/g, (_, c: string) => c.toUpperCase());
+
+function commit(): string {
+  const sha = execSync("git rev-parse HEAD").toString().trim();
+  const dirty = execSync("git status --porcelain -- programs_py").toString().trim();
+  return dirty ? `${sha}-dirty` : sha;
+}
+
+(fs.existsSync(MANIFEST) ? describe : describe.skip)("compute units", () => {
+  const manifest = fs.existsSync(MANIFEST)
+    ? JSON.parse(fs.readFileSync(MANIFEST, "utf8"))
+    : { cases: [] };
+  const results: { [name: string]: number } = {};
+  let provider: anchor.AnchorProvider;
+  let idl: anchor.Idl;
+  let programId: anchor.web3.PublicKey;
+  let program: anchor.Program;
+  let payer: anchor.web3.Keypair;
+
+  before(() => {
+    provider = anchor.AnchorProvider.env();
+    anchor.setProvider(provider);
+    idl = JSON.parse(fs.readFileSync(IDL, "utf8"));
+    programId = new PublicKey(manifest.program_id);
+    program = new anchor.Program(idl, programId, provider);
+    payer = (provider.wallet as anchor.Wallet).payer;
+  });
+
+  for (const c of manifest.cases) {
+    it(c.name, async () => {
+      const available: { [name: string]: anchor.web3.PublicKey } = {};
+      for (const name of Object.keys(c.accounts)) {
+        available[camel(name)] = new PublicKey(c.accounts[name]);
+      }
+      const accounts: { [name: string]: anchor.web3.PublicKey } = {};
+      const ix = idl.instructions.find(
+        (ix) => camel(ix.name) === camel(c.instruction)
+      );
+      for (const account of ix.accounts) {
+        accounts[account.name] = available[camel(account.name)];
+      }
+
+      const instruction = await (program.methods as any)
+        [camel(c.instruction)](...c.args)
+        .accounts(accounts)
+        .instruction();
+      const tx = new Transaction().add(
+        ComputeBudgetProgram.setComputeUnitLimit({ units: MAX_UNITS }),
+        ...Array(c.repeat || 1).fill(instruction)
+      );
+      tx.feePayer = payer.publicKey;
+      const { value } = await provider.connection.simulateTransaction(tx, [payer]);
+      const logs = value.logs || [];
+      assert.isNull(value.err, logs.join("\n"));
+
+      // The last line of the program at depth 1 counts its CPIs too, and is that of the last
+      // instruction.
+      const consumed = logs
+        .map((line) => line.match(new RegExp(`^Program ${programId} consumed (\\d+) of`)))
+        .filter((match) => match !== null);
+      results[c.name] = Number(consumed[consumed.length - 1][1]);
+    });
+  }
+
+  after(() => {
+    const sha = commit();
+    const output = process.env.CU_OUTPUT || path.join(".benchmarks", "cu", `${sha}.json`);
+    fs.mkdirSync(path.dirname(output), { recursive: true });
+    fs.writeFileSync(output, JSON.stringify({ commit: sha, results }, null, 1));
+    const width = Math.max(0, ...Object.keys(results).map((name) => name.length));
+    for (const name of Object.keys(results)) {
+      console.log(`${name.padEnd(width)} ${String(results[name]).padStart(8)} CU`);
+    }
+    console.log(`Saved to ${output}`);
+  });
+});
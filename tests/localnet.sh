@@ -0,0 +1,26 @@
+#!/usr/bin/env bash
+# Runs a local validator for load tests: the program built at target/deploy/oamm.so, the fixtures
+# of programs_py/offchain/localnet.py and the Pyth oracle program, to which
+# programs_py/offchain/oracle.py replays a price history. The oracle program is dumped from devnet
+# to .localnet/pyth_oracle.so the first time (or read from PYTH_ORACLE); no network access is
+# needed afterwards. Extra arguments are passed to solana-test-validator.
+set -euo pipefail
+cd "$(dirname "$0")/.."
+
+WALLET="${ANCHOR_WALLET:-$HOME/.config/solana/id.json}"
+PYTH_PROGRAM_ID=$(cd programs_py && python -c "from offchain.pyth import PYTH_PROGRAM_ID; print(PYTH_PROGRAM_ID)")
+PYTH_ORACLE="${PYTH_ORACLE:-.localnet/pyth_oracle.so}"
+
+mkdir -p .localnet
+if [ ! -f "$PYTH_ORACLE" ]; then
+  solana program dump -u devnet "$PYTH_PROGRAM_ID" "$PYTH_ORACLE"
+fi
+rm -rf .localnet/accounts .localnet/manifest.json
+(cd programs_py && python -m offchain.localnet ../.localnet --keypair "$WALLET")
+PROGRAM_ID=$(python -c "import json; print(json.load(open('.localnet/manifest.json'))['program_id'])")
+
+exec solana-test-validator --reset --ledger .localnet/ledger \
+  --mint "$(solana-keygen pubkey "$WALLET")" \
+  --bpf-program "$PROGRAM_ID" target/deploy/oamm.so \
+  --bpf-program "$PYTH_PROGRAM_ID" "$PYTH_ORACLE" \
+  --account-dir .localnet/accounts "$@"